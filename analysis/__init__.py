@@ -1,15 +1,18 @@
-from .binarization import analyze_binarization, BinarizationResults
-from .optical_flow import analyze_optical_flow, FlowResults
-from .intensity_distribution import analyze_intensity_distribution, IntensityResults
+from .binarization import analyze_binarization, BinarizationAccumulator, BinarizationResults
+from .optical_flow import analyze_optical_flow, FlowAccumulator, FlowResults
+from .intensity_distribution import analyze_intensity_distribution, IntensityAccumulator, IntensityResults
 
 from .run import run_analysis_pipeline
 #test
 __all__ = [
     "analyze_binarization",
+    "BinarizationAccumulator",
     "BinarizationResults",
     "analyze_optical_flow",
+    "FlowAccumulator",
     "FlowResults",
     "analyze_intensity_distribution",
+    "IntensityAccumulator",
     "IntensityResults",
     "run_analysis_pipeline",
 ]
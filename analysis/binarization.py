@@ -1,67 +1,59 @@
 import os
 from typing import Tuple, Optional
 from itertools import pairwise, combinations
-import matplotlib.pyplot as plt
 import numpy as np
-from numpy.fft import fft2,ifft2,fftshift
-from scipy import ndimage
-from skimage.measure import label, regionprops_table
-from utils import average_largest, find_analysis_frames, vprint, flatten
-from utils.setup import setup_csv_writer
-from utils.binarization import invert_frame, binarize, sia_radial_average
+from scipy.spatial import cKDTree
+from utils import average_largest, find_analysis_frames, vprint, flatten, find_correlation_lengths
+from utils.setup import setup_rds_writer
+from utils.binarization import invert_frame, binarize, autocorrelation_profiles
+from utils.binarization import BinaryFrameLabels, label_binary_frame, region_areas, region_shape_properties, spans_frame
 from core import BinarizationConfig, ReaderConfig, WriterConfig, BinarizationResults
+from utils.reader import FrameSource
+from utils.render import PlotPayload, render_figure
 
-def check_span(frame: np.ndarray):
-    def check_connected(frame: np.ndarray, axis: int = 0):
-        # Ensures that either connected across left-right or up-down axis
-        if not axis in [0, 1]:
-            raise Exception("Axis must be 0 or 1.")
-    
-        struct = ndimage.generate_binary_structure(2, 2)
-        frame_connections, _ = ndimage.label(input=frame, structure=struct)
-    
-        if axis == 0:
-            labeled_first = np.unique(frame_connections[0,:])
-            labeled_last = np.unique(frame_connections[-1,:])
-        if axis == 1:
-            labeled_first = np.unique(frame_connections[:,0])
-            labeled_last = np.unique(frame_connections[:,-1])
-    
-        labeled_first = set(labeled_first[labeled_first != 0])
-        labeled_last = set(labeled_last[labeled_last != 0])
-        return 1 if labeled_first.intersection(labeled_last) else 0
-    return (check_connected(frame, axis = 0) or check_connected(frame, axis = 1))
-
-def find_largest_void(frame: np.ndarray):
-    eval_frame = invert_frame(frame)
-    labeled, a = label(eval_frame, connectivity= 2, return_num =True) # identify the regions of connectivity 2
-    if a == 0:
-        return frame.shape[0] * frame.shape[1]    
-    regions = regionprops_table(labeled, properties=["area"]) # determines the region properties of the labeled
-    region_areas = sorted(regions["area"], reverse = True)
-    largest_void = region_areas[0]
-    return largest_void # returns largest region(s) area
-
-
-def find_island_properties(frame: np.ndarray, bin_config: BinarizationConfig):
+# Maximum number of neighbor distances held in memory at once
+_NEIGHBOR_QUERY_SIZE = 1 << 22
+# Maximum size (bytes) of a batch of frames whose autocorrelations are computed together
+_AUTOCORRELATION_BATCH_BYTES = 1 << 26
+
+def check_span(labels: BinaryFrameLabels):
+    # Ensures that an island connects either the left-right or up-down edges
+    return spans_frame(labels.islands)
+
+def find_largest_void(labels: BinaryFrameLabels):
+    if labels.num_voids == 0:
+        return labels.voids.shape[0] * labels.voids.shape[1]
+    return float(region_areas(labels.voids, labels.num_voids).max()) # returns largest region(s) area
+
+
+def find_island_properties(labels: BinaryFrameLabels, bin_config: BinarizationConfig):
     def get_nearest_neighbors(islands: list[tuple], k:float):
+        # Mean distance from each island to its k_num + 1 nearest islands (itself included)
         k_num = int(np.ceil(k * len(islands)) - 1)
-        points = np.array(islands, dtype = np.dtype([('x', 'float'), ('y', 'float')]))
-        a, b = points.reshape(len(islands), 1), points.reshape(1, len(islands))
-        distances = ((a['x'] - b['x'])**2 + (a['y'] - b['y'])**2) ** (1/2)
-        nearest_distances = np.partition(distances, k_num + 1, axis = 1)[:, :k_num+1]
-        return np.nanmean(nearest_distances)
+        if k_num + 1 >= len(islands):
+            raise ValueError(f"Too few islands ({len(islands)}) to find {k_num + 1} nearest neighbors")
+        if k_num + 1 <= 0:
+            return np.nan
+        points = np.array(islands, dtype = float)
+        tree = cKDTree(points)
+        # Query in chunks so memory stays bounded when there are many islands
+        chunk_size = max(1, _NEIGHBOR_QUERY_SIZE // (k_num + 1))
+        distance_sum = 0.0
+        for start in range(0, len(points), chunk_size):
+            nearest_distances, _ = tree.query(points[start:start + chunk_size], k = k_num + 1, workers = -1)
+            distance_sum += np.sum(nearest_distances)
+        return distance_sum / (len(points) * (k_num + 1))
         
     def get_anisotropy_factor(major_axis_length, minor_axis_length):
         if major_axis_length and minor_axis_length:
             return major_axis_length/minor_axis_length
         else:
             return np.nan
-    labeled_frame, num_islands = label(frame, connectivity= 2, return_num =True)
+    num_islands = labels.num_islands
     if num_islands == 0:
         return [np.nan] * 6
 
-    regions = regionprops_table(labeled_frame, properties = ['label', 'area', 'centroid', 'axis_major_length', 'axis_minor_length'])
+    regions = region_shape_properties(labels.islands, num_islands)
     region_areas = sorted(regions['area'], reverse = True)
     total_island_area = sum(region_areas)
     mean_island_area = np.nanmean(region_areas)
@@ -75,11 +67,9 @@ def find_island_properties(frame: np.ndarray, bin_config: BinarizationConfig):
     mean_anisotropy = np.nanmean([get_anisotropy_factor(major, minor) for (major, minor) in major_minor_axes])
     return largest_island_area, second_largest_island_area, total_island_area, mean_island_area, mean_island_distance, mean_anisotropy
 
-def spatial_image_autocorrelation(frame: np.ndarray):
-    frame = (frame - np.mean(frame))/np.std(frame)
-    corr_image = np.real(fftshift(ifft2(fft2(frame)*np.conj(fft2(frame)))))/(frame.shape[0]*frame.shape[1])
-    radial_avg = sia_radial_average(corr_image)
-    return corr_image, radial_avg
+def spatial_image_autocorrelation(frame: np.ndarray, single_precision: bool = False):
+    corr_images, radial_avgs = autocorrelation_profiles(frame[None], return_images=True, single_precision=single_precision)
+    return corr_images[0], radial_avgs[0]
 
 def calculate_area_or_percentage(metric: float, img_dimensions: int, 
                                  convert_units: bool = False, um_pixel_ratio: float = None) -> Tuple[np.ndarray, float]:
@@ -90,152 +80,184 @@ def calculate_area_or_percentage(metric: float, img_dimensions: int,
     return metric_physical_units, metric_percentage
 
 
-def analyze_binarization(video: np.ndarray, name: str, bin_config: BinarizationConfig, in_config: ReaderConfig, out_config: WriterConfig) -> Tuple[Optional[plt.Figure], BinarizationResults]:
-    vprint('Beginning Binarization Analysis')
-    num_frames = len(video)
-    frame_step = bin_config.frame_step
-    threshold_offset = bin_config.threshold_offset
-    frame_eval_percent = bin_config.percentage_frames_evaluated
-    um_pixel_ratio = in_config.um_pixel_ratio
-    binning_factor = bin_config.bin_factor
-    convert_units = bin_config.enable_physical_units
-    
-    frame_indices, frame_step = find_analysis_frames(video, frame_step)
-
-    csvwriter, csvfile = None, None
-    scorr_csvwriter, scorr_csvfile = None, None
-    if out_config.save_rds:
-        from visualization import write_binarization_rds, write_correlation_rds
-        filename = os.path.join(name, 'BinarizationData.csv')
-        csvwriter, csvfile = setup_csv_writer(filename)
-        filename_scorr = os.path.join(name, 'StructuralImageAutocorrelation.csv')
-        scorr_csvwriter, scorr_csvfile = setup_csv_writer(filename_scorr)
-    if out_config.save_visualizations:
-        from visualization import save_binarization_visualization
-        from visualization import save_binarization_plots
-        from visualization import save_correlation_visualization
-        
-    void_area_lst = []
-    island_area_lst = []
-    island_area_lst2 = []
-    total_island_area_lst = []
-    mean_island_area_lst = []
-    mean_island_distance_lst = []
-    mean_anisotropy_lst = []
-    correlation_lengths = []
-    connected_lst = []
-
-    correlation_max = int(video.shape[1]/2 * binning_factor)
-    mid_point = frame_indices[int((len(frame_indices) - 1)/2)]
-    save_spots = np.array([0, mid_point, frame_indices[-1]])
-
-    #Test comment
-
-    for frame_idx in frame_indices:
-        frame = video[frame_idx]
-        image_autocorrelation, rad_avg = spatial_image_autocorrelation(frame)
-        new_frame = binarize(frame, threshold_offset, binning_factor)
+class BinarizationAccumulator:
+    """
+    Binarization analysis of one channel of a video, fed its sampled frames in order.
+
+    The frames to pass to add_frame are given by frame_indices. They are buffered into
+    batches of at most _AUTOCORRELATION_BATCH_BYTES, so the autocorrelation FFTs of a batch
+    are computed together, and finish() returns the figure and results of the analysis.
+    """
+
+    def __init__(self, video: FrameSource, channel: int, name: str, bin_config: BinarizationConfig,
+                 in_config: ReaderConfig, out_config: WriterConfig):
+        vprint('Beginning Binarization Analysis')
+        self.video = video
+        self.name = name
+        self.bin_config = bin_config
+        self.out_config = out_config
+        self.um_pixel_ratio = in_config.um_pixel_ratio
+        self.binning_factor = bin_config.bin_factor
+        self.single_precision = bin_config.single_precision_autocorrelation
+
+        self.frame_indices, self.frame_step = find_analysis_frames(video, bin_config.frame_step)
+
+        self.csvwriter, self.csvfile = None, None
+        self.scorr_csvwriter, self.scorr_csvfile = None, None
+        if out_config.save_rds:
+            filename = os.path.join(name, 'BinarizationData.csv')
+            self.csvwriter, self.csvfile = setup_rds_writer(filename, out_config)
+            filename_scorr = os.path.join(name, 'StructuralImageAutocorrelation.csv')
+            self.scorr_csvwriter, self.scorr_csvfile = setup_rds_writer(filename_scorr, out_config)
+
+        self.void_area_lst = []
+        self.island_area_lst = []
+        self.island_area_lst2 = []
+        self.total_island_area_lst = []
+        self.mean_island_area_lst = []
+        self.mean_island_distance_lst = []
+        self.mean_anisotropy_lst = []
+        self.correlation_profiles = []
+        self.connected_lst = []
+
+        self.correlation_max = int(video.height/2 * self.binning_factor)
+        mid_point = self.frame_indices[int((len(self.frame_indices) - 1)/2)]
+        self.save_spots = np.array([0, mid_point, self.frame_indices[-1]])
+        self.xvalues = None
+
+        self._batch_size = max(1, _AUTOCORRELATION_BATCH_BYTES // (video.height * video.width * 8))
+        self._batch_indices, self._batch_frames = [], []
+
+    def add_frame(self, frame_idx: int, frame: np.ndarray):
+        self._batch_indices.append(frame_idx)
+        self._batch_frames.append(frame)
+        if len(self._batch_indices) == self._batch_size:
+            self._process_batch()
+
+    def _process_batch(self):
+        batch_profiles = autocorrelation_profiles(np.stack(self._batch_frames), single_precision=self.single_precision)
+        for frame_idx, frame, rad_avg in zip(self._batch_indices, self._batch_frames, batch_profiles):
+            self._process_frame(frame_idx, frame, rad_avg)
+        self._batch_indices, self._batch_frames = [], []
+
+    def _process_frame(self, frame_idx: int, frame: np.ndarray, rad_avg: np.ndarray):
+        bin_config, out_config, name = self.bin_config, self.out_config, self.name
+        new_frame = binarize(frame, bin_config.threshold_offset, self.binning_factor)
         if bin_config.invert_binarization:
             new_frame = invert_frame(new_frame)
-        if frame_idx in save_spots and out_config.save_visualizations:
-            save_binarization_visualization(frame, new_frame, frame_idx, name)
-            save_correlation_visualization(image_autocorrelation, frame_idx, name, "Structural", 1, um_pixel_ratio)
+        if frame_idx in self.save_spots and out_config.save_visualizations:
+            from visualization import save_binarization_visualization, save_correlation_visualization
+            render_figure(save_binarization_visualization, frame, new_frame, frame_idx, name)
+            # The correlation image itself is only kept for the frames that are visualized
+            image_autocorrelation, _ = spatial_image_autocorrelation(frame, self.single_precision)
+            render_figure(save_correlation_visualization, image_autocorrelation, frame_idx, name, "Structural", 1, self.um_pixel_ratio)
 
         if out_config.save_rds:
-            write_binarization_rds(csvwriter, new_frame, frame_idx)
+            from visualization import write_binarization_rds
+            write_binarization_rds(self.csvwriter, new_frame, frame_idx)
 
-        max_void_area = find_largest_void(new_frame)
-        max_island_area, max_island_area2, total_island_area, mean_island_area, island_distance, anisotropy = find_island_properties(new_frame, bin_config)
-        rad_avg = rad_avg[:correlation_max]
-        xvalues = np.arange(len(rad_avg)) * um_pixel_ratio * binning_factor
-        
-        threshold = np.exp(-1)
-        correlation_length = np.nan
-        for i in range(len(rad_avg) - 1):
+        # Islands and voids are labeled once, and every property below is derived from those labels
+        labels = label_binary_frame(new_frame)
+        max_void_area = find_largest_void(labels)
+        max_island_area, max_island_area2, total_island_area, mean_island_area, island_distance, anisotropy = find_island_properties(labels, bin_config)
+        rad_avg = rad_avg[:self.correlation_max]
+        self.xvalues = np.arange(len(rad_avg)) * self.um_pixel_ratio * self.binning_factor
 
-            if rad_avg[i] > threshold and rad_avg[i+1] <= threshold:
+        if out_config.save_rds:
+            from visualization import write_correlation_rds
+            write_correlation_rds(self.scorr_csvwriter, frame_idx, self.xvalues.tolist(), rad_avg.tolist())
 
-                d1 = abs(rad_avg[i]   - threshold)
-                d2 = abs(rad_avg[i+1] - threshold)
+        self.void_area_lst.append(max_void_area)
+        self.island_area_lst.append(max_island_area)
+        self.island_area_lst2.append(max_island_area2)
+        self.total_island_area_lst.append(total_island_area)
+        self.mean_island_area_lst.append(mean_island_area)
+        self.mean_island_distance_lst.append(island_distance)
+        self.mean_anisotropy_lst.append(anisotropy)
+        self.connected_lst.append(check_span(labels))
+        self.correlation_profiles.append(rad_avg)
 
-                if d1 < d2:
-                    correlation_length = xvalues[i]
-                else:
-                    correlation_length = xvalues[i+1]
+    def close(self):
+        if self.csvfile:
+            self.csvfile.close()
+        if self.scorr_csvfile:
+            self.scorr_csvfile.close()
 
-                break
+    def finish(self) -> Tuple[Optional[PlotPayload], BinarizationResults]:
+        if self._batch_indices:
+            self._process_batch()
+        self.close()
 
+        video, bin_config = self.video, self.bin_config
+        um_pixel_ratio, binning_factor = self.um_pixel_ratio, self.binning_factor
+        convert_units = bin_config.enable_physical_units
+        void_area_lst, island_area_lst, island_area_lst2 = self.void_area_lst, self.island_area_lst, self.island_area_lst2
+        connected_lst = self.connected_lst
 
-        if out_config.save_rds:
-            write_correlation_rds(scorr_csvwriter, frame_idx, xvalues.tolist(), rad_avg.tolist())
-
-        void_area_lst.append(max_void_area)
-        island_area_lst.append(max_island_area)
-        island_area_lst2.append(max_island_area2)
-        total_island_area_lst.append(total_island_area)
-        mean_island_area_lst.append(mean_island_area)
-        mean_island_distance_lst.append(island_distance)
-        mean_anisotropy_lst.append(anisotropy)
-        connected_lst.append(check_span(new_frame))
-        correlation_lengths.append(correlation_length)
-
-    if csvfile:
-        csvfile.close()
-    if scorr_csvfile:
-        scorr_csvfile.close()
-    
-    correlation_lengths = np.array(correlation_lengths)
-    structural_correlation_flag = int(np.isnan(np.sum(correlation_lengths)))
-    mean_correlation_length = np.nanmean(correlation_lengths)
-
-    start_eval_index = int(np.ceil(len(void_area_lst)*frame_eval_percent))
-    final_eval_index = len(void_area_lst) - start_eval_index
-
-    void_size_initial = np.nanmean(void_area_lst[:start_eval_index])
-    void_percent_gain_list = np.array(void_area_lst)/void_size_initial
-    
-    island_size_initial = np.nanmean(island_area_lst[:start_eval_index])
-    island_size_initial2 = np.nanmean(island_area_lst2[:start_eval_index])
-    island_percent_gain_list = np.array(island_area_lst)/island_size_initial
-
-    fig = None
-    if out_config.save_visualizations:
-        fig = save_binarization_plots(void_percent_gain_list, island_percent_gain_list, num_frames, frame_step)
-
-    img_dims = video[0].shape[0] * video[0].shape[1] / (binning_factor ** 2)
-    
-    max_void_percent_change = np.nanmean(void_area_lst[final_eval_index:])/void_size_initial
-    void_size_initial_quantity, void_size_initial_percent = calculate_area_or_percentage(void_size_initial, img_dims, convert_units, um_pixel_ratio)
-    max_void_size_quantity, max_void_size_percent = calculate_area_or_percentage(average_largest(void_area_lst), img_dims, convert_units, um_pixel_ratio)
-    max_island_percent_change = np.nanmean(island_area_lst[final_eval_index:])/island_size_initial
-    island_size_initial_quantity, island_size_initial_percent = calculate_area_or_percentage(island_size_initial, img_dims, convert_units, um_pixel_ratio)
-    island_size_initial2_quantity, island_size_initial2_percent = calculate_area_or_percentage(island_size_initial2, img_dims, convert_units, um_pixel_ratio)    
-    max_island_size_quantity, max_island_size_percent = calculate_area_or_percentage(average_largest(island_area_lst), img_dims, convert_units, um_pixel_ratio)    
-    connectivity = len([connected for connected in connected_lst if connected == 1])/len(connected_lst)
-    mean_island_area_quantity, mean_island_area_percent = calculate_area_or_percentage(np.nanmean(mean_island_area_lst), img_dims, convert_units, um_pixel_ratio)
-    total_island_area_quantity, total_island_area_percent = calculate_area_or_percentage(np.nanmean(total_island_area_lst), img_dims, convert_units, um_pixel_ratio)
-    island_anisotropy = np.nanmean(mean_anisotropy_lst)
-    mean_island_distance = np.nanmean(mean_island_distance_lst) * um_pixel_ratio
-    results = BinarizationResults(
-        connectivity = connectivity, 
-        max_island_size = max_island_size_percent, 
-        max_void_size = max_void_size_percent,
-        max_island_percent_change = max_island_percent_change, 
-        max_void_percent_change = max_void_percent_change,
-        island_size_initial=island_size_initial_percent, 
-        island_size_initial2=island_size_initial2_percent,
-        island_anisotropy=island_anisotropy,
-        mean_island_size=mean_island_area_percent,
-        total_island_size=total_island_area_percent, 
-        mean_island_separation=mean_island_distance, 
-        island_correlation_length=mean_correlation_length,
-        max_island_size_quantity=max_island_size_quantity,
-        max_void_size_quantity=max_void_size_quantity,
-        island_size_initial_quantity=island_size_initial_quantity,
-        island_size_initial2_quantity=island_size_initial2_quantity,
-        mean_island_size_quantity=mean_island_area_quantity,
-        total_island_size_quantity=total_island_area_quantity,
-        structural_correlation_flag=structural_correlation_flag,
-    )
-
-    return fig, results
+        # Correlation length of every frame: where its profile first drops below 1/e
+        correlation_lengths = find_correlation_lengths(np.array(self.correlation_profiles), self.xvalues, np.exp(-1))
+        structural_correlation_flag = int(np.isnan(np.sum(correlation_lengths)))
+        mean_correlation_length = np.nanmean(correlation_lengths)
+
+        start_eval_index = int(np.ceil(len(void_area_lst)*bin_config.percentage_frames_evaluated))
+        final_eval_index = len(void_area_lst) - start_eval_index
+
+        void_size_initial = np.nanmean(void_area_lst[:start_eval_index])
+        void_percent_gain_list = np.array(void_area_lst)/void_size_initial
+
+        island_size_initial = np.nanmean(island_area_lst[:start_eval_index])
+        island_size_initial2 = np.nanmean(island_area_lst2[:start_eval_index])
+        island_percent_gain_list = np.array(island_area_lst)/island_size_initial
+
+        fig = None
+        if self.out_config.save_visualizations:
+            from visualization import save_binarization_plots
+            fig = PlotPayload(save_binarization_plots, (void_percent_gain_list, island_percent_gain_list, video.num_frames, self.frame_step))
+
+        img_dims = video.height * video.width / (binning_factor ** 2)
+
+        max_void_percent_change = np.nanmean(void_area_lst[final_eval_index:])/void_size_initial
+        void_size_initial_quantity, void_size_initial_percent = calculate_area_or_percentage(void_size_initial, img_dims, convert_units, um_pixel_ratio)
+        max_void_size_quantity, max_void_size_percent = calculate_area_or_percentage(average_largest(void_area_lst), img_dims, convert_units, um_pixel_ratio)
+        max_island_percent_change = np.nanmean(island_area_lst[final_eval_index:])/island_size_initial
+        island_size_initial_quantity, island_size_initial_percent = calculate_area_or_percentage(island_size_initial, img_dims, convert_units, um_pixel_ratio)
+        island_size_initial2_quantity, island_size_initial2_percent = calculate_area_or_percentage(island_size_initial2, img_dims, convert_units, um_pixel_ratio)
+        max_island_size_quantity, max_island_size_percent = calculate_area_or_percentage(average_largest(island_area_lst), img_dims, convert_units, um_pixel_ratio)
+        connectivity = len([connected for connected in connected_lst if connected == 1])/len(connected_lst)
+        mean_island_area_quantity, mean_island_area_percent = calculate_area_or_percentage(np.nanmean(self.mean_island_area_lst), img_dims, convert_units, um_pixel_ratio)
+        total_island_area_quantity, total_island_area_percent = calculate_area_or_percentage(np.nanmean(self.total_island_area_lst), img_dims, convert_units, um_pixel_ratio)
+        island_anisotropy = np.nanmean(self.mean_anisotropy_lst)
+        mean_island_distance = np.nanmean(self.mean_island_distance_lst) * um_pixel_ratio
+        results = BinarizationResults(
+            connectivity = connectivity, 
+            max_island_size = max_island_size_percent, 
+            max_void_size = max_void_size_percent,
+            max_island_percent_change = max_island_percent_change, 
+            max_void_percent_change = max_void_percent_change,
+            island_size_initial=island_size_initial_percent, 
+            island_size_initial2=island_size_initial2_percent,
+            island_anisotropy=island_anisotropy,
+            mean_island_size=mean_island_area_percent,
+            total_island_size=total_island_area_percent, 
+            mean_island_separation=mean_island_distance, 
+            island_correlation_length=mean_correlation_length,
+            max_island_size_quantity=max_island_size_quantity,
+            max_void_size_quantity=max_void_size_quantity,
+            island_size_initial_quantity=island_size_initial_quantity,
+            island_size_initial2_quantity=island_size_initial2_quantity,
+            mean_island_size_quantity=mean_island_area_quantity,
+            total_island_size_quantity=total_island_area_quantity,
+            structural_correlation_flag=structural_correlation_flag,
+        )
+
+        return fig, results
+
+
+def analyze_binarization(video: FrameSource, channel: int, name: str, bin_config: BinarizationConfig, in_config: ReaderConfig, out_config: WriterConfig) -> Tuple[Optional[PlotPayload], BinarizationResults]:
+    accumulator = BinarizationAccumulator(video, channel, name, bin_config, in_config, out_config)
+    try:
+        for frame_idx in accumulator.frame_indices:
+            accumulator.add_frame(frame_idx, video.get_frame(frame_idx, channel))
+        return accumulator.finish()
+    finally:
+        accumulator.close()
@@ -1,71 +1,123 @@
 import os
-from typing import Tuple, List, Optional
+from typing import Tuple, Optional
 
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy.stats import kurtosis
 
 from core import IntensityDistributionConfig, WriterConfig, IntensityResults
 from utils import vprint, average_largest, find_analysis_frames
-from utils.intensity_distribution import (
-    frame_mode, median_skewness, mode_skewness, kurtosis, histogram)
-from utils.setup import setup_csv_writer
-
-def analyze_intensity_distribution(video: np.ndarray, name: str, id_config: IntensityDistributionConfig, out_config: WriterConfig) -> Tuple[Optional[plt.Figure], IntensityResults]:
-    vprint('Beginning Intensity Distribution Analysis')
-    step_size = id_config.frame_step
-    frame_eval_percent = id_config.percentage_frames_evaluated
-    bin_number = id_config.bin_size
-    noise_threshold = id_config.noise_threshold
-    frame_indices = find_analysis_frames(video, step_size)[0]
-    num_frames_analysis = int(np.ceil(frame_eval_percent * len(frame_indices)))
-
-    csvwriter, csvfile = None, None
-    if out_config.save_rds:
-        filename = os.path.join(name, 'IntensityDistribution.csv')
-        csvwriter, csvfile = setup_csv_writer(filename)
-
-    kurtosis_list = []
-    median_skewness_list = []
-    mode_skewness_list = []
-    flags = []
-
-    for frame_idx in frame_indices:
-        frame_data = video[frame_idx]
-        frame_counts, frame_values = histogram(frame_data, bin_number, noise_threshold)
+from utils.intensity_distribution import histogram_counts, histogram_moments, has_small_integer_type, normalize_counts, saturation_flags
+from utils.setup import setup_rds_writer
+from utils.reader import FrameSource
+from utils.render import PlotPayload
 
+# Maximum size (bytes) of the histograms of a batch of frames computed together
+_HISTOGRAM_BATCH_BYTES = 1 << 26
+
+class IntensityAccumulator:
+    """
+    Intensity distribution analysis of one channel of a video, fed its sampled frames in order.
+
+    The frames to pass to add_frame are given by frame_indices. Their histograms are computed
+    together in batches of at most _HISTOGRAM_BATCH_BYTES, and finish() returns the figure and
+    results of the analysis.
+    """
+
+    def __init__(self, video: FrameSource, channel: int, name: str, id_config: IntensityDistributionConfig, out_config: WriterConfig):
+        vprint('Beginning Intensity Distribution Analysis')
+        self.video = video
+        self.channel = channel
+        self.out_config = out_config
+        self.bin_number = id_config.bin_size
+        self.noise_threshold = id_config.noise_threshold
+        self.frame_indices = find_analysis_frames(video, id_config.frame_step)[0]
+        self.num_frames_analysis = int(np.ceil(id_config.percentage_frames_evaluated * len(self.frame_indices)))
+
+        self.csvwriter, self.csvfile = None, None
         if out_config.save_rds:
+            filename = os.path.join(name, 'IntensityDistribution.csv')
+            self.csvwriter, self.csvfile = setup_rds_writer(filename, out_config)
+
+        self.kurtosis_list = []
+        self.median_skewness_list = []
+        self.mode_skewness_list = []
+        self.flags = []
+
+        if self.bin_number > 1:
+            frame_bytes = 8 * max(video.height * video.width, self.bin_number)
+        elif has_small_integer_type(video.dtype):
+            frame_bytes = 8 * max(video.height * video.width, 1 << 16)
+        else:
+            # Every distinct intensity of the batch is a bin, so the histograms grow with the batch
+            frame_bytes = _HISTOGRAM_BATCH_BYTES
+        self._batch_size = max(1, _HISTOGRAM_BATCH_BYTES // frame_bytes)
+        self._batch_indices, self._batch_frames = [], []
+
+    def add_frame(self, frame_idx: int, frame: np.ndarray):
+        self._batch_indices.append(frame_idx)
+        self._batch_frames.append(frame)
+        if len(self._batch_indices) == self._batch_size:
+            self._process_batch()
+
+    def _process_batch(self):
+        batch_counts, batch_values = histogram_counts(np.stack(self._batch_frames), self.bin_number, self.noise_threshold)
+        moments = histogram_moments(batch_counts, batch_values)
+        self.kurtosis_list.append(moments.kurtosis)
+        self.median_skewness_list.append(moments.median_skewness)
+        self.mode_skewness_list.append(moments.mode_skewness)
+        self.flags.append(saturation_flags(batch_counts))
+
+        if self.out_config.save_rds:
             from visualization import write_intensity_distribution_rds
-            write_intensity_distribution_rds(csvwriter, frame_values, frame_counts, frame_idx)
+            for frame_idx, frame_counts, frame_values in zip(self._batch_indices, batch_counts, batch_values):
+                # Bins below the noise threshold have zero counts
+                kept = frame_counts > 0
+                write_intensity_distribution_rds(self.csvwriter, frame_values[kept], normalize_counts(frame_counts[kept]), frame_idx)
+        self._batch_indices, self._batch_frames = [], []
+
+    def close(self):
+        if self.csvfile:
+            self.csvfile.close()
+
+    def finish(self) -> Tuple[Optional[PlotPayload], IntensityResults]:
+        if self._batch_indices:
+            self._process_batch()
+        self.close()
+
+        video, channel, num_frames_analysis = self.video, self.channel, self.num_frames_analysis
+        kurtosis_list = np.concatenate(self.kurtosis_list)
+        median_skewness_list = np.concatenate(self.median_skewness_list)
+        mode_skewness_list = np.concatenate(self.mode_skewness_list)
+        flags = np.concatenate(self.flags)
+
+        max_kurt = average_largest(kurtosis_list)
+        max_median_skew = average_largest(median_skewness_list)
+        max_mode_skew = average_largest(mode_skewness_list)
+
+        kurt_diff = np.nanmean(kurtosis_list[-num_frames_analysis:]) - np.nanmean(kurtosis_list[:num_frames_analysis])
+        median_skew_diff = np.nanmean(median_skewness_list[-num_frames_analysis:]) - np.nanmean(median_skewness_list[:num_frames_analysis])
+        mode_skew_diff = np.nanmean(mode_skewness_list[-num_frames_analysis:]) - np.nanmean(mode_skewness_list[:num_frames_analysis])
+
+        fig = None
+        if self.out_config.save_visualizations:
+            from visualization import save_intensity_plots
+            # Plot the intensity distributions for the first and last frame for comparison
+            first_frame = video.get_frame(0, channel)
+            end_frame = video.get_frame(-1, channel)
+            max_px_intensity = 1.1*video.max(channel)
+            fig = PlotPayload(save_intensity_plots, (first_frame, end_frame, self.bin_number, self.noise_threshold, video.num_frames, max_px_intensity))
+
+        flag = int(np.all(flags))
+        results = IntensityResults(max_kurtosis=max_kurt, max_median_skew=max_median_skew, max_mode_skew=max_mode_skew,
+                                   kurtosis_diff=kurt_diff, median_skew_diff=median_skew_diff, mode_skew_diff=mode_skew_diff, saturation_flag=flag)
         
-        kurtosis_list.append(kurtosis(frame_values, frame_counts))
-        median_skewness_list.append(median_skewness(frame_values, frame_counts))
-        mode_skewness_list.append(mode_skewness(frame_values, frame_counts))
-        flag_value = bool(frame_mode(frame_data, bin_number, noise_threshold) == frame_values[-1])
-        flags.append(flag_value)
-    
-    max_kurt = average_largest(kurtosis_list)
-    max_median_skew = average_largest(median_skewness_list)
-    max_mode_skew = average_largest(mode_skewness_list)
-
-    kurt_diff = np.nanmean(kurtosis_list[-num_frames_analysis:]) - np.nanmean(kurtosis_list[:num_frames_analysis])
-    median_skew_diff = np.nanmean(median_skewness_list[-num_frames_analysis:]) - np.nanmean(median_skewness_list[:num_frames_analysis])
-    mode_skew_diff = np.nanmean(mode_skewness_list[-num_frames_analysis:]) - np.nanmean(mode_skewness_list[:num_frames_analysis])
-
-    #div_test
-
-    fig = None
-    if out_config.save_visualizations:
-        from visualization import save_intensity_plots
-        # Plot the intensity distributions for the first and last frame for comparison
-        first_frame = video[0]
-        end_frame = video[-1]
-        max_px_intensity = 1.1*np.max(video)
-        fig = save_intensity_plots(first_frame, end_frame, bin_number, noise_threshold, len(video), max_px_intensity)
-
-    flag = int(all(flags))
-    results = IntensityResults(max_kurtosis=max_kurt, max_median_skew=max_median_skew, max_mode_skew=max_mode_skew,
-                               kurtosis_diff=kurt_diff, median_skew_diff=median_skew_diff, mode_skew_diff=mode_skew_diff, saturation_flag=flag)
-    
-    return fig, results
+        return fig, results
 
+def analyze_intensity_distribution(video: FrameSource, channel: int, name: str, id_config: IntensityDistributionConfig, out_config: WriterConfig) -> Tuple[Optional[PlotPayload], IntensityResults]:
+    accumulator = IntensityAccumulator(video, channel, name, id_config, out_config)
+    try:
+        for frame_idx in accumulator.frame_indices:
+            accumulator.add_frame(frame_idx, video.get_frame(frame_idx, channel))
+        return accumulator.finish()
+    finally:
+        accumulator.close()
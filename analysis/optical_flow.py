@@ -1,63 +1,104 @@
 import os 
-import cv2 as cv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
 import numpy as np
-from utils import groupAvg, find_analysis_frames, vprint, flatten
-from utils.optical_flow import velocity_correlation, divergence, curl
-from utils.setup import setup_csv_writer
+from utils import groupAvg, find_analysis_frames, vprint, flatten, find_correlation_lengths
+from utils.optical_flow import velocity_correlation, divergence, curl, create_flow_backend, flow_downsample
+from utils.setup import setup_rds_writer
 from core import OpticalFlowConfig, ReaderConfig, WriterConfig, FlowResults
-
-def analyze_optical_flow(video: np.ndarray, name: str, flow_config: OpticalFlowConfig, 
-                         in_config: ReaderConfig, out_config: WriterConfig) -> FlowResults:
-    # Defines print to enable printing only if verbose setting set to True
-    vprint('Beginning Optical Flow Analysis')
-    frame_eval_percent = flow_config.percentage_frames_evaluated
-    frame_stride = flow_config.frame_step
-    win_size = flow_config.win_size
-    downsample = flow_config.downsample
-    exposure_time = in_config.exposure_time
-    um_pix_ratio = in_config.um_pixel_ratio
-    frame_indices, frame_stride = find_analysis_frames(video, frame_stride)
-    correlation_max = int(video.shape[1]/(2 * downsample))
-    flow_field_indices = [(frame_indices[i], frame_indices[i + 1]) for i in range(len(frame_indices) - 1)]
-    num_frames_analysis = int(np.ceil(frame_eval_percent * len(flow_field_indices)))
-
-    mid_point = flow_field_indices[int((len(flow_field_indices) - 1)/2)]
-    visualization_flow_fields = [flow_field_indices[0], mid_point, flow_field_indices[-1]]
-
-    flow_field_list = []
-    vx_list = []
-    vy_list = []
-    velocity_correlations = []
-    divergences = []
-    curls = []
-    speeds = []
-
-    # Prepares the intermediate file for saving if setting is turned on
-    csvwriter, csvfile = None, None
-    vcorr_csvwriter, vcorr_file = None, None
-    divwriter, divfile = None, None
-    curlwriter, curlfile = None, None
-    if out_config.save_rds:
-        from visualization import write_flow_field_rds, write_correlation_rds, write_divergence_curl_rds
-        filename = os.path.join(name, 'OpticalFlow.csv')
-        filename_vcorr = os.path.join(name, 'VelocityCorrelation.csv')
-        filename_div = os.path.join(name, 'Divergence.csv')
-        filename_curl = os.path.join(name, 'Curl.csv')
-        csvwriter, csvfile = setup_csv_writer(filename)
-        vcorr_csvwriter, vcorr_file = setup_csv_writer(filename_vcorr)
-        divwriter, divfile = setup_csv_writer(filename_div)
-        curlwriter, curlfile = setup_csv_writer(filename_curl)
-    for frame_pair in flow_field_indices:
+from utils.reader import FrameSource
+from utils.render import render_figure
+
+class FlowAccumulator:
+    """
+    Optical flow analysis of one channel of a video, fed its sampled frames in order.
+
+    The frames to pass to add_frame are given by frame_indices; each frame ends one pair
+    and starts the next. With flow_threads > 1, flows are computed on a thread pool (OpenCV
+    releases the GIL), with at most 2 * flow_threads fields in flight, but are reduced one at
+    a time in frame order. Backends that depend on the previous pair's flow are always run on
+    the calling thread. finish() returns the results of the analysis.
+    """
+
+    def __init__(self, video: FrameSource, channel: int, name: str, flow_config: OpticalFlowConfig,
+                 in_config: ReaderConfig, out_config: WriterConfig):
+        # Defines print to enable printing only if verbose setting set to True
+        vprint('Beginning Optical Flow Analysis')
+        self.name = name
+        self.flow_config = flow_config
+        self.out_config = out_config
+        self.exposure_time = in_config.exposure_time
+        self.um_pix_ratio = in_config.um_pixel_ratio
+        self.downsample = flow_config.downsample
+        self.frame_indices, _ = find_analysis_frames(video, flow_config.frame_step)
+        self.correlation_max = int(video.height/(2 * self.downsample))
+        flow_field_indices = [(self.frame_indices[i], self.frame_indices[i + 1]) for i in range(len(self.frame_indices) - 1)]
+        self.num_frames_analysis = int(np.ceil(flow_config.percentage_frames_evaluated * len(flow_field_indices)))
+
+        mid_point = flow_field_indices[int((len(flow_field_indices) - 1)/2)]
+        self.visualization_flow_fields = [flow_field_indices[0], mid_point, flow_field_indices[-1]]
+
+        # Running sum of the unit flow fields computed so far
+        self.cumulative_field = None
+        self.vx_list = []
+        self.vy_list = []
+        self.correlation_profiles = []
+        self.divergences = []
+        self.curls = []
+        self.speeds = []
+        self.xvalues = None
+
+        # Prepares the intermediate file for saving if setting is turned on
+        self.csvwriter, self.csvfile = None, None
+        self.vcorr_csvwriter, self.vcorr_file = None, None
+        self.divwriter, self.divfile = None, None
+        self.curlwriter, self.curlfile = None, None
+        if out_config.save_rds:
+            filename = os.path.join(name, 'OpticalFlow.csv')
+            filename_vcorr = os.path.join(name, 'VelocityCorrelation.csv')
+            filename_div = os.path.join(name, 'Divergence.csv')
+            filename_curl = os.path.join(name, 'Curl.csv')
+            self.csvwriter, self.csvfile = setup_rds_writer(filename, out_config)
+            self.vcorr_csvwriter, self.vcorr_file = setup_rds_writer(filename_vcorr, out_config)
+            self.divwriter, self.divfile = setup_rds_writer(filename_div, out_config)
+            self.curlwriter, self.curlfile = setup_rds_writer(filename_curl, out_config)
+
+        self.backend = create_flow_backend(flow_config)
+        # Flows of pre-binned frames are already partly downsampled
+        self.reduction = flow_downsample(flow_config)
+        threads = in_config.flow_threads
+        self._executor = None
+        if threads > 1 and self.backend.supports_threads:
+            self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._max_in_flight = 2 * threads
+        self._in_flight = deque()
+        self._previous_idx, self._previous_frame = None, None
+
+    def add_frame(self, frame_idx: int, frame: np.ndarray):
+        if self._previous_frame is not None:
+            frame_pair = (self._previous_idx, frame_idx)
+            if self._executor is None:
+                self._process_flow(frame_pair, self.backend.compute(self._previous_frame, frame))
+            else:
+                self._in_flight.append((frame_pair, self._executor.submit(self.backend.compute, self._previous_frame, frame)))
+                if len(self._in_flight) >= self._max_in_flight:
+                    oldest_pair, oldest_flow = self._in_flight.popleft()
+                    self._process_flow(oldest_pair, oldest_flow.result())
+        self._previous_idx, self._previous_frame = frame_idx, frame
+
+    def _process_flow(self, frame_pair: Tuple[int, int], flow: np.ndarray):
+        out_config, um_pix_ratio, downsample = self.out_config, self.um_pix_ratio, self.downsample
         start, stop = frame_pair
-        flow = cv.calcOpticalFlowFarneback(video[start], video[stop], None, 0.5, 3, win_size, 3, 5, 1.2, 0)
-        flow_reduced = groupAvg(flow, downsample)
+        flow_reduced = groupAvg(flow, self.reduction)
         downU = flow_reduced[:,:,0]
         downV = flow_reduced[:,:,1]
-        downU = np.flipud(downU)* 1/(exposure_time) * 1/(stop - start) * um_pix_ratio
-        downV = -1 * np.flipud(downV)* 1/(exposure_time) * 1/(stop - start) * um_pix_ratio
+        downU = np.flipud(downU)* 1/(self.exposure_time) * 1/(stop - start) * um_pix_ratio
+        downV = -1 * np.flipud(downV)* 1/(self.exposure_time) * 1/(stop - start) * um_pix_ratio
 
         if out_config.save_rds:
-            write_flow_field_rds(csvwriter, downU, downV, start, stop)
+            from visualization import write_flow_field_rds
+            write_flow_field_rds(self.csvwriter, downU, downV, start, stop)
         
         speed = (downU ** 2 + downV ** 2) ** (1/2)
         direction = np.arctan2(downV, downU)
@@ -68,77 +109,85 @@ def analyze_optical_flow(video: np.ndarray, name: str, flow_config: OpticalFlowC
         valid = speed > eps
         unit_field = np.zeros_like(downsampled_field)
         unit_field[valid] = downsampled_field[valid] / speed[valid, None]
-        flow_field_list.append(unit_field)
+        if self.cumulative_field is None:
+            self.cumulative_field = unit_field.copy()
+        else:
+            self.cumulative_field += unit_field
 
 
         v_correlation, v_rad_avg = velocity_correlation(downsampled_field)
-        cumulative_field = np.cumsum(flow_field_list, axis = 0)[-1]
-        div_field = divergence(cumulative_field, um_pix_ratio * downsample)
+        div_field = divergence(self.cumulative_field, um_pix_ratio * downsample)
 
         curl_field = curl(unit_field, um_pix_ratio * downsample)
 
         mean_div = np.nanmean(div_field)
         mean_curl = np.nanmean(curl_field)
-        v_rad_avg = v_rad_avg[:correlation_max]
-        xvalues = np.arange(len(v_rad_avg)) * um_pix_ratio * downsample
-
-        threshold = 0.5
-        correlation_length = np.nan
-        for i in range(len(v_rad_avg) - 1):
-
-            if v_rad_avg[i] > threshold and v_rad_avg[i + 1] <= threshold:
-
-                d1 = abs(v_rad_avg[i]     - threshold)
-                d2 = abs(v_rad_avg[i + 1] - threshold)
-
-                if d1 < d2:
-                    correlation_length = xvalues[i]
-                else:
-                    correlation_length = xvalues[i + 1]
-
-                break
-
+        v_rad_avg = v_rad_avg[:self.correlation_max]
+        self.xvalues = np.arange(len(v_rad_avg)) * um_pix_ratio * downsample
         if out_config.save_rds:
-            write_correlation_rds(vcorr_csvwriter, frame_pair, xvalues.tolist(), v_rad_avg.tolist())
-            write_divergence_curl_rds(divwriter, frame_pair, div_field)
-            write_divergence_curl_rds(curlwriter, frame_pair, curl_field)
+            from visualization import write_correlation_rds, write_divergence_curl_rds
+            write_correlation_rds(self.vcorr_csvwriter, frame_pair, self.xvalues.tolist(), v_rad_avg.tolist())
+            write_divergence_curl_rds(self.divwriter, frame_pair, div_field)
+            write_divergence_curl_rds(self.curlwriter, frame_pair, curl_field)
 
 
-        if (start, stop) in visualization_flow_fields and out_config.save_visualizations:
+        if (start, stop) in self.visualization_flow_fields and out_config.save_visualizations:
             from visualization import save_flow_field_visualization, save_correlation_visualization
-            save_flow_field_visualization(flow_field, start, stop, name, downsample, um_pix_ratio)
-            save_correlation_visualization(v_correlation, (start, stop), name, "Velocity", downsample, um_pix_ratio)
+            render_figure(save_flow_field_visualization, flow_field, start, stop, self.name, downsample, um_pix_ratio)
+            render_figure(save_correlation_visualization, v_correlation, (start, stop), self.name, "Velocity", downsample, um_pix_ratio)
         
         # Conversion: px/interval * interval/frame * 1/(sec/frame) * um/px
-        vx_list.append(np.mean(np.cos(direction)))
-        vy_list.append(np.mean(np.sin(direction)))
-        velocity_correlations.append(correlation_length)
-        divergences.append(mean_div)
-        curls.append(mean_curl)
-        speeds.append(np.mean(speed))
-        
-    # Close the CSV intermediate file
-    for rds_file in [csvfile, vcorr_file, divfile, curlfile]:
-        if rds_file:
-            rds_file.close()
-    vx_list = np.array(vx_list)
-    vy_list = np.array(vy_list)
-    speeds = np.array(speeds)
-    correlation_lengths = np.array(velocity_correlations)
-    velocity_correlation_flag = int(np.isnan(np.sum(correlation_lengths)))
-    max_divergence = divergences[-1]
-    mean_curl = np.mean(curls)
-    mean_correlation_length = np.nanmean(correlation_lengths)
-
-    vector_lengths = np.sqrt(vx_list ** 2 + vy_list ** 2)
-    sigma_thetas = np.sqrt(-2 * np.log(vector_lengths))
-
-    theta = np.arctan2(np.nanmean(vy_list), np.nanmean(vx_list)) # Metric for average flow direction # "Mean Flow Direction"
-    sigma_theta = np.nanmean(sigma_thetas) # Metric for st. dev of flow (-pi, pi) # "Flow Directional Spread"
-    mean_speed = np.nanmean(speeds) # Metric for avg. speed (units of um/s) # Average speed
-    delta_speed = np.nanmean(speeds[-num_frames_analysis:]) - np.nanmean(speeds[:num_frames_analysis]) # Metric for change in speed # "Speed Change"
-    results = FlowResults(mean_speed = mean_speed, delta_speed = delta_speed, mean_theta = theta, 
-                          mean_sigma_theta = sigma_theta, velocity_correlation_length = mean_correlation_length,
-                          divergence = max_divergence, curl = mean_curl,
-                          velocity_correlation_flag=velocity_correlation_flag)
-    return results
\ No newline at end of file
+        self.vx_list.append(np.mean(np.cos(direction)))
+        self.vy_list.append(np.mean(np.sin(direction)))
+        self.correlation_profiles.append(v_rad_avg)
+        self.divergences.append(mean_div)
+        self.curls.append(mean_curl)
+        self.speeds.append(np.mean(speed))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+        # Close the CSV intermediate file
+        for rds_file in [self.csvfile, self.vcorr_file, self.divfile, self.curlfile]:
+            if rds_file:
+                rds_file.close()
+
+    def finish(self) -> FlowResults:
+        while self._in_flight:
+            oldest_pair, oldest_flow = self._in_flight.popleft()
+            self._process_flow(oldest_pair, oldest_flow.result())
+        self.close()
+
+        num_frames_analysis = self.num_frames_analysis
+        vx_list = np.array(self.vx_list)
+        vy_list = np.array(self.vy_list)
+        speeds = np.array(self.speeds)
+        # Correlation length of every flow field: where its profile first drops below 0.5
+        correlation_lengths = find_correlation_lengths(np.array(self.correlation_profiles), self.xvalues, 0.5)
+        velocity_correlation_flag = int(np.isnan(np.sum(correlation_lengths)))
+        max_divergence = self.divergences[-1]
+        mean_curl = np.mean(self.curls)
+        mean_correlation_length = np.nanmean(correlation_lengths)
+
+        vector_lengths = np.sqrt(vx_list ** 2 + vy_list ** 2)
+        sigma_thetas = np.sqrt(-2 * np.log(vector_lengths))
+
+        theta = np.arctan2(np.nanmean(vy_list), np.nanmean(vx_list)) # Metric for average flow direction # "Mean Flow Direction"
+        sigma_theta = np.nanmean(sigma_thetas) # Metric for st. dev of flow (-pi, pi) # "Flow Directional Spread"
+        mean_speed = np.nanmean(speeds) # Metric for avg. speed (units of um/s) # Average speed
+        delta_speed = np.nanmean(speeds[-num_frames_analysis:]) - np.nanmean(speeds[:num_frames_analysis]) # Metric for change in speed # "Speed Change"
+        results = FlowResults(mean_speed = mean_speed, delta_speed = delta_speed, mean_theta = theta, 
+                              mean_sigma_theta = sigma_theta, velocity_correlation_length = mean_correlation_length,
+                              divergence = max_divergence, curl = mean_curl,
+                              velocity_correlation_flag=velocity_correlation_flag)
+        return results
+
+def analyze_optical_flow(video: FrameSource, channel: int, name: str, flow_config: OpticalFlowConfig, 
+                         in_config: ReaderConfig, out_config: WriterConfig) -> FlowResults:
+    accumulator = FlowAccumulator(video, channel, name, flow_config, in_config, out_config)
+    try:
+        for frame_idx in accumulator.frame_indices:
+            accumulator.add_frame(frame_idx, video.get_frame(frame_idx, channel))
+        return accumulator.finish()
+    finally:
+        accumulator.close()
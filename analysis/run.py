@@ -1,59 +1,190 @@
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 import traceback
-import matplotlib.pyplot as plt
-import numpy as np
 
 from analysis import analyze_optical_flow, analyze_intensity_distribution, analyze_binarization
+from analysis.binarization import BinarizationAccumulator
+from analysis.optical_flow import FlowAccumulator
+from analysis.intensity_distribution import IntensityAccumulator
 from core import BarcodeConfig, ChannelResults
-from utils import vprint
+from core.cache import ResultCache
+from utils import vprint, write_error_log
+from utils.reader import FrameSource
+from utils.render import PlotPayload
 
-def run_analysis_pipeline(filepath: str, file: np.ndarray, channel: int, config: BarcodeConfig, output_dir: str, fail_file_loc: str) -> Tuple[ChannelResults, List[plt.Figure]]:
+# Name of each branch in the error log
+_MODULE_NAMES = {
+    "binarization": "Binarization",
+    "optical_flow": "Optical Flow",
+    "intensity_distribution": "Intensity Distribution",
+}
+# Field of ChannelResults holding the results of each branch
+_RESULT_FIELDS = {
+    "binarization": "binarization",
+    "optical_flow": "flow",
+    "intensity_distribution": "intensity",
+}
+
+def run_fused_branches(file: FrameSource, channel: int, accumulators: Dict[str, object], fail_file_loc: str) -> Dict[str, object]:
+    """
+    Run several analysis branches over one channel of a file in a single pass.
+
+    Every frame in the union of the branches' frame_indices is read once, in frame order, and
+    handed to the add_frame of each branch that samples it. A branch that raises is logged and
+    dropped without stopping the others. Returns the output of finish() of every branch that
+    succeeded, which is identical to running that branch on its own.
+    """
+    schedules = {branch: set(accumulator.frame_indices) for branch, accumulator in accumulators.items()}
+    running = dict(accumulators)
+
+    def fail(branch: str, e: Exception):
+        write_error_log(
+            fail_file_loc,
+            traceback.format_exc(),
+            f"Channel {channel}, Module: {_MODULE_NAMES[branch]}, Exception: {str(e)}\n",
+        )
+        try:
+            running.pop(branch).close()
+        except Exception as close_error:
+            # Closing can re-raise an RDS writer error; it must not stop the other branches
+            write_error_log(
+                fail_file_loc,
+                traceback.format_exc(),
+                f"Channel {channel}, Module: {_MODULE_NAMES[branch]}, Exception while closing: {str(close_error)}\n",
+            )
+
+    for frame_idx in sorted(set().union(*schedules.values())):
+        branches = [branch for branch in running if frame_idx in schedules[branch]]
+        if not branches:
+            continue
+        try:
+            frame = file.get_frame(frame_idx, channel)
+        except Exception as e:
+            for branch in branches:
+                fail(branch, e)
+            continue
+        for branch in branches:
+            try:
+                running[branch].add_frame(frame_idx, frame)
+            except Exception as e:
+                fail(branch, e)
+
+    outputs = {}
+    for branch in list(running):
+        try:
+            outputs[branch] = running[branch].finish()
+        except Exception as e:
+            fail(branch, e)
+    return outputs
+
+def run_analysis_pipeline(filepath: str, file: FrameSource, channel: int, config: BarcodeConfig, output_dir: str, fail_file_loc: str,
+                          cache: Optional[ResultCache] = None, fingerprint: str = "") -> Tuple[ChannelResults, List[PlotPayload]]:
     results = ChannelResults(filepath=filepath, channel=channel)
     figures = []
-    video = file[:,:,:, channel]
-    if (video == 0).all():
+    if file.is_blank(channel):
         vprint('Video appears to be blank, please check channel manually.')
         return results, figures
 
-    if config.modules.image_binarization:
+    # A cached result can only replace a branch when none of its output files are requested
+    use_cached = cache is not None and not (config.writer.save_rds or config.writer.save_visualizations)
+
+    def cached_result(branch: str):
+        if not use_cached:
+            return None
+        result = cache.get(branch, fingerprint, channel, config)
+        if result is not None:
+            vprint(f"Using cached {branch.replace('_', ' ')} results")
+        return result
+
+    def cache_result(branch: str, result):
+        if cache is not None:
+            cache.put(branch, fingerprint, channel, config, result)
+
+    if config.reader.fused_branches:
+        # Branches without a cached result are set up first, then all run in one pass over the video
+        branches = [
+            ("binarization", config.modules.image_binarization, lambda: BinarizationAccumulator(
+                file, channel, output_dir, config.image_binarization_parameters, config.reader, config.writer)),
+            ("optical_flow", config.modules.optical_flow, lambda: FlowAccumulator(
+                file, channel, output_dir, config.optical_flow_parameters, config.reader, config.writer)),
+            ("intensity_distribution", config.modules.intensity_distribution, lambda: IntensityAccumulator(
+                file, channel, output_dir, config.intensity_distribution_parameters, config.writer)),
+        ]
+        accumulators = {}
+        for branch, enabled, create_accumulator in branches:
+            if not enabled:
+                continue
+            cached = cached_result(branch)
+            if cached is not None:
+                setattr(results, _RESULT_FIELDS[branch], cached)
+                continue
+            try:
+                accumulators[branch] = create_accumulator()
+            except Exception as e:
+                write_error_log(
+                    fail_file_loc,
+                    traceback.format_exc(),
+                    f"Channel {channel}, Module: {_MODULE_NAMES[branch]}, Exception: {str(e)}\n",
+                )
+        for branch, output in run_fused_branches(file, channel, accumulators, fail_file_loc).items():
+            # Optical flow has no summary figure
+            fig, branch_results = (None, output) if branch == "optical_flow" else output
+            setattr(results, _RESULT_FIELDS[branch], branch_results)
+            cache_result(branch, branch_results)
+            if fig and config.writer.save_visualizations:
+                figures.append(fig)
+        return results, figures
+
+    binarization_results = cached_result("binarization") if config.modules.image_binarization else None
+    if binarization_results is not None:
+        results.binarization = binarization_results
+    elif config.modules.image_binarization:
         try:
             bfig, binarization_results = analyze_binarization(
-                video, output_dir, config.image_binarization_parameters, config.reader, config.writer)
+                file, channel, output_dir, config.image_binarization_parameters, config.reader, config.writer)
             results.binarization = binarization_results
+            cache_result("binarization", binarization_results)
             if bfig and config.writer.save_visualizations:
                 figures.append(bfig)
         except Exception as e:
-            with open(fail_file_loc, "a", encoding="utf-8") as log_file:
-                log_file.write(traceback.format_exc())
-                log_file.write(
-                    f"Channel {channel}, Module: Binarization, Exception: {str(e)}\n"
-                )
+            write_error_log(
+                fail_file_loc,
+                traceback.format_exc(),
+                f"Channel {channel}, Module: Binarization, Exception: {str(e)}\n",
+            )
 
     # Run optical flow analysis
-    if config.modules.optical_flow:
+    flow_results = cached_result("optical_flow") if config.modules.optical_flow else None
+    if flow_results is not None:
+        results.flow = flow_results
+    elif config.modules.optical_flow:
         try:
-            results.flow = analyze_optical_flow(video, output_dir, config.optical_flow_parameters, config.reader, config.writer)
+            results.flow = analyze_optical_flow(file, channel, output_dir, config.optical_flow_parameters, config.reader, config.writer)
+            cache_result("optical_flow", results.flow)
         except Exception as e:
-            with open(fail_file_loc, "a", encoding="utf-8") as log_file:
-                log_file.write(traceback.format_exc())
-                log_file.write(
-                    f"Channel {channel}, Module: Optical Flow, Exception: {str(e)}\n"
-                )
+            write_error_log(
+                fail_file_loc,
+                traceback.format_exc(),
+                f"Channel {channel}, Module: Optical Flow, Exception: {str(e)}\n",
+            )
 
     # Run intensity distribution analysis
-    if config.modules.intensity_distribution:
+    intensity_results = cached_result("intensity_distribution") if config.modules.intensity_distribution else None
+    if intensity_results is not None:
+        results.intensity = intensity_results
+    elif config.modules.intensity_distribution:
         try:
             ifig, intensity_results = analyze_intensity_distribution(
-                video, output_dir, config.intensity_distribution_parameters, config.writer
+                file, channel, output_dir, config.intensity_distribution_parameters, config.writer
             )
             results.intensity = intensity_results
+            cache_result("intensity_distribution", intensity_results)
             if ifig and config.writer.save_visualizations:
                 figures.append(ifig)
         except Exception as e:
-            with open(fail_file_loc, "a", encoding="utf-8") as log_file:
-                log_file.write(traceback.format_exc())
-                log_file.write(
-                    f"Channel {channel}, Module: Intensity Distribution, Exception: {str(e)}\n"
-                )
+            write_error_log(
+                fail_file_loc,
+                traceback.format_exc(),
+                f"Channel {channel}, Module: Intensity Distribution, Exception: {str(e)}\n",
+            )
 
-    return results, figures
\ No newline at end of file
+    return results, figures
@@ -0,0 +1,176 @@
+"""
+Persistent cache of branch results, so unchanged files are not analysed again.
+
+Each entry holds the result of one branch (binarization, optical flow or intensity
+distribution) for one channel of one file. It is keyed by a fingerprint of the file
+contents and a hash of the config sections that branch depends on, so changing the
+parameters of one branch leaves the cached results of the other branches valid.
+
+Clear the cache from the command line with:
+
+    python -m core.cache clear [--branch BRANCH] [--cache-dir DIR]
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import uuid
+from typing import Dict, List, Optional
+
+from core.checkpoint import hash_config
+from core.config import BarcodeConfig, ReaderConfig
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".barcode", "result_cache")
+
+# Config sections whose values change the results of each branch
+BRANCH_CONFIG_SECTIONS: Dict[str, List[str]] = {
+    "binarization": ["image_binarization_parameters", "reader"],
+    "optical_flow": ["optical_flow_parameters", "reader"],
+    "intensity_distribution": ["intensity_distribution_parameters"],
+}
+
+# Bytes hashed from the start, middle and end of a file for its fingerprint
+_SAMPLE_SIZE = 1 << 16
+
+
+def content_fingerprint(filepath: str) -> str:
+    """
+    Fingerprint a file from its size, modification time and samples of its contents.
+
+    The path is not part of the fingerprint, so moving or renaming a file (keeping
+    its modification time) does not invalidate its cached results.
+    """
+    stat = os.stat(filepath)
+    digest = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    with open(filepath, "rb") as f:
+        for offset in (0, stat.st_size // 2, max(stat.st_size - _SAMPLE_SIZE, 0)):
+            f.seek(offset)
+            digest.update(f.read(_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Size-bounded, on-disk cache of branch results shared by every run and worker process."""
+
+    def __init__(self, cache_dir: str = "", max_size_mb: float = 2048):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_size_bytes = int(max_size_mb * 1024**2)
+
+    @classmethod
+    def from_config(cls, reader_config: ReaderConfig) -> Optional["ResultCache"]:
+        """Return the cache selected in the reader settings, or None if caching is off."""
+        if not reader_config.use_result_cache:
+            return None
+        return cls(reader_config.result_cache_dir, reader_config.result_cache_size_mb)
+
+    def _entry_path(self, branch: str, fingerprint: str, channel: int, config: BarcodeConfig) -> str:
+        config_hash = hash_config(config, BRANCH_CONFIG_SECTIONS[branch])
+        key = hashlib.sha256(f"{fingerprint}:{channel}:{config_hash}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, branch, key + ".pkl")
+
+    def get(self, branch: str, fingerprint: str, channel: int, config: BarcodeConfig):
+        """Return the cached result of a branch, or None on a miss."""
+        entry_path = self._entry_path(branch, fingerprint, channel, config)
+        try:
+            with open(entry_path, "rb") as f:
+                result = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # Mark the entry as recently used so it is evicted last
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, branch: str, fingerprint: str, channel: int, config: BarcodeConfig, result) -> None:
+        """Store the result of a branch, evicting the least recently used entries if over size."""
+        entry_path = self._entry_path(branch, fingerprint, channel, config)
+        # Write to a temporary file first so other processes never read a partial entry
+        tmp_path = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(result, f)
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            # A full or read-only cache location should never fail the analysis itself
+            print(f"Unable to save result to cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries = []
+        for branch in BRANCH_CONFIG_SECTIONS:
+            branch_dir = os.path.join(self.cache_dir, branch)
+            if not os.path.isdir(branch_dir):
+                continue
+            entries.extend(entry for entry in os.scandir(branch_dir) if entry.name.endswith(".pkl"))
+        return entries
+
+    def size(self) -> int:
+        """Return the total size of the cache entries in bytes."""
+        total = 0
+        for entry in self._entries():
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in its size limit."""
+        stats = []
+        for entry in self._entries():
+            try:
+                stats.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except OSError:
+                pass
+
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self, branch: Optional[str] = None) -> int:
+        """Remove every entry, or only those of one branch. Returns the number removed."""
+        branches = [branch] if branch else list(BRANCH_CONFIG_SECTIONS)
+        removed = 0
+        for name in branches:
+            branch_dir = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(branch_dir):
+                continue
+            for entry in os.scandir(branch_dir):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Manage the BARCODE result cache.")
+    parser.add_argument("command", choices=["clear", "info"])
+    parser.add_argument("--cache-dir", default="", help=f"Cache location (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--branch", choices=list(BRANCH_CONFIG_SECTIONS), help="Only clear results of this branch")
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache_dir)
+    if args.command == "clear":
+        removed = cache.clear(args.branch)
+        print(f"Removed {removed} cached results from {cache.cache_dir}")
+    else:
+        print(f"{cache.cache_dir}: {len(cache._entries())} cached results, {cache.size() / 1024**2:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import json
+import os
+import pickle
+from typing import Dict, List, Optional, Tuple
+
+from core.config import BarcodeConfig
+from core.results import ChannelResults
+
+# Config sections whose values change the results computed for a file
+RESULT_CONFIG_SECTIONS = [
+    "channels",
+    "modules",
+    "reader",
+    "image_binarization_parameters",
+    "optical_flow_parameters",
+    "intensity_distribution_parameters",
+]
+
+# Reader settings that only change how a run is executed, not its results
+RUN_ONLY_READER_FIELDS = [
+    "verbose",
+    "workers",
+    "flow_threads",
+    "fused_branches",
+    "use_result_cache",
+    "result_cache_dir",
+    "result_cache_size_mb",
+]
+
+
+def file_fingerprint(filepath: str) -> Tuple[int, int]:
+    """Return the size (bytes) and modification time (ns) used to detect a changed file."""
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def hash_config_section(section) -> str:
+    """Hash the values of a config section (or a plain dictionary of values)."""
+    values = section if isinstance(section, dict) else section.to_dict()
+    encoded = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def hash_config(config: BarcodeConfig, sections: List[str] = RESULT_CONFIG_SECTIONS) -> str:
+    """Hash the given config sections (by default, every section that affects the results of an analysis)."""
+    values = {}
+    for section_name in sections:
+        section = getattr(config, section_name).to_dict()
+        if section_name == "reader":
+            section = {k: v for k, v in section.items() if k not in RUN_ONLY_READER_FIELDS}
+        values[section_name] = section
+    return hash_config_section(values)
+
+
+def encode_results(results: List[ChannelResults]) -> str:
+    """Encode channel results as text, keeping NumPy scalar types so CSV output is unchanged."""
+    return base64.b64encode(pickle.dumps(results)).decode("ascii")
+
+
+def decode_results(encoded: str) -> List[ChannelResults]:
+    """Decode channel results made by encode_results."""
+    return pickle.loads(base64.b64decode(encoded))
+
+
+class ResultJournal:
+    """
+    Append-only journal of the results of each completed file.
+
+    Every line holds the results for one file, keyed by its path, size, modification
+    time and the hash of the config it was analysed with. Entries are written as soon
+    as a file finishes, so an interrupted run can be resumed without repeating work.
+    """
+
+    def __init__(self, filepath: str, config_hash: str):
+        self.filepath = filepath
+        self.config_hash = config_hash
+        self.completed: Dict[str, List[ChannelResults]] = {}
+
+    def clear(self) -> None:
+        """Start a new, empty journal."""
+        self.completed = {}
+        open(self.filepath, "w").close()
+
+    def remove(self) -> None:
+        """Delete the journal file, once the results it holds have been saved elsewhere."""
+        self.completed = {}
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+    def load(self) -> Dict[str, List[ChannelResults]]:
+        """
+        Read completed entries from disk.
+
+        Entries for files that have changed since, or that were analysed with a
+        different config, are ignored. A partially written final line is skipped.
+        """
+        self.completed = {}
+        if not os.path.exists(self.filepath):
+            return self.completed
+
+        with open(self.filepath, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get("config_hash") != self.config_hash:
+                    continue
+                path = entry["path"]
+                try:
+                    if list(file_fingerprint(path)) != [entry["size"], entry["mtime"]]:
+                        continue
+                except OSError:
+                    continue
+                self.completed[path] = decode_results(entry["results"])
+
+        return self.completed
+
+    def lookup(self, filepath: str) -> Optional[List[ChannelResults]]:
+        """Return the journaled results of a file, or None if it has not been completed."""
+        return self.completed.get(filepath)
+
+    def record(self, filepath: str, results: List[ChannelResults]) -> None:
+        """Append the results of a completed file to the journal."""
+        size, mtime = file_fingerprint(filepath)
+        entry = {
+            "path": filepath,
+            "size": size,
+            "mtime": mtime,
+            "config_hash": self.config_hash,
+            "results": encode_results(results),
+        }
+        with open(self.filepath, "a", encoding="utf-8") as journal_file:
+            journal_file.write(json.dumps(entry) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.completed[filepath] = results
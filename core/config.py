@@ -57,6 +57,7 @@ class InputConfig(BaseConfig):
     configuration_file: str = ""
     length_units: str = "μm"
     time_units: str = "s"
+    resume: bool = False  # reuse results saved by an interrupted run
 
     @property
     def length(self):
@@ -139,12 +140,21 @@ class ReaderConfig(BaseConfig):
     exposure_time: float = 1.0
     um_pixel_ratio: float = 1.0
     verbose: bool = False
+    workers: int = 1  # number of files processed in parallel
+    flow_threads: int = 1  # threads computing optical flow fields within a file
+    fused_branches: bool = False  # read each frame once for all branches of a channel
+    use_result_cache: bool = False
+    result_cache_dir: str = ""  # defaults to ~/.barcode/result_cache
+    result_cache_size_mb: int = 2048
 
 @dataclass
 class WriterConfig(BaseConfig):
     generate_barcode: bool = False
     save_rds: bool = False
+    rds_format: str = "csv"  # "csv" or "binary" (see utils.binary_rds)
+    background_rds_writes: bool = False  # write reduced data structures on a background thread
     save_visualizations: bool = False
+    render_workers: int = 0  # processes rendering the visualizations; 0 renders them during the analysis
 
 @dataclass
 class BinarizationConfig(BaseConfig):
@@ -156,6 +166,7 @@ class BinarizationConfig(BaseConfig):
     minimum_island_size: int = 1
     enable_physical_units: bool = False
     invert_binarization: bool = False
+    single_precision_autocorrelation: bool = False
 
 
 @dataclass
@@ -164,6 +175,14 @@ class OpticalFlowConfig(BaseConfig):
     win_size: int = 32
     downsample: int = 8
     percentage_frames_evaluated: float = 0.05
+    flow_backend: str = "farneback"  # see utils.optical_flow.FLOW_BACKENDS
+    prebin_factor: int = 1  # bin frames before computing flow; must divide downsample
+    # Farneback parameters
+    pyr_scale: float = 0.5
+    levels: int = 3
+    iterations: int = 3
+    poly_n: int = 5
+    poly_sigma: float = 1.2
 
 @dataclass
 class IntensityDistributionConfig(BaseConfig):
@@ -1,20 +1,27 @@
 import os
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 
 from analysis import run_analysis_pipeline
 from core import BarcodeConfig, ChannelResults, InputConfig
-from utils import vprint, set_verbose, Timer
-from utils.reader import read_file, check_first_frame_dim
+from core.cache import ResultCache, content_fingerprint
+from core.checkpoint import ResultJournal, hash_config
+from utils import vprint, set_verbose, set_error_log_lock, restore_standard_streams, write_error_log, Timer
+from utils.reader import FileProbe, FrameSource, read_file
+from utils.render import deferred_rendering, render_figure
 from utils.setup import (
+    build_file_manifest,
     create_output_directories,
     create_channel_output_dir,
-    find_files,
     setup_paths,
 )
-from utils.writer import generate_combined_barcode, results_to_csv
+from utils.writer import generate_combined_barcode, manifest_to_csv, results_to_csv
 
 
 def determine_channels_to_process(config: BarcodeConfig, total_channels: int) -> List[int]:
@@ -78,8 +85,7 @@ def save_analysis_results(
                 generate_combined_barcode(all_results, barcode_path)
 
         except Exception as e:
-            with open(ff_loc, "a", encoding="utf-8") as log_file:
-                log_file.write(f"Unable to generate barcode, Exception: {str(e)}\n")
+            write_error_log(ff_loc, f"Unable to generate barcode, Exception: {str(e)}\n")
 
     config.reader.um_pixel_ratio *= input_config.length
     config.reader.exposure_time *= input_config.time
@@ -108,15 +114,30 @@ def process_single_file(
     if file is None:
         raise TypeError("File not read by BARCODE.")
 
+    cache = ResultCache.from_config(config.reader)
+    fingerprint = content_fingerprint(filepath) if cache is not None else ""
+
+    with file:
+        channel_results = process_frame_source(filepath, file, config, fail_file_loc, cache, fingerprint)
+
+    return channel_results, count
+
+
+def process_frame_source(
+    filepath: str, file: FrameSource, config: BarcodeConfig, fail_file_loc: str,
+    cache: Optional[ResultCache] = None, fingerprint: str = "",
+) -> List[ChannelResults]:
+    """Run the analysis pipeline on each selected channel of an opened file."""
+
     print(f"File Dimensions: {file.shape}")
-    if not isinstance(file, np.ndarray):
+    if not isinstance(file, FrameSource):
         raise TypeError("File was not of the correct filetype")
 
     # Setup output directories
     figure_dir_name = create_output_directories(filepath)
 
     # Determine channels to process
-    total_channels = min(file.shape)
+    total_channels = file.num_channels
     channels_to_process = determine_channels_to_process(config, total_channels)
     channel_results = []
 
@@ -124,7 +145,7 @@ def process_single_file(
         vprint(f"Processing Channel: {channel}")
 
         # Check for dim channels
-        is_dim = check_first_frame_dim(file[:, :, :, channel])
+        is_dim = file.is_dim(channel)
         if is_dim and not config.reader.accept_dim_channels:
             vprint("Channel too dim, not enough signal, skipping...")
             continue
@@ -136,7 +157,7 @@ def process_single_file(
 
         # Run analysis pipeline
         results, figures = run_analysis_pipeline(
-            filepath, file, channel, config, channel_output_dir, fail_file_loc
+            filepath, file, channel, config, channel_output_dir, fail_file_loc, cache, fingerprint
         )
         results.filepath = filepath
         results.channel = channel
@@ -147,75 +168,219 @@ def process_single_file(
         if config.writer.save_visualizations:
             from visualization import create_summary_visualization
             summary_path = os.path.join(channel_output_dir, "Summary Graphs.png")
-            create_summary_visualization(figures, summary_path)
+            render_figure(create_summary_visualization, figures, summary_path)
         channel_results.append(results)
         vprint("Channel Screening Completed")
 
-    return channel_results, count
+    return channel_results
+
+
+def process_file_safely(
+    filepath: str, config: BarcodeConfig, in_config: InputConfig, ff_loc: str, count: int, total: int
+) -> Tuple[Optional[List[ChannelResults]], int, float]:
+    """
+    Process a single file, reporting any failure instead of raising it.
+
+    Returns the channel results (None if the file failed), the updated file count
+    and the time spent on the file in seconds.
+    """
+    start_time = time.time()
+    try:
+        results, count = process_single_file(filepath, config, in_config, ff_loc, count, total)
+    except TypeError as e:
+        if "BARCODE" not in str(e):
+            print(e)
+        return None, count, time.time() - start_time
+    except Exception as e:
+        print(f"Exception processing file: {filepath}")
+        print(f"{type(e).__name__}: {e}")
+        traceback.print_exc()
+        write_error_log(ff_loc, f"File: {filepath}, Exception: {str(e)}\n")
+        return None, count, time.time() - start_time
+
+    if results == None:
+        print("No results computed.")
+    return results, count, time.time() - start_time
+
+
+def _init_worker(error_log_lock, verbose: bool) -> None:
+    """Set up the module globals of a worker process."""
+    # Worker output goes to the console; the parent reports the progress of every file
+    restore_standard_streams()
+    set_error_log_lock(error_log_lock)
+    set_verbose(verbose)
 
 
 def process_multiple_files(
-    files_to_process: List[str], config: BarcodeConfig, in_config: InputConfig, ff_loc: str, timer: Timer,
+    files_to_process: List[FileProbe], config: BarcodeConfig, in_config: InputConfig, ff_loc: str, timer: Timer,
+    journal: Optional[ResultJournal] = None,
 ) -> List[ChannelResults]:
     """
-    Process a list of files and return collected results.
+    Process a list of probed files and return collected results.
+
+    With config.reader.workers > 1, files are processed in a pool of worker processes.
+    If a journal is given, files it already holds are not processed again and every
+    newly completed file is recorded in it. Results are always returned in the order
+    of files_to_process.
     """
+    file_results = [None] * len(files_to_process)
+    pending = []
+    for idx, probe in enumerate(files_to_process):
+        journaled = journal.lookup(probe.filepath) if journal is not None else None
+        if journaled is not None:
+            file_results[idx] = journaled
+        else:
+            pending.append(idx)
+
+    if journal is not None and len(pending) < len(files_to_process):
+        print(f"Resuming: {len(files_to_process) - len(pending)} of {len(files_to_process)} files already completed")
+
+    if config.reader.workers > 1 and len(pending) > 1:
+        _process_files_in_pool(files_to_process, pending, file_results, config, in_config, ff_loc, timer, journal)
+    else:
+        # File workers render their figures themselves; a render pool is only started for serial processing
+        render_workers = config.writer.render_workers if config.writer.save_visualizations else 0
+        with deferred_rendering(render_workers, ff_loc):
+            _process_files_serially(files_to_process, pending, file_results, config, in_config, ff_loc, timer, journal)
+
     all_results = []
-    total_files = len(files_to_process)
-    file_itr = 1
+    for results in file_results:
+        if results:
+            all_results.extend(results)
+    return all_results
 
-    for file_path in files_to_process:
-        try:
-            results, file_itr = process_single_file(file_path, config, in_config, ff_loc, file_itr, total_files)
-        except TypeError as e:
-            if "BARCODE" in str(e):
-                continue
-            print(e)
-            continue
-        except Exception as e:
-            print(f"Exception processing file: {file_path}")
-            print(f"{type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            with open(ff_loc, "a", encoding="utf-8") as log_file:
-                log_file.write(f"File: {file_path}, Exception: {str(e)}\n")
-            continue
 
-        if results == None:
-            print("No results computed.")
+def _process_files_serially(
+    files_to_process: List[FileProbe], pending: List[int], file_results: List[Optional[List[ChannelResults]]],
+    config: BarcodeConfig, in_config: InputConfig, ff_loc: str, timer: Timer, journal: Optional[ResultJournal],
+) -> None:
+    """Process the pending files one after another, storing their results in file_results."""
+    total_files = len(files_to_process)
+    total_workload = sum(files_to_process[idx].workload for idx in pending)
+    completed_workload = 0
+
+    for idx in pending:
+        probe = files_to_process[idx]
+        if completed_workload and total_workload:
+            timer.log_estimated_time_remaining(completed_workload / total_workload)
+        completed_workload += probe.workload
+        results, _, _ = process_file_safely(probe.filepath, config, in_config, ff_loc, idx + 1, total_files)
+        if results is None:
             continue
 
-        for result in results:
-            all_results.append(result)
+        file_results[idx] = results
+        if journal is not None:
+            journal.record(probe.filepath, results)
 
         # Timing and logging
         timer.log_time_since_last_log("Time Elapsed")
 
-    return all_results
 
+def _process_files_in_pool(
+    files_to_process: List[FileProbe], pending: List[int], file_results: List[Optional[List[ChannelResults]]],
+    config: BarcodeConfig, in_config: InputConfig, ff_loc: str, timer: Timer, journal: Optional[ResultJournal],
+) -> None:
+    """Process the pending files in a process pool, storing their results in file_results."""
+    total_files = len(files_to_process)
+    total_workload = sum(files_to_process[idx].workload for idx in pending)
+    completed_workload = 0
+    completed_files = 0
+    workers = min(config.reader.workers, len(pending))
+    vprint(f"Processing {len(pending)} files with {workers} workers")
+
+    # Error log writes from all processes are serialised through one lock
+    error_log_lock = multiprocessing.Lock()
+    set_error_log_lock(error_log_lock)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(error_log_lock, config.reader.verbose)
+        ) as executor:
+            futures = {
+                executor.submit(
+                    process_file_safely, files_to_process[idx].filepath, config, in_config, ff_loc, idx + 1, total_files
+                ): idx
+                for idx in pending
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                probe = files_to_process[idx]
+                try:
+                    results, _, elapsed = future.result()
+                except Exception as e:
+                    # The worker itself died (e.g. out of memory), so the file has no results
+                    print(f"Exception processing file: {probe.filepath}")
+                    print(f"{type(e).__name__}: {e}")
+                    write_error_log(ff_loc, f"File: {probe.filepath}, Exception: {str(e)}\n")
+                    results, elapsed = None, None
+
+                completed_files += 1
+                status = "done" if results is not None else "failed"
+                print(f"File {completed_files} of {len(pending)} {status}: {probe.filepath}")
+
+                file_results[idx] = results
+                if results is not None and journal is not None:
+                    journal.record(probe.filepath, results)
+                if elapsed is not None:
+                    timer.log_duration(elapsed, f"{os.path.basename(probe.filepath)} Time Elapsed")
+                completed_workload += probe.workload
+                if completed_workload < total_workload:
+                    timer.log_estimated_time_remaining(completed_workload / total_workload)
+    finally:
+        set_error_log_lock(None)
+
+
+def run_analysis(root_dir: str, config: BarcodeConfig, input_config: InputConfig, resume: bool = False) -> None:
+    """
+    Run analysis on a file or directory path.
 
-def run_analysis(root_dir: str, config: BarcodeConfig, input_config: InputConfig) -> None:
-    """Run analysis on a file or directory path."""
+    When processing a directory, the results of each completed file are saved to a
+    checkpoint journal, which is deleted once the summary has been saved. With resume=True,
+    files already in the journal of an interrupted run (unchanged, and analysed with the
+    same settings) are not processed again.
+    """
 
     # Set global verbose mode
     set_verbose(config.reader.verbose)
 
-    # Discover files to process
-    files_to_process = find_files(root_dir)
+    # Discover files and read their headers before any pixels are loaded
+    manifest = build_file_manifest(root_dir, config.reader.accept_dim_images)
     is_single_file = os.path.isfile(root_dir)
 
     if not is_single_file:
         vprint(root_dir)
 
-    base_path, base_name, ff_loc, time_filepath = setup_paths(root_dir, is_single_file)
+    base_path, base_name, ff_loc, time_filepath, manifest_filepath = setup_paths(root_dir, is_single_file)
+
+    if not is_single_file:
+        manifest_to_csv(manifest, manifest_filepath)
+
+    files_to_process = []
+    for probe in manifest:
+        if probe.is_valid:
+            files_to_process.append(probe)
+        else:
+            print(f"Skipping {probe.filepath}: {probe.rejection}")
+
+    # A single file has nothing to resume partway through, so only directory runs are journaled
+    journal = None
+    if not is_single_file:
+        journal = ResultJournal(os.path.join(base_path, base_name + " Checkpoint.jsonl"), hash_config(config))
+        if resume:
+            journal.load()
+        else:
+            journal.clear()
 
     timer = Timer(time_filepath)
     timer.start()
 
-    all_results = process_multiple_files(files_to_process, config, input_config, ff_loc, timer)
+    all_results = process_multiple_files(files_to_process, config, input_config, ff_loc, timer, journal)
 
     message = "Time Elapsed" + (" to Process Files" if is_single_file else " to Process Folder")
     timer.log_time_since_start(message)
     timer.stop()
 
     save_analysis_results(all_results, base_path, base_name, config, input_config, ff_loc, is_single_file)
+    # Every result is in the summary now, so the checkpoint is no longer needed
+    if journal is not None:
+        journal.remove()
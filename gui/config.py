@@ -18,6 +18,7 @@ class InputConfigGUI:
     configuration_file: tk.StringVar = field(init=False)
     length_units: tk.StringVar = field(init=False)
     time_units: tk.StringVar = field(init=False)
+    resume: tk.BooleanVar = field(init=False)
 
     def __post_init__(self):
         self.file_path = tk.StringVar(value=self._core_config.file_path)
@@ -26,6 +27,7 @@ class InputConfigGUI:
         self.configuration_file = tk.StringVar(value=self._core_config.configuration_file)
         self.length_units = tk.StringVar(value=self._core_config.length_units)
         self.time_units = tk.StringVar(value=self._core_config.time_units)
+        self.resume = tk.BooleanVar(value=self._core_config.resume)
 
     @property
     def config(self) -> InputConfig:
@@ -37,6 +39,7 @@ class InputConfigGUI:
             configuration_file=self.configuration_file.get(),
             length_units=self.length_units.get(),
             time_units=self.time_units.get(),
+            resume=self.resume.get(),
         )
 
     def update_gui(self, new_config: InputConfig):
@@ -48,6 +51,7 @@ class InputConfigGUI:
         self.configuration_file.set(new_config.configuration_file)
         self.length_units.set(new_config.length_units)
         self.time_units.set(new_config.time_units)
+        self.resume.set(new_config.resume)
 
 @dataclass
 class ReaderConfigGUI:
@@ -59,6 +63,12 @@ class ReaderConfigGUI:
     exposure_time: tk.DoubleVar = field(init=False)
     um_pixel_ratio: tk.DoubleVar = field(init=False)
     verbose: tk.BooleanVar = field(init=False)
+    workers: tk.IntVar = field(init=False)
+    flow_threads: tk.IntVar = field(init=False)
+    fused_branches: tk.BooleanVar = field(init=False)
+    use_result_cache: tk.BooleanVar = field(init=False)
+    result_cache_dir: tk.StringVar = field(init=False)
+    result_cache_size_mb: tk.IntVar = field(init=False)
 
     def __post_init__(self):
         self.accept_dim_channels = tk.BooleanVar(value=self._core_config.accept_dim_channels)
@@ -66,6 +76,12 @@ class ReaderConfigGUI:
         self.exposure_time = tk.DoubleVar(value=self._core_config.exposure_time)
         self.um_pixel_ratio = tk.DoubleVar(value=self._core_config.um_pixel_ratio)
         self.verbose = tk.BooleanVar(value=self._core_config.verbose)
+        self.workers = tk.IntVar(value=self._core_config.workers)
+        self.flow_threads = tk.IntVar(value=self._core_config.flow_threads)
+        self.fused_branches = tk.BooleanVar(value=self._core_config.fused_branches)
+        self.use_result_cache = tk.BooleanVar(value=self._core_config.use_result_cache)
+        self.result_cache_dir = tk.StringVar(value=self._core_config.result_cache_dir)
+        self.result_cache_size_mb = tk.IntVar(value=self._core_config.result_cache_size_mb)
 
     @property
     def config(self) -> ReaderConfig:
@@ -76,6 +92,12 @@ class ReaderConfigGUI:
             exposure_time=self.exposure_time.get(),
             um_pixel_ratio=self.um_pixel_ratio.get(),
             verbose=self.verbose.get(),
+            workers=self.workers.get(),
+            flow_threads=self.flow_threads.get(),
+            fused_branches=self.fused_branches.get(),
+            use_result_cache=self.use_result_cache.get(),
+            result_cache_dir=self.result_cache_dir.get(),
+            result_cache_size_mb=self.result_cache_size_mb.get(),
         )
 
     def update_gui(self, new_config: ReaderConfig):
@@ -86,6 +108,12 @@ class ReaderConfigGUI:
         self.exposure_time.set(new_config.exposure_time)
         self.um_pixel_ratio.set(new_config.um_pixel_ratio)
         self.verbose.set(new_config.verbose)
+        self.workers.set(new_config.workers)
+        self.flow_threads.set(new_config.flow_threads)
+        self.fused_branches.set(new_config.fused_branches)
+        self.use_result_cache.set(new_config.use_result_cache)
+        self.result_cache_dir.set(new_config.result_cache_dir)
+        self.result_cache_size_mb.set(new_config.result_cache_size_mb)
 
 @dataclass
 class WriterConfigGUI:
@@ -94,12 +122,18 @@ class WriterConfigGUI:
 
     generate_barcode: tk.BooleanVar = field(init=False)
     save_rds: tk.BooleanVar = field(init=False)
+    rds_format: tk.StringVar = field(init=False)
+    background_rds_writes: tk.BooleanVar = field(init=False)
     save_visualizations: tk.BooleanVar = field(init=False)
+    render_workers: tk.IntVar = field(init=False)
 
     def __post_init__(self):
         self.generate_barcode = tk.BooleanVar(value=self._core_config.generate_barcode)
         self.save_rds = tk.BooleanVar(value=self._core_config.save_rds)
+        self.rds_format = tk.StringVar(value=self._core_config.rds_format)
+        self.background_rds_writes = tk.BooleanVar(value=self._core_config.background_rds_writes)
         self.save_visualizations = tk.BooleanVar(value=self._core_config.save_visualizations)
+        self.render_workers = tk.IntVar(value=self._core_config.render_workers)
 
     @property
     def config(self) -> WriterConfig:
@@ -107,7 +141,10 @@ class WriterConfigGUI:
         return WriterConfig(
             generate_barcode=self.generate_barcode.get(),
             save_rds=self.save_rds.get(),
+            rds_format=self.rds_format.get(),
+            background_rds_writes=self.background_rds_writes.get(),
             save_visualizations=self.save_visualizations.get(),
+            render_workers=self.render_workers.get(),
         )
 
     def update_gui(self, new_config: WriterConfig):
@@ -115,7 +152,10 @@ class WriterConfigGUI:
         self._core_config = new_config
         self.generate_barcode.set(new_config.generate_barcode)
         self.save_rds.set(new_config.save_rds)
+        self.rds_format.set(new_config.rds_format)
+        self.background_rds_writes.set(new_config.background_rds_writes)
         self.save_visualizations.set(new_config.save_visualizations)
+        self.render_workers.set(new_config.render_workers)
 
 @dataclass
 class ChannelConfigGUI:
@@ -156,6 +196,7 @@ class BinarizationConfigGUI:
     minimum_island_size: tk.IntVar = field(init=False)
     enable_physical_units: tk.BooleanVar = field(init=False)
     invert_binarization: tk.BooleanVar = field(init=False)
+    single_precision_autocorrelation: tk.BooleanVar = field(init=False)
 
     def __post_init__(self):
         self.threshold_offset = tk.DoubleVar(value=self._core_config.threshold_offset)
@@ -166,6 +207,7 @@ class BinarizationConfigGUI:
         self.minimum_island_size = tk.IntVar(value=self._core_config.minimum_island_size)
         self.enable_physical_units = tk.BooleanVar(value=self._core_config.enable_physical_units)
         self.invert_binarization = tk.BooleanVar(value=self._core_config.invert_binarization)
+        self.single_precision_autocorrelation = tk.BooleanVar(value=self._core_config.single_precision_autocorrelation)
 
     @property
     def config(self) -> BinarizationConfig:
@@ -179,6 +221,7 @@ class BinarizationConfigGUI:
             minimum_island_size=self.minimum_island_size.get(),
             enable_physical_units=self.enable_physical_units.get(),
             invert_binarization=self.invert_binarization.get(),
+            single_precision_autocorrelation=self.single_precision_autocorrelation.get(),
         )
 
     def update_gui(self, new_config: BinarizationConfig):
@@ -192,6 +235,7 @@ class BinarizationConfigGUI:
         self.minimum_island_size.set(new_config.minimum_island_size)
         self.enable_physical_units.set(new_config.enable_physical_units)
         self.invert_binarization.set(new_config.invert_binarization)
+        self.single_precision_autocorrelation.set(new_config.single_precision_autocorrelation)
 
 @dataclass
 class OpticalFlowConfigGUI:
@@ -202,12 +246,26 @@ class OpticalFlowConfigGUI:
     win_size: tk.IntVar = field(init=False)
     downsample: tk.IntVar = field(init=False)
     percentage_frames_evaluated: tk.DoubleVar = field(init=False)
+    flow_backend: tk.StringVar = field(init=False)
+    prebin_factor: tk.IntVar = field(init=False)
+    pyr_scale: tk.DoubleVar = field(init=False)
+    levels: tk.IntVar = field(init=False)
+    iterations: tk.IntVar = field(init=False)
+    poly_n: tk.IntVar = field(init=False)
+    poly_sigma: tk.DoubleVar = field(init=False)
 
     def __post_init__(self):
         self.frame_step = tk.IntVar(value=self._core_config.frame_step)
         self.win_size = tk.IntVar(value=self._core_config.win_size)
         self.downsample = tk.IntVar(value=self._core_config.downsample)
         self.percentage_frames_evaluated = tk.DoubleVar(value=self._core_config.percentage_frames_evaluated)
+        self.flow_backend = tk.StringVar(value=self._core_config.flow_backend)
+        self.prebin_factor = tk.IntVar(value=self._core_config.prebin_factor)
+        self.pyr_scale = tk.DoubleVar(value=self._core_config.pyr_scale)
+        self.levels = tk.IntVar(value=self._core_config.levels)
+        self.iterations = tk.IntVar(value=self._core_config.iterations)
+        self.poly_n = tk.IntVar(value=self._core_config.poly_n)
+        self.poly_sigma = tk.DoubleVar(value=self._core_config.poly_sigma)
 
     @property
     def config(self) -> OpticalFlowConfig:
@@ -217,6 +275,13 @@ class OpticalFlowConfigGUI:
             win_size=self.win_size.get(),
             downsample=self.downsample.get(),
             percentage_frames_evaluated=self.percentage_frames_evaluated.get(),
+            flow_backend=self.flow_backend.get(),
+            prebin_factor=self.prebin_factor.get(),
+            pyr_scale=self.pyr_scale.get(),
+            levels=self.levels.get(),
+            iterations=self.iterations.get(),
+            poly_n=self.poly_n.get(),
+            poly_sigma=self.poly_sigma.get(),
         )
 
     def update_gui(self, new_config: OpticalFlowConfig):
@@ -226,6 +291,13 @@ class OpticalFlowConfigGUI:
         self.win_size.set(new_config.win_size)
         self.downsample.set(new_config.downsample)
         self.percentage_frames_evaluated.set(new_config.percentage_frames_evaluated)
+        self.flow_backend.set(new_config.flow_backend)
+        self.prebin_factor.set(new_config.prebin_factor)
+        self.pyr_scale.set(new_config.pyr_scale)
+        self.levels.set(new_config.levels)
+        self.iterations.set(new_config.iterations)
+        self.poly_n.set(new_config.poly_n)
+        self.poly_sigma.set(new_config.poly_sigma)
 
 @dataclass
 class IntensityDistributionConfigGUI:
@@ -283,25 +355,11 @@ class PreviewConfigGUI:
     def sample_preview(self) -> np.ndarray:
         if self._sample_preview is None or self._sample_file.get() != self.sample_file.get():
             filepath = self.sample_file.get()
-            if filepath.endswith(('.avi', '.mp4')):
-                frames = []
-                container = av.open(filepath)
-                for frame in container.decode(video=0):
-                    frames.append(frame.to_ndarray(format='gray'))
-                file = np.array(frames)
-                file = np.expand_dims(file, axis = 3) if len(file.shape) == 3 else file
-            elif filepath.endswith(('.tif', '.tiff')):
-                file = iio.imread(filepath)
-                file = np.expand_dims(file, axis = 3) if len(file.shape) == 3 else file
-                if file.shape[3] != min(file.shape):
-                    file = np.swapaxes(np.swapaxes(file, 1, 2), 2, 3)
-            elif filepath.endswith('.nd2'):
-                with nd2.ND2File(filepath) as ndfile:
-                    if (len(ndfile.sizes) < 5 and (not 'Z' in ndfile.sizes) and 
-                        'T' in ndfile.sizes and len(ndfile.shape) > 2 and ndfile.sizes['T'] > 5):
-                        file = ndfile.asarray()
-                        file = np.expand_dims(file, axis = 1) if len(file.shape) == 3 else file
-                        file = np.swapaxes(np.swapaxes(file, 1, 2), 2, 3)
+            if filepath.endswith(('.avi', '.mp4', '.tif', '.tiff', '.nd2')):
+                from utils.reader import open_frame_source
+                # Each channel is stored as a contiguous (T, Y, X) stack, so previews slice it without copying
+                with open_frame_source(filepath) as source:
+                    file = source.read_stacks()
             else:
                 file = np.ones((3, 256, 256, 1))
             self._sample_preview = file
@@ -462,117 +520,21 @@ class VisualizationConfigGUI:
         self._frames = list(self._core_config._frames)
         self._indices = list(self._core_config._indices)
 
-    def append(self, major_arr, minor_arr):
-        if not isinstance(major_arr, np.ndarray):
-            major_arr = np.expand_dims(minor_arr, axis = 0)
-        else:
-            minor_arr = np.expand_dims(minor_arr, axis = 0)
-            major_arr = np.append(major_arr, minor_arr, axis=0)
-        return major_arr
-        
     def read_of_rds(self, path: str) -> tuple[np.ndarray, list]:
         '''
-        Reads flow fields from a BARCODE-generated CSV file into two arrays with dimension (num_frames, width, height)
-        and one array with the index of the flow fields
+        Reads flow fields from a BARCODE-generated CSV file into an array with dimension (num_frames, height, width, 2)
+        and a list with the frame pair of each flow field
         '''
-        flow_field_x = None
-        flow_field_y = None
-        flow_field_indices = []
-        with open(path, 'r') as file:
-            csvreader = csv.reader(file)
-            x_flag = True
-            x_field = None
-            y_field = None
-            for row in csvreader:
-                if len(row) == 0:
-                    continue
-                elif len(row) == 1:
-                    if str(row[0]).startswith('X'):
-                        x_flag = True
-                    if str(row[0]).startswith('Y'):
-                        x_flag = False
-                    if str(row[0]).startswith('Flow Field'):
-                        flow_idx = int(str(row[0]).split('-')[0].split(' ')[2][1:])
-                        flow_idx2 = int(str(row[0]).split('-')[1][:-1])
-                        # print(flow_idx, flow_idx2)
-                        flow_field_indices.append([flow_idx, flow_idx2])
-                        x_flag = True
-                        if isinstance(x_field, np.ndarray):
-                            flow_field_x = self.append(flow_field_x, x_field)
-                            flow_field_y = self.append(flow_field_y, y_field)
-                            x_field = None
-                            y_field = None
-                else:
-                    row = np.array(np.float64(row))
-                    if x_flag:
-                        x_field = np.vstack((x_field, row)) if isinstance(x_field, np.ndarray) else row
-                    else:
-                        y_field = np.vstack((y_field, row)) if isinstance(y_field, np.ndarray) else row
-                            
-            if isinstance(x_field, np.ndarray):
-                flow_field_x = self.append(flow_field_x, x_field)
-                flow_field_y = self.append(flow_field_y, y_field)
-                x_field = None
-                y_field = None
-        flow_field_x = np.expand_dims(flow_field_x, axis=3)
-        flow_field_y = np.expand_dims(flow_field_y, axis=3)
-        flow_field = np.append(flow_field_x, flow_field_y, axis=3)
-        return flow_field, flow_field_indices
+        from utils.csv_rds import read_flow_field_csv
+        return read_flow_field_csv(path)
 
     def read_ib_rds(self, path: str) -> tuple[np.ndarray, list]:
-        bin_frame_indices = []
-        bin_frames = None
-        with open(path, 'r') as file:
-            bin_frame = None
-            csvreader = csv.reader(file)
-            for row in csvreader:
-                if len(row) == 0:
-                    continue
-                if len(row) == 1:
-                    bin_frame_indices.append(int(row[0].removeprefix("Frame ")))
-                    if isinstance(bin_frame, np.ndarray):
-                        bin_frames = self.append(bin_frames, bin_frame)
-                        bin_frame=None
-                else:
-                    row = np.array(np.float64(row))
-                    row = row.astype(int)
-                    if not isinstance(bin_frame, np.ndarray):
-                        bin_frame = row
-                    else:
-                        bin_frame = np.vstack((bin_frame, row))
-            if isinstance(bin_frame, np.ndarray):
-                bin_frames = self.append(bin_frames, bin_frame)
-                bin_frame=None
-        return bin_frames, bin_frame_indices
+        from utils.csv_rds import read_binarization_csv
+        return read_binarization_csv(path)
 
     def read_field_rds(self, path: str) -> tuple[np.ndarray, list]:
-        field_indices = []
-        fields = []
-        with open(path, 'r') as file:
-            field_frame = None
-            csvreader = csv.reader(file)
-            for row in csvreader:
-                if len(row) == 0:
-                    continue
-                elif len(row) == 1:
-                    if str(row[0]).startswith('Flow Field'):
-                        flow_idx = int(str(row[0]).split('-')[0].split(' ')[2][1:])
-                        flow_idx2 = int(str(row[0]).split('-')[1][:-1])
-                        # print(flow_idx, flow_idx2)
-                        field_indices.append([flow_idx, flow_idx2])
-                    if isinstance(field_frame, np.ndarray):
-                        fields = self.append(fields, field_frame)
-                        field_frame = None
-                else:
-                    row = np.array(np.float64(row))
-                    if not isinstance(field_frame, np.ndarray):
-                        field_frame = row
-                    else:
-                        field_frame = np.vstack((field_frame, row))
-            if isinstance(field_frame, np.ndarray):
-                fields = self.append(fields, field_frame)
-                field_frame =None
-        return fields, field_indices
+        from utils.csv_rds import read_field_csv
+        return read_field_csv(path)
 
     def read_id_rds(self, path: str) -> tuple[list, np.ndarray]:
         frame_nums = []
@@ -627,7 +589,7 @@ class VisualizationConfigGUI:
             frame_nums = []
             frame_dists = []
             filepath = self.file_path.get()
-            if not (os.path.exists(filepath) and filepath.endswith('.csv')):
+            if not (os.path.exists(filepath) and filepath.endswith(('.csv', '.rds'))):
                 return [None] * 3
             rds_map = {
                 'BinarizationData': ('Image_Binarization', self.read_ib_rds),
@@ -642,7 +604,11 @@ class VisualizationConfigGUI:
                 if key in filepath:
                     branch_name, rds_function = rds_map[key]
                     self.rds_type.set(branch_name)
-                    rds_results = rds_function(filepath)
+                    if filepath.endswith('.rds'):
+                        from utils.binary_rds import read_binary_rds
+                        rds_results = read_binary_rds(filepath)
+                    else:
+                        rds_results = rds_function(filepath)
                     self._frames = rds_results[0]
                     self._indices = rds_results[1]
                     self._file_path.set(filepath)
@@ -84,7 +84,7 @@ def create_visualization_frame(parent, barcode_config: BarcodeConfigGUI, config:
 
     # File/Directory Selection
     def browse_file():
-        chosen = filedialog.askopenfilename(filetypes=[("CSV File", "*.csv")], title="Select a File")
+        chosen = filedialog.askopenfilename(filetypes=[("CSV File", "*.csv"), ("Binary RDS File", "*.rds")], title="Select a File")
         if chosen:
             config.file_path.set(chosen)
 
@@ -66,6 +66,15 @@ def create_binarization_frame(
     )
     row_b += 1
 
+    create_option_section(
+        frame,
+        row_b,
+        cb.single_precision_autocorrelation,
+        "Single Precision Autocorrelation",
+        "Compute the structural autocorrelation in single precision, which is faster but can change the correlation length slightly."
+    )
+    row_b += 1
+
 
     # Binarization Threshold with scale
     threshold_label = tk.Label(frame, text="Binarization Threshold:")
@@ -1,5 +1,5 @@
 import tkinter as tk
-from tkinter import ttk, filedialog
+from tkinter import ttk, filedialog, messagebox
 from utils.gui import create_option_section, create_popup
 
 # from core import BarcodeConfig, InputConfig
@@ -83,6 +83,16 @@ def create_execution_frame(parent, config: BarcodeConfigGUI, input_config: Input
     browse_folder_btn.grid(row=row_idx, sticky="w", column=2, padx=5)
     row_idx += 1
 
+    create_option_section(
+        frame,
+        row_idx,
+        ci.resume,
+        "Resume Interrupted Run",
+        "Reuse the results of files completed by a previous run of the same data with the same settings (saved in the Checkpoint.jsonl file " \
+        "next to the Summary CSV), and only process the remaining files.",
+    )
+    row_idx += 2
+
     tk.Label(frame, text="Select Channels", font=header).grid(
         row=row_idx, column=0, columnspan=3, sticky="w", padx=(5, 5), pady=(10, 5)
     )
@@ -233,6 +243,84 @@ def create_execution_frame(parent, config: BarcodeConfigGUI, input_config: Input
     )
     row_idx += 2
 
+    tk.Label(frame, text="Parallel Processing", font=header).grid(
+        row=row_idx, column=0, columnspan=3, sticky="w", padx=(5, 5), pady=(10, 5)
+    )
+    row_idx += 1
+
+    workers_label = tk.Label(frame, text="Worker Processes (1 - 64)")
+    workers_label.grid(row=row_idx, column=0, sticky="w", padx=5, pady=5)
+    workers_spin = ttk.Spinbox(
+        frame, from_=1, to=64,
+        increment=1,
+        textvariable=cr.workers,
+        width=5
+    )
+    workers_spin.grid(row=row_idx, column=1, padx=5, pady=5)
+    create_popup(frame, "Number of files processed at the same time when scanning a directory. Each worker holds one file in memory, so " \
+                 "keep this at or below the number of CPU cores and the memory available.", row_idx, workers_label)
+    row_idx += 1
+
+    flow_threads_label = tk.Label(frame, text="Optical Flow Threads (1 - 64)")
+    flow_threads_label.grid(row=row_idx, column=0, sticky="w", padx=5, pady=5)
+    flow_threads_spin = ttk.Spinbox(
+        frame, from_=1, to=64,
+        increment=1,
+        textvariable=cr.flow_threads,
+        width=5
+    )
+    flow_threads_spin.grid(row=row_idx, column=1, padx=5, pady=5)
+    create_popup(frame, "Number of threads computing optical flow fields for frame pairs of the same file. When also using several " \
+                 "worker processes, keep workers times threads at or below the number of CPU cores.", row_idx, flow_threads_label)
+    row_idx += 1
+
+    create_option_section(
+        frame,
+        row_idx,
+        cr.fused_branches,
+        "Fuse Analysis Branches",
+        "Run all selected branches of a channel in one pass over the video, reading every frame once instead of once per branch. " \
+        "Results are identical to running the branches one after another.",
+    )
+    row_idx += 2
+
+    tk.Label(frame, text="Result Cache", font=header).grid(
+        row=row_idx, column=0, columnspan=3, sticky="w", padx=(5, 5), pady=(10, 5)
+    )
+    row_idx += 1
+
+    create_option_section(
+        frame,
+        row_idx,
+        cr.use_result_cache,
+        "Use Result Cache",
+        "Save the results of each branch for every file, and reuse them when the same file is processed again with the same branch settings. " \
+        "Cached results are only reused when graphs and reduced data structures are not being saved.",
+    )
+    row_idx += 2
+
+    cache_size_label = tk.Label(frame, text="Cache Size Limit [MB]")
+    cache_size_label.grid(row=row_idx, column=0, sticky="w", padx=5, pady=5)
+    cache_size_spin = ttk.Spinbox(
+        frame, from_=1, to=10**6,
+        increment=128,
+        textvariable=cr.result_cache_size_mb,
+        width=9
+    )
+    cache_size_spin.grid(row=row_idx, column=1, padx=5, pady=5)
+
+    def clear_result_cache():
+        from core.cache import ResultCache
+        cache = ResultCache(cr.result_cache_dir.get())
+        removed = cache.clear()
+        messagebox.showinfo("Result Cache", f"Removed {removed} cached results.")
+
+    tk.Button(frame, text="Clear Cache", command=clear_result_cache).grid(
+        row=row_idx, column=2, sticky="w", padx=5
+    )
+    create_popup(frame, "When the cache grows past this size, the least recently used results are removed.", row_idx, cache_size_label)
+    row_idx += 1
+
     tk.Label(frame, text="Output Settings", font=header).grid(
         row=row_idx, column=0, columnspan=3, sticky="w", padx=(5, 5), pady=(10, 5)
     )
@@ -256,6 +344,19 @@ def create_execution_frame(parent, config: BarcodeConfigGUI, input_config: Input
     )
     row_idx += 2
 
+    render_workers_label = tk.Label(frame, text="Graph Rendering Processes (0 - 64)")
+    render_workers_label.grid(row=row_idx, column=0, sticky="w", padx=5, pady=5)
+    render_workers_spin = ttk.Spinbox(
+        frame, from_=0, to=64,
+        increment=1,
+        textvariable=co.render_workers,
+        width=5
+    )
+    render_workers_spin.grid(row=row_idx, column=1, padx=5, pady=5)
+    create_popup(frame, "Number of processes drawing and saving the graphs while the analysis continues. With 0, graphs are drawn " \
+                 "during the analysis. Only used when files are processed by a single worker process.", row_idx, render_workers_label)
+    row_idx += 1
+
     create_option_section(
         frame,
         row_idx,
@@ -265,6 +366,29 @@ def create_execution_frame(parent, config: BarcodeConfigGUI, input_config: Input
     )
     row_idx += 2
 
+    rds_format_label = tk.Label(frame, text="Reduced Data Structure Format")
+    rds_format_label.grid(row=row_idx, column=0, sticky="w", padx=5, pady=5)
+    rds_format_combo = ttk.Combobox(
+        frame,
+        textvariable=co.rds_format,
+        values=["csv", "binary"],
+        state="readonly",
+        width=7,
+    )
+    rds_format_combo.grid(row=row_idx, column=1, padx=5, pady=5)
+    create_popup(frame, "Format of the saved reduced data structures. CSV files can be opened in any spreadsheet program; binary .RDS files " \
+                 "are several times smaller and faster to write, and any frame can be loaded without reading the rest of the file.", row_idx, rds_format_label)
+    row_idx += 1
+
+    create_option_section(
+        frame,
+        row_idx,
+        co.background_rds_writes,
+        "Write Reduced Data Structures in Background",
+        "Format and save reduced data structures on a separate thread while the analysis continues, holding at most 256 MB of unsaved data per file.",
+    )
+    row_idx += 2
+
     create_option_section(
         frame,
         row_idx,
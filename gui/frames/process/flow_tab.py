@@ -1,6 +1,5 @@
 import os, threading
 from typing import Tuple, TypeAlias
-import cv2 as cv
 import numpy as np
 import matplotlib.ticker as ticker
 from matplotlib.figure import Figure
@@ -11,18 +10,18 @@ from tkinter import ttk, filedialog
 import matplotlib.pyplot as plt
 plt.style.use('utils/presentation.mplstyle')
 from utils import groupAvg
+from utils.optical_flow import FLOW_BACKENDS, create_flow_backend, flow_downsample
 from utils.gui import create_popup, save_preview_image, save_preview_video, os_right_click
 from gui.config import BarcodeConfigGUI, InputConfigGUI, PreviewConfigGUI, ReaderConfigGUI, OpticalFlowConfigGUI
 FramePair: TypeAlias = Tuple[int, int]
 
 def calculate_optical_flow(video: np.ndarray, frame_pair: tuple[int, int], 
                            flow_config: OpticalFlowConfigGUI, in_config: ReaderConfigGUI):
-    win_size = flow_config.win_size.get()
-    downsample = flow_config.downsample.get()
+    downsample = flow_downsample(flow_config.config)
     exposure_time = in_config.exposure_time.get()
     um_pix_ratio = in_config.um_pixel_ratio.get()
     start, stop = frame_pair
-    flow = cv.calcOpticalFlowFarneback(video[start], video[stop], None, 0.5, 3, win_size, 3, 5, 1.2, 0)
+    flow = create_flow_backend(flow_config.config).compute(video[start], video[stop])
     flow_reduced = groupAvg(flow, downsample)
     downU = flow_reduced[:,:,0]
     downV = flow_reduced[:,:,1]
@@ -107,6 +106,62 @@ def create_flow_frame(parent, config: BarcodeConfigGUI, preview_config: PreviewC
     row_f, downsample_label)
     row_f += 1
 
+    prebin_label = tk.Label(frame, text="Pre-binning Factor")
+    prebin_label.grid(row=row_f, column=0, sticky="w", padx=5, pady=5)
+    prebin_spin = ttk.Combobox(
+        frame,
+        textvariable=co.prebin_factor,
+        values=[1, 2, 4, 8],
+        width=7,
+    )
+    prebin_spin.grid(row=row_f, column=1, padx=5, pady=5)
+    create_popup(frame, "Average blocks of pixels before calculating the optical flow field, which is much faster for large downsampling factors. " \
+    "Must divide the downsampling factor; 1 calculates the flow field at full resolution.",
+    row_f, prebin_label)
+    row_f += 1
+
+    backend_label = tk.Label(frame, text="Optical Flow Method")
+    backend_label.grid(row=row_f, column=0, sticky="w", padx=5, pady=5)
+    backend_menu = ttk.Combobox(
+        frame,
+        textvariable=co.flow_backend,
+        values=list(FLOW_BACKENDS),
+        width=20,
+        state="readonly"
+    )
+    backend_menu.grid(row=row_f, column=1, padx=5, pady=5)
+    create_popup(frame, "Algorithm used to calculate optical flow fields. \"farneback\" is the default. \"farneback_warm_start\" starts each " \
+    "flow field from the previous one, which converges faster on steadily moving material. The \"dis\" methods (Dense Inverse Search) are much " \
+    "faster and less precise, from ultrafast (fastest) to medium (most precise), and do not use the window size or Farneback settings.",
+    row_f, backend_label)
+    row_f += 1
+
+    levels_label = tk.Label(frame, text="Farneback Pyramid Levels")
+    levels_label.grid(row=row_f, column=0, sticky="w", padx=5, pady=5)
+    levels_spin = ttk.Spinbox(
+        frame, from_=1, to=10,
+        increment=1,
+        textvariable=co.levels,
+        width=7
+    )
+    levels_spin.grid(row=row_f, column=1, padx=5, pady=5)
+    create_popup(frame, "Number of image pyramid levels used by the Farneback method. More levels can follow larger movements between frames.",
+    row_f, levels_label)
+    row_f += 1
+
+    iterations_label = tk.Label(frame, text="Farneback Iterations")
+    iterations_label.grid(row=row_f, column=0, sticky="w", padx=5, pady=5)
+    iterations_spin = ttk.Spinbox(
+        frame, from_=1, to=20,
+        increment=1,
+        textvariable=co.iterations,
+        width=7
+    )
+    iterations_spin.grid(row=row_f, column=1, padx=5, pady=5)
+    create_popup(frame, "Number of iterations the Farneback method runs at each pyramid level. Fewer iterations are faster but less precise.",
+    row_f, iterations_label)
+    row_f += 1
+
     frame_number_label = tk.Label(frame, text="Preview Frame Number:")
     frame_number_label.grid(
         row=row_f, column = 0, sticky="w", padx=5, pady=5
@@ -329,6 +384,10 @@ def create_flow_frame(parent, config: BarcodeConfigGUI, preview_config: PreviewC
     co.frame_step.trace_add("write", update_preview)
     co.win_size.trace_add("write", update_preview)
     co.downsample.trace_add("write", update_preview)
+    co.prebin_factor.trace_add("write", update_preview)
+    co.flow_backend.trace_add("write", update_preview)
+    co.levels.trace_add("write", update_preview)
+    co.iterations.trace_add("write", update_preview)
     ci.dir_path.trace_add("write", update_sample_file_options)
     cp.preview_frame_number.trace_add("write", update_preview)
 
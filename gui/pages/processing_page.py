@@ -79,7 +79,7 @@ def create_processing_worker(
                 return
 
             dir_name = dir_path if dir_path else file_path
-            run_analysis(dir_name, config, input_config)
+            run_analysis(dir_name, config, input_config, resume=input_config.resume)
 
         except Exception as e:
             print(f"Error during processing: {e}")
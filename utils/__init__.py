@@ -1,7 +1,11 @@
+import sys
+from functools import lru_cache
 from utils.timing import Timer
 import numpy as np
 # Global verbose setting
 _VERBOSE = False
+# Lock shared by worker processes appending to the same error log
+_ERROR_LOG_LOCK = None
 
 def set_verbose(verbose: bool):
     """Set global verbose mode."""
@@ -13,6 +17,28 @@ def vprint(*args, **kwargs):
     if _VERBOSE:
         print(*args, **kwargs, flush=True)
 
+def restore_standard_streams():
+    """
+    Point sys.stdout and sys.stderr back at the process's own streams. Worker processes
+    inherit the GUI's redirection into its Tk log window, which only the GUI process can use.
+    """
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+def set_error_log_lock(lock):
+    """Set the lock used to serialise writes to the error log."""
+    global _ERROR_LOG_LOCK
+    _ERROR_LOG_LOCK = lock
+
+def write_error_log(filepath: str, *messages: str):
+    """Append messages to the error log as a single uninterrupted write."""
+    if _ERROR_LOG_LOCK is None:
+        with open(filepath, "a", encoding="utf-8") as log_file:
+            log_file.write("".join(messages))
+        return
+    with _ERROR_LOG_LOCK:
+        with open(filepath, "a", encoding="utf-8") as log_file:
+            log_file.write("".join(messages))
+
 class MyException(Exception):
     pass
 
@@ -23,6 +49,69 @@ def groupAvg(arr, N):
     result[:,1:] = result[:,1:] - result[:,:-1]
     return result
 
+@lru_cache(maxsize=16)
+def radial_profile_plan(shape: tuple):
+    """
+    Radial bin of every pixel of a frame centred on (nx/2, ny/2), and the number of pixels in each bin.
+
+    Bins are [r, r + 1) for r = 0, 1, ..., with the last bin closed, up to max(nx, ny)/2 (as
+    np.histogram with those edges). Pixels further away are put in one extra bin past the end.
+    Cached by shape, since every frame of a video has the same shape.
+    """
+    nx, ny = shape
+    dists = np.sqrt(np.arange(-1*nx/2, nx/2)[:,None]**2 + np.arange(-1*ny/2, ny/2)[None,:]**2).ravel()
+    edges = np.arange(max(nx,ny)/2+1)
+    num_bins = len(edges) - 1
+    bin_indices = np.floor(dists).astype(np.intp)
+    bin_indices[dists == edges[-1]] = num_bins - 1
+    bin_indices[dists > edges[-1]] = num_bins
+    counts = np.bincount(bin_indices, minlength=num_bins + 1)[:num_bins]
+    bin_indices.setflags(write=False)
+    counts.setflags(write=False)
+    return bin_indices, counts
+
+def radial_average(frame: np.ndarray):
+    """
+    Average of a frame over rings of unit width around its centre (see radial_profile_plan).
+
+    A stack of frames (frames x nx x ny) gives one profile per frame, from a single bincount.
+    """
+    bin_indices, counts = radial_profile_plan(frame.shape[-2:])
+    num_bins = len(counts) + 1
+    if frame.ndim == 2:
+        return np.bincount(bin_indices, weights=frame.ravel(), minlength=num_bins)[:-1]/counts
+    # Offset the bins of each frame so every frame's rings are summed separately
+    num_frames = frame.shape[0]
+    stack_indices = (np.arange(num_frames)[:, None] * num_bins + bin_indices[None, :]).ravel()
+    sums = np.bincount(stack_indices, weights=frame.ravel(), minlength=num_frames * num_bins)
+    return sums.reshape(num_frames, num_bins)[:, :-1]/counts
+
+def find_correlation_lengths(profiles: np.ndarray, xvalues: np.ndarray, threshold: float, interpolate: bool = False):
+    """
+    Distance at which each radial correlation profile (frames x radii) first drops below a threshold.
+
+    The crossing is the first i with profile[i] > threshold >= profile[i + 1]; the result is
+    the xvalue of whichever of those two points is closer to the threshold (the second on a
+    tie), or the linearly interpolated crossing position if interpolate. Profiles that never
+    cross give NaN. A single profile gives a single length.
+    """
+    single = np.ndim(profiles) == 1
+    profiles = np.atleast_2d(profiles)
+    lengths = np.full(len(profiles), np.nan)
+    if profiles.shape[1] >= 2:
+        crossings = (profiles[:, :-1] > threshold) & (profiles[:, 1:] <= threshold)
+        found = crossings.any(axis=1)
+        first = np.argmax(crossings, axis=1)[found]
+        before = profiles[found, first]
+        after = profiles[found, first + 1]
+        if interpolate:
+            fraction = (before - threshold)/(before - after)
+            lengths[found] = xvalues[first] + fraction * (xvalues[first + 1] - xvalues[first])
+        else:
+            nearer_before = np.abs(before - threshold) < np.abs(after - threshold)
+            lengths[found] = np.where(nearer_before, xvalues[first], xvalues[first + 1])
+    return lengths[0] if single else lengths
+
 def average_largest(lst, percent = 0.1):
     new_lst = sorted(lst, reverse=True)
     length = len(new_lst)
@@ -51,4 +140,6 @@ __all__ = [
     "Timer",
     "vprint",
     "set_verbose",
+    "set_error_log_lock",
+    "write_error_log",
 ]
\ No newline at end of file
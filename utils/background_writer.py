@@ -0,0 +1,97 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+# Maximum size (bytes) of the arrays waiting to be written by one background RDS writer
+_RDS_QUEUE_BYTES = 1 << 28
+
+
+def _nbytes(arg) -> int:
+    if isinstance(arg, np.ndarray):
+        return arg.nbytes
+    if isinstance(arg, (list, tuple)):
+        return 8 * len(arg)
+    return 0
+
+
+class BackgroundRDSWriter:
+    """
+    Writes reduced data structures on a background thread, so that formatting and disk I/O
+    overlap with the analysis.
+
+    write_*_rds calls on this writer are queued in order and replayed on the wrapped writer by
+    a single thread. The queue holds at most max_bytes of arrays (but always at least one call),
+    and callers block while it is full. The arrays passed must not be modified afterwards. An
+    error on the writer thread is raised by the next call, flush() or close().
+    """
+
+    def __init__(self, writer, file, max_bytes: int = _RDS_QUEUE_BYTES):
+        self.writer = writer
+        self._file = file
+        self.max_bytes = max_bytes
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._condition = threading.Condition()
+        self._error = None
+        self._error_raised = False
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="RDS writer", daemon=True)
+        self._thread.start()
+
+    def _raise_error(self):
+        if self._error is not None:
+            self._error_raised = True
+            raise RuntimeError("Writing reduced data structures failed") from self._error
+
+    def submit(self, write, *args):
+        """Queue write(writer, *args), blocking while the queue is full."""
+        size = sum(_nbytes(arg) for arg in args)
+        with self._condition:
+            if self._closing:
+                raise ValueError("Reduced data structure writer is closed")
+            while self._queue and self._queued_bytes + size > self.max_bytes and self._error is None:
+                self._condition.wait()
+            self._raise_error()
+            self._queue.append((write, args, size))
+            self._queued_bytes += size
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closing:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                write, args, size = self._queue[0]
+                skip = self._error is not None
+            try:
+                # After an error the remaining calls are dropped, so the file ends at the failed write
+                if not skip:
+                    write(self.writer, *args)
+            except BaseException as e:
+                with self._condition:
+                    self._error = e
+            with self._condition:
+                self._queue.popleft()
+                self._queued_bytes -= size
+                self._condition.notify_all()
+
+    def flush(self):
+        """Wait until every queued call is written, then flush the file."""
+        with self._condition:
+            while self._queue:
+                self._condition.wait()
+            self._raise_error()
+        self._file.flush()
+
+    def close(self):
+        """Write every queued call and close the file, raising any error not raised yet."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._file.close()
+        if not self._error_raised:
+            self._raise_error()
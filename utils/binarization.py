@@ -1,6 +1,9 @@
+from dataclasses import dataclass
 import numpy as np
+from scipy import fft
+from skimage.measure import label
 from skimage.morphology import remove_small_holes, remove_small_objects
-from utils import groupAvg
+from utils import groupAvg, radial_average
 
 def invert_frame(arr):
     ones_arr = np.ones(shape = arr.shape)
@@ -15,11 +18,85 @@ def binarize(frame: np.ndarray, offset_threshold: float, binning_factor: int, mi
     new_frame = remove_small_holes(new_frame, min_size + 1, connectivity=2).astype(int)
     return new_frame
 
+@dataclass
+class BinaryFrameLabels:
+    """Connected components (connectivity 2) of the islands and voids of a binarized frame."""
+    islands: np.ndarray
+    num_islands: int
+    voids: np.ndarray
+    num_voids: int
+
+def label_binary_frame(frame: np.ndarray) -> BinaryFrameLabels:
+    """Label the islands (nonzero pixels) and voids (zero pixels) of a binarized frame, once each."""
+    islands, num_islands = label(frame != 0, connectivity=2, return_num=True)
+    voids, num_voids = label(frame == 0, connectivity=2, return_num=True)
+    return BinaryFrameLabels(islands, num_islands, voids, num_voids)
+
+def region_areas(labels: np.ndarray, num_regions: int) -> np.ndarray:
+    """Area (in pixels) of each labeled region, ordered by label."""
+    return np.bincount(labels.ravel(), minlength=num_regions + 1)[1:]
+
+def region_shape_properties(labels: np.ndarray, num_regions: int) -> dict:
+    """
+    Area, centroid and major/minor axis lengths of every labeled region, ordered by label.
+
+    Equivalent to skimage's regionprops_table for these properties, but computed for
+    all regions at once from per-pixel sums instead of region by region.
+    """
+    rows, cols = np.nonzero(labels)
+    pixel_labels = labels[rows, cols]
+    area = np.bincount(pixel_labels, minlength=num_regions + 1)[1:].astype(float)
+    centroid_row = np.bincount(pixel_labels, rows, minlength=num_regions + 1)[1:] / area
+    centroid_col = np.bincount(pixel_labels, cols, minlength=num_regions + 1)[1:] / area
+
+    # Central second moments about each region's centroid
+    d_row = rows - centroid_row[pixel_labels - 1]
+    d_col = cols - centroid_col[pixel_labels - 1]
+    mu_rr = np.bincount(pixel_labels, d_row * d_row, minlength=num_regions + 1)[1:]
+    mu_cc = np.bincount(pixel_labels, d_col * d_col, minlength=num_regions + 1)[1:]
+    mu_rc = np.bincount(pixel_labels, d_row * d_col, minlength=num_regions + 1)[1:]
+
+    # Inertia tensor of each region, as defined by skimage
+    inertia_tensor = np.empty((num_regions, 2, 2))
+    inertia_tensor[:, 0, 0] = mu_cc / area
+    inertia_tensor[:, 1, 1] = mu_rr / area
+    inertia_tensor[:, 0, 1] = inertia_tensor[:, 1, 0] = -mu_rc / area
+    eigvals = np.clip(np.linalg.eigvalsh(inertia_tensor), 0, None)
+
+    return {
+        "area": area,
+        "centroid-0": centroid_row,
+        "centroid-1": centroid_col,
+        "axis_major_length": 4 * np.sqrt(eigvals[:, 1]),
+        "axis_minor_length": 4 * np.sqrt(eigvals[:, 0]),
+    }
+
+def spans_frame(labels: np.ndarray) -> int:
+    """Return 1 if any labeled region connects the top and bottom, or left and right, edges of the frame."""
+    for first, last in ((labels[0, :], labels[-1, :]), (labels[:, 0], labels[:, -1])):
+        if np.intersect1d(first[first != 0], last[last != 0]).size:
+            return 1
+    return 0
+
 def sia_radial_average(frame: np.ndarray):
-    nx, ny = frame.shape
-    mask = np.ones_like(frame)
-    dists = np.sqrt(np.arange(-1*nx/2, nx/2)[:,None]**2 + np.arange(-1*ny/2, ny/2)[None,:]**2)
-    bins = np.arange(max(nx,ny)/2+1)
-    histo_of_bins = np.histogram(dists[mask==1], bins)[0]
-    h = np.histogram(dists[mask==1], bins, weights=frame[mask==1])[0]
-    return h/histo_of_bins
\ No newline at end of file
+    return radial_average(frame)
+
+def autocorrelation_profiles(frames: np.ndarray, return_images: bool = False, single_precision: bool = False):
+    """
+    Radial profile of the spatial autocorrelation of every frame in a stack (frames x height x width).
+
+    Each frame is normalised to zero mean and unit variance, and its circular autocorrelation
+    is found from one real FFT and one inverse, batched over the whole stack. With
+    single_precision the transforms are done in float32, which is faster but only precise
+    to ~1e-6. If return_images, the (fftshifted) correlation images are returned first.
+    """
+    frames = np.asarray(frames, dtype=np.float32 if single_precision else np.float64)
+    height, width = frames.shape[-2:]
+    frames = (frames - frames.mean(axis=(-2, -1), keepdims=True))/frames.std(axis=(-2, -1), keepdims=True)
+    spectrum = fft.rfft2(frames, workers=-1)
+    power = spectrum.real**2 + spectrum.imag**2
+    images = fft.fftshift(fft.irfft2(power, s=(height, width), workers=-1), axes=(-2, -1))/(height*width)
+    profiles = radial_average(images)
+    if return_images:
+        return images, profiles
+    return profiles
\ No newline at end of file
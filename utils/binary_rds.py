@@ -0,0 +1,209 @@
+"""
+Binary container for reduced data structures (RDS), an alternative to the CSV files.
+
+A file holds one kind of RDS (named like the CSV file it replaces, e.g. "BinarizationData")
+as a sequence of arrays in their native dtype, followed by an index table:
+
+    header   64 bytes: magic, format version, RDS kind
+    arrays   each starting at a multiple of 64 bytes; binarized frames are bit-packed
+    index    one INDEX_DTYPE entry per array: frame (pair), name, dtype, shape, offset
+    footer   24 bytes: offset and number of entries of the index, end magic
+
+Since the index gives the offset of every array, any frame is read (or memory-mapped)
+without reading the rest of the file.
+"""
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+RDS_EXTENSION = ".rds"
+
+_MAGIC = b"BARCODE\x00"
+_END_MAGIC = b"RDSINDEX"
+_VERSION = 1
+_HEADER_SIZE = 64
+_ALIGNMENT = 64
+
+_HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("reserved", "<u4"), ("kind", "S48")])
+_FOOTER_DTYPE = np.dtype([("index_offset", "<u8"), ("num_entries", "<u8"), ("magic", "S8")])
+
+# Arrays of a single frame have stop = -1; arrays of a frame pair (flow fields) have both
+INDEX_DTYPE = np.dtype([
+    ("start", "<i8"),
+    ("stop", "<i8"),
+    ("name", "S16"),
+    ("dtype", "S8"),
+    ("ndim", "u1"),
+    ("packed", "u1"),
+    ("shape", "<i8", (2,)),
+    ("offset", "<u8"),
+])
+
+
+class BinaryRDSWriter:
+    """Appends the arrays of one kind of RDS to a binary container, writing the index on close."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.kind = os.path.splitext(os.path.basename(filename))[0]
+        self._file = open(filename, "wb")
+        header = np.zeros((), dtype=_HEADER_DTYPE)
+        header["magic"], header["version"], header["kind"] = _MAGIC, _VERSION, self.kind.encode()
+        self._file.write(header.tobytes().ljust(_HEADER_SIZE, b"\x00"))
+        self._entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def _align(self) -> int:
+        offset = self._file.tell()
+        padding = -offset % _ALIGNMENT
+        if padding:
+            self._file.write(b"\x00" * padding)
+        return offset + padding
+
+    def write_array(self, start: int, stop: int, name: str, array: np.ndarray, packed: bool = False):
+        """
+        Append a 1-D or 2-D array for frame start (or frame pair start - stop). With packed, the
+        array is stored as one bit per element (nonzero or not), packed along its rows.
+        """
+        array = np.asarray(array)
+        shape = array.shape
+        data = np.packbits(array != 0, axis=-1) if packed else np.ascontiguousarray(array)
+        entry = np.zeros((), dtype=INDEX_DTYPE)
+        entry["start"], entry["stop"], entry["name"] = start, stop, name.encode()
+        entry["dtype"] = data.dtype.str.encode()
+        entry["ndim"], entry["packed"] = len(shape), packed
+        entry["shape"] = tuple(shape) + (1,) * (2 - len(shape))
+        entry["offset"] = self._align()
+        self._file.write(data.tobytes())
+        self._entries.append(entry)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        index_offset = self._align()
+        index = np.array(self._entries, dtype=INDEX_DTYPE)
+        self._file.write(index.tobytes())
+        footer = np.zeros((), dtype=_FOOTER_DTYPE)
+        footer["index_offset"], footer["num_entries"], footer["magic"] = index_offset, len(index), _END_MAGIC
+        self._file.write(footer.tobytes())
+        self._file.close()
+
+
+class BinaryRDSReader:
+    """Random access to the arrays of a binary RDS container, which are memory-mapped on demand."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            header = np.frombuffer(file.read(_HEADER_DTYPE.itemsize), dtype=_HEADER_DTYPE)[0]
+            if header["magic"] != _MAGIC.rstrip(b"\x00"):
+                raise ValueError(f"{filename} is not a binary RDS file")
+            if header["version"] > _VERSION:
+                raise ValueError(f"{filename} has an unsupported RDS format version {header['version']}")
+            self.kind = header["kind"].decode()
+            file.seek(-_FOOTER_DTYPE.itemsize, os.SEEK_END)
+            footer = np.frombuffer(file.read(_FOOTER_DTYPE.itemsize), dtype=_FOOTER_DTYPE)[0]
+            if footer["magic"] != _END_MAGIC:
+                raise ValueError(f"{filename} has no RDS index; it may not have been closed")
+            file.seek(int(footer["index_offset"]))
+            self.index = np.frombuffer(file.read(int(footer["num_entries"]) * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+        self._map = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def frames(self) -> List[Tuple[int, int]]:
+        """Every frame (start, -1) or frame pair (start, stop) in the file, in the order written."""
+        keys = dict.fromkeys(zip(self.index["start"].tolist(), self.index["stop"].tolist()))
+        return list(keys)
+
+    def _entry_array(self, entry: np.void) -> np.ndarray:
+        if self._map is None:
+            self._map = np.memmap(self.filename, dtype=np.uint8, mode="r")
+        dtype = np.dtype(entry["dtype"].decode())
+        shape = tuple(int(dim) for dim in entry["shape"][:entry["ndim"]])
+        if entry["packed"]:
+            stored_shape = shape[:-1] + ((shape[-1] + 7) // 8,)
+        else:
+            stored_shape = shape
+        offset = int(entry["offset"])
+        data = self._map[offset:offset + int(np.prod(stored_shape)) * dtype.itemsize].view(dtype).reshape(stored_shape)
+        if entry["packed"]:
+            return np.unpackbits(data, axis=-1, count=shape[-1])
+        return data
+
+    def get(self, name: str, start: int, stop: int = -1) -> np.ndarray:
+        """The named array of frame start (or frame pair start - stop), read-only and memory-mapped unless bit-packed."""
+        matches = np.flatnonzero((self.index["name"] == name.encode()) & (self.index["start"] == start) & (self.index["stop"] == stop))
+        if len(matches) == 0:
+            raise KeyError(f"No array {name} for frame {start if stop == -1 else (start, stop)} in {self.filename}")
+        return self._entry_array(self.index[matches[0]])
+
+    def arrays(self, name: str) -> List[np.ndarray]:
+        """The named array of every frame, in the order written."""
+        return [self._entry_array(entry) for entry in self.index[self.index["name"] == name.encode()]]
+
+    def frame_keys(self, name: str) -> List[Tuple[int, int]]:
+        """The frame (pair) of every array with this name, in the order written."""
+        entries = self.index[self.index["name"] == name.encode()]
+        return list(zip(entries["start"].tolist(), entries["stop"].tolist()))
+
+
+def read_binarization_rds(reader: BinaryRDSReader) -> Tuple[np.ndarray, list]:
+    """Binarized frames (frames x height x width) and their frame numbers."""
+    frames = reader.arrays("frame")
+    return np.stack(frames).astype(int), [start for start, _ in reader.frame_keys("frame")]
+
+def read_flow_field_rds(reader: BinaryRDSReader) -> Tuple[np.ndarray, list]:
+    """Flow fields (fields x height x width x 2) and their frame pairs."""
+    flow_fields = np.stack([np.stack(pair, axis=-1) for pair in zip(reader.arrays("vx"), reader.arrays("vy"))])
+    return flow_fields, [list(pair) for pair in reader.frame_keys("vx")]
+
+def read_divergence_curl_rds(reader: BinaryRDSReader) -> Tuple[np.ndarray, list]:
+    """Divergence or curl fields (fields x height x width) and their frame pairs."""
+    fields = reader.arrays("field")
+    return (np.stack(fields) if fields else []), [list(pair) for pair in reader.frame_keys("field")]
+
+def read_intensity_distribution_rds(reader: BinaryRDSReader) -> Tuple[list, np.ndarray]:
+    """Intensity distribution of every frame as (bins x 2) [intensity, probability], and their frame numbers."""
+    distributions = [np.stack([values, probabilities], axis=1).astype(float)
+                     for values, probabilities in zip(reader.arrays("intensity"), reader.arrays("probability"))]
+    return distributions, np.array([start for start, _ in reader.frame_keys("intensity")])
+
+def read_correlation_rds(reader: BinaryRDSReader) -> Tuple[list, np.ndarray]:
+    """Correlation profile of every frame (or flow field) as (radii x 2) [r, correlation], and their first frame numbers."""
+    profiles = [np.stack([radii, correlation], axis=1).astype(float)
+                for radii, correlation in zip(reader.arrays("r"), reader.arrays("correlation"))]
+    return profiles, np.array([start for start, _ in reader.frame_keys("r")])
+
+# Reader of each kind of RDS, returning the same structures as the CSV readers of the visualization GUI
+RDS_READERS = {
+    "BinarizationData": read_binarization_rds,
+    "OpticalFlow": read_flow_field_rds,
+    "IntensityDistribution": read_intensity_distribution_rds,
+    "StructuralImageAutocorrelation": read_correlation_rds,
+    "VelocityCorrelation": read_correlation_rds,
+    "Divergence": read_divergence_curl_rds,
+    "Curl": read_divergence_curl_rds,
+}
+
+def read_binary_rds(filename: str):
+    """Read every frame of a binary RDS file into the structures returned by the matching CSV reader."""
+    reader = BinaryRDSReader(filename)
+    if reader.kind not in RDS_READERS:
+        raise ValueError(f"Unknown RDS kind {reader.kind} in {filename}")
+    return RDS_READERS[reader.kind](reader)
@@ -0,0 +1,165 @@
+"""
+Linear-time readers for the CSV reduced data structures (RDS) of binarized frames, flow
+fields, divergence and curl written by visualization.rds.
+
+A file is first scanned for its frame boundaries (the byte range of every block of numeric
+rows and the frame or flow field it belongs to), then the output arrays are preallocated and
+every block is parsed in a single call. The boundaries can be saved to a side-car index next
+to the CSV file, so that later reads skip the scan and a single frame can be loaded on its own:
+
+    python -m utils.csv_rds FILE [FILE ...]
+"""
+
+import argparse
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+INDEX_SUFFIX = ".index.npz"
+
+# One entry per block of numeric rows. Blocks of a single frame have stop = -1; the
+# component is 1 for the Y-direction block of a flow field and 0 otherwise.
+BLOCK_DTYPE = np.dtype([
+    ("start", "<i8"),
+    ("stop", "<i8"),
+    ("component", "<i8"),
+    ("offset", "<u8"),
+    ("length", "<u8"),
+    ("rows", "<i8"),
+    ("cols", "<i8"),
+])
+
+
+def _frame_label(header: str):
+    # "Flow Field (start - stop)" or "Frame start"
+    if header.startswith("Flow Field"):
+        start, stop = header.removeprefix("Flow Field").strip(" ()").split("-")
+        return int(start), int(stop)
+    if header.startswith("Frame"):
+        return int(header.removeprefix("Frame ").split()[0]), -1
+    return None
+
+
+def scan_csv_rds(path: str) -> np.ndarray:
+    """Find the byte range, frame (pair) and size of every block of numeric rows in one pass."""
+    blocks = []
+    start, stop, component = -1, -1, 0
+    block_offset, rows, cols = None, 0, 0
+    offset = 0
+    with open(path, "rb") as file:
+        for line in file:
+            stripped = line.strip()
+            if b"," in stripped:
+                if block_offset is None:
+                    block_offset, rows, cols = offset, 0, stripped.count(b",") + 1
+                rows += 1
+            else:
+                if block_offset is not None:
+                    blocks.append((start, stop, component, block_offset, offset - block_offset, rows, cols))
+                    block_offset = None
+                header = stripped.decode()
+                if header.startswith("X-"):
+                    component = 0
+                elif header.startswith("Y-"):
+                    component = 1
+                elif _frame_label(header) is not None:
+                    (start, stop), component = _frame_label(header), 0
+            offset += len(line)
+    if block_offset is not None:
+        blocks.append((start, stop, component, block_offset, offset - block_offset, rows, cols))
+    return np.array(blocks, dtype=BLOCK_DTYPE)
+
+
+def write_csv_rds_index(path: str) -> np.ndarray:
+    """Scan a CSV RDS file and save its frame boundaries to the side-car index."""
+    blocks = scan_csv_rds(path)
+    stat = os.stat(path)
+    np.savez(path + INDEX_SUFFIX, blocks=blocks, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    return blocks
+
+
+def load_csv_rds_index(path: str) -> np.ndarray:
+    """Frame boundaries of a CSV RDS file, from its side-car index if it is up to date, otherwise by scanning it."""
+    index_path = path + INDEX_SUFFIX
+    if os.path.exists(index_path):
+        stat = os.stat(path)
+        with np.load(index_path) as index:
+            if index["size"] == stat.st_size and index["mtime_ns"] == stat.st_mtime_ns:
+                return index["blocks"]
+    return scan_csv_rds(path)
+
+
+def _parse_block(file, block: np.void) -> np.ndarray:
+    file.seek(int(block["offset"]))
+    data = file.read(int(block["length"]))
+    # Every comma and line break separates two values
+    values = np.fromstring(data.replace(b",", b" ").decode(), sep=" ")
+    return values.reshape(int(block["rows"]), int(block["cols"]))
+
+
+def _read_stack(path: str, blocks: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # Parse every block into the preallocated out[i] (or out[i, ..., component] for flow fields)
+    with open(path, "rb") as file:
+        for i, block in enumerate(blocks):
+            out[i] = _parse_block(file, block)
+    return out
+
+
+def read_binarization_csv(path: str) -> Tuple[np.ndarray, List[int]]:
+    """Binarized frames (frames x height x width) and their frame numbers."""
+    blocks = load_csv_rds_index(path)
+    frames = np.empty((len(blocks),) + _block_shape(blocks), dtype=int)
+    return _read_stack(path, blocks, frames), blocks["start"].tolist()
+
+
+def read_flow_field_csv(path: str) -> Tuple[np.ndarray, List[List[int]]]:
+    """Flow fields (fields x height x width x 2) and their frame pairs."""
+    blocks = load_csv_rds_index(path)
+    x_blocks, y_blocks = blocks[blocks["component"] == 0], blocks[blocks["component"] == 1]
+    flow_fields = np.empty((len(x_blocks),) + _block_shape(blocks) + (2,))
+    _read_stack(path, x_blocks, flow_fields[..., 0])
+    _read_stack(path, y_blocks, flow_fields[..., 1])
+    return flow_fields, [[int(start), int(stop)] for start, stop in zip(x_blocks["start"], x_blocks["stop"])]
+
+
+def read_field_csv(path: str) -> Tuple[np.ndarray, List[List[int]]]:
+    """Divergence or curl fields (fields x height x width) and their frame pairs."""
+    blocks = load_csv_rds_index(path)
+    if len(blocks) == 0:
+        return [], []
+    fields = _read_stack(path, blocks, np.empty((len(blocks),) + _block_shape(blocks)))
+    return fields, [[int(start), int(stop)] for start, stop in zip(blocks["start"], blocks["stop"])]
+
+
+def _block_shape(blocks: np.ndarray) -> Tuple[int, int]:
+    return (int(blocks["rows"][0]), int(blocks["cols"][0])) if len(blocks) else (0, 0)
+
+
+def read_csv_rds_frame(path: str, position: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Load only the frame (or flow field) at a position in the file, as (height x width), or
+    (height x width x 2) for flow fields, with its frame (pair). Uses the side-car index
+    if there is one, otherwise the whole file is scanned.
+    """
+    blocks = load_csv_rds_index(path)
+    frame_blocks = blocks[blocks["component"] == 0]
+    start, stop = frame_blocks["start"][position], frame_blocks["stop"][position]
+    blocks = blocks[(blocks["start"] == start) & (blocks["stop"] == stop)]
+    with open(path, "rb") as file:
+        components = [_parse_block(file, block) for block in np.sort(blocks, order="component")]
+    frame = components[0] if len(components) == 1 else np.stack(components, axis=-1)
+    return frame, (int(start), int(stop))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write side-car frame indexes of CSV reduced data structures.")
+    parser.add_argument("files", nargs="+", help="BinarizationData, OpticalFlow, Divergence or Curl CSV files")
+    args = parser.parse_args()
+    for path in args.files:
+        blocks = write_csv_rds_index(path)
+        print(f"{path}: {len(blocks)} blocks indexed in {path + INDEX_SUFFIX}")
+
+
+if __name__ == "__main__":
+    main()
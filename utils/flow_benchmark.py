@@ -0,0 +1,178 @@
+"""
+Benchmark the optical flow backends on synthetic videos with a known flow.
+
+For each backend, reports the throughput (frame pairs per second), the mean endpoint
+error against the true flow, and the drift of the flow metrics from the default
+Farneback settings. Run with:
+
+    python -m utils.flow_benchmark [--size 512] [--pairs 20]
+
+To validate pre-binned optical flow on a real video, compare the metrics of every
+pre-binning factor to the full resolution flow with:
+
+    python -m utils.flow_benchmark --prebin-report FILE [--config CONFIG.yaml] [--channel 0]
+"""
+
+import argparse
+import time
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from core import BarcodeConfig, OpticalFlowConfig, WriterConfig
+from utils import groupAvg, find_correlation_lengths
+from utils.optical_flow import FLOW_BACKENDS, create_flow_backend, velocity_correlation
+
+
+def _textured_frame(size: int, rng: np.random.Generator) -> np.ndarray:
+    """Smooth random texture spanning most of the 16 bit range, like a fluorescence image."""
+    noise = rng.random((size, size)).astype(np.float32)
+    frame = cv.GaussianBlur(noise, (0, 0), 3)
+    frame = (frame - frame.min()) / (frame.max() - frame.min())
+    return (frame * 60000).astype(np.uint16)
+
+
+def _translation(x: np.ndarray, y: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    return np.full_like(x, 1.5), np.full_like(y, -0.75)
+
+
+def _rotation(x: np.ndarray, y: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    angle = 0.01
+    cx = cy = size / 2
+    return -angle * (y - cy), angle * (x - cx)
+
+
+def _vortices(x: np.ndarray, y: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    k = 2 * np.pi / size * 2
+    return 1.5 * np.sin(k * x) * np.cos(k * y), -1.5 * np.cos(k * x) * np.sin(k * y)
+
+
+SYNTHETIC_FLOWS: Dict[str, Callable] = {
+    "translation": _translation,
+    "rotation": _rotation,
+    "vortices": _vortices,
+}
+
+
+def synthetic_video(flow_name: str, size: int, num_frames: int, seed: int = 0) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Return frames moved by the same known flow at every step, and that flow (size x size x 2)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    u, v = SYNTHETIC_FLOWS[flow_name](x, y, size)
+    true_flow = np.stack([u, v], axis=-1).astype(np.float32)
+
+    frames = [_textured_frame(size, rng)]
+    for _ in range(num_frames - 1):
+        # frame_{t+1}(r) = frame_t(r - flow), so the flow from frame t to t+1 is `flow`
+        frames.append(cv.remap(frames[-1], x - u, y - v, cv.INTER_LINEAR, borderMode=cv.BORDER_REFLECT))
+    return frames, true_flow
+
+
+def flow_metrics(flow: np.ndarray, downsample: int) -> Dict[str, float]:
+    """Per-pair summary of a flow field, computed as in the optical flow branch."""
+    reduced = groupAvg(flow, downsample)
+    speed = np.sqrt(reduced[:, :, 0] ** 2 + reduced[:, :, 1] ** 2)
+    direction = np.arctan2(reduced[:, :, 1], reduced[:, :, 0])
+    _, radial = velocity_correlation(reduced)
+    radial = radial[: reduced.shape[0] // 2]
+    correlation_length = find_correlation_lengths(radial, np.arange(len(radial)) * downsample, 0.5)
+    return {
+        "speed": float(np.mean(speed)),
+        "order": float(np.hypot(np.mean(np.cos(direction)), np.mean(np.sin(direction)))),
+        "correlation_length": float(correlation_length),
+    }
+
+
+def _finite_mean(values: List[float]) -> float:
+    # A uniform flow never decorrelates, so its correlation length is NaN for every pair
+    finite = [value for value in values if not np.isnan(value)]
+    return float(np.mean(finite)) if finite else np.nan
+
+
+def _relative_drift(value: float, reference: float) -> float:
+    if np.isnan(value) or np.isnan(reference):
+        return np.nan if np.isnan(value) != np.isnan(reference) else 0.0
+    return abs(value - reference) / abs(reference) if reference else abs(value)
+
+
+def benchmark(size: int = 512, pairs: int = 20, downsample: int = 8) -> None:
+    print(f"{'flow':<12} {'backend':<22} {'pairs/s':>9} {'EPE [px]':>9} "
+          f"{'speed drift':>12} {'order drift':>12} {'corr. drift':>12}")
+    for flow_name in SYNTHETIC_FLOWS:
+        frames, true_flow = synthetic_video(flow_name, size, pairs + 1)
+        reference = None
+        for backend_name in FLOW_BACKENDS:
+            flow_config = OpticalFlowConfig(flow_backend=backend_name)
+            backend = create_flow_backend(flow_config)
+            start_time = time.perf_counter()
+            flows = [backend.compute(frames[i], frames[i + 1]) for i in range(pairs)]
+            throughput = pairs / (time.perf_counter() - start_time)
+
+            # Ignore a border where flow is undefined for pixels moving in from outside the frame
+            border = 16
+            errors = [np.linalg.norm(flow - true_flow, axis=-1)[border:-border, border:-border] for flow in flows]
+            endpoint_error = float(np.mean(errors))
+            metrics = [flow_metrics(flow, downsample) for flow in flows]
+            mean_metrics = {key: _finite_mean([m[key] for m in metrics]) for key in metrics[0]}
+            if reference is None:
+                # The first backend is the current default, which the others are compared to
+                reference = mean_metrics
+            drift = {key: _relative_drift(mean_metrics[key], reference[key]) for key in mean_metrics}
+            print(f"{flow_name:<12} {backend_name:<22} {throughput:>9.1f} {endpoint_error:>9.3f} "
+                  f"{drift['speed']:>11.1%} {drift['order']:>12.1%} {drift['correlation_length']:>11.1%}")
+
+
+def prebin_report(filepath: str, config: BarcodeConfig, channel: int = 0,
+                  factors: Optional[List[int]] = None) -> None:
+    """
+    Run the optical flow analysis of a file at full resolution and with each pre-binning
+    factor (by default every divisor of the downsampling factor), and print the metrics
+    of each with their relative difference from the full resolution results.
+    """
+    from analysis.optical_flow import analyze_optical_flow
+    from utils.reader import open_frame_source
+
+    flow_config = config.optical_flow_parameters
+    downsample = flow_config.downsample
+    if factors is None:
+        factors = [factor for factor in range(2, downsample + 1) if downsample % factor == 0]
+
+    runs = {}
+    with open_frame_source(filepath) as video:
+        for factor in [1] + factors:
+            start_time = time.perf_counter()
+            results = analyze_optical_flow(video, channel, "", replace(flow_config, prebin_factor=factor),
+                                           config.reader, WriterConfig())
+            runs[factor] = (time.perf_counter() - start_time, dict(zip(results.get_headers(), results.get_data())))
+
+    reference_time, reference = runs[1]
+    print(f"Pre-binned optical flow of {filepath} (channel {channel}, downsample {downsample})")
+    print(f"{'metric':<28} {'full resolution':>16}" + "".join(f" {f'prebin {factor}':>16} {'difference':>11}" for factor in factors))
+    print(f"{'time [s]':<28} {reference_time:>16.2f}" + "".join(
+        f" {runs[factor][0]:>16.2f} {runs[factor][0] / reference_time - 1:>11.1%}" for factor in factors))
+    for key in reference:
+        print(f"{key:<28} {reference[key]:>16.6g}" + "".join(
+            f" {runs[factor][1][key]:>16.6g} {_relative_drift(runs[factor][1][key], reference[key]):>11.1%}"
+            for factor in factors))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the optical flow backends on synthetic flows.")
+    parser.add_argument("--size", type=int, default=512, help="Frame height and width in pixels")
+    parser.add_argument("--pairs", type=int, default=20, help="Number of frame pairs per synthetic flow")
+    parser.add_argument("--downsample", type=int, default=8, help="Downsampling used for the flow metrics")
+    parser.add_argument("--prebin-report", metavar="FILE", help="Compare pre-binned to full resolution flow metrics of a video")
+    parser.add_argument("--config", help="Configuration file with the settings of the pre-binning report")
+    parser.add_argument("--channel", type=int, default=0, help="Channel analysed in the pre-binning report")
+    args = parser.parse_args()
+    if args.prebin_report:
+        config = BarcodeConfig.load_from_yaml(args.config) if args.config else BarcodeConfig()
+        prebin_report(args.prebin_report, config, args.channel)
+    else:
+        benchmark(args.size, args.pairs, args.downsample)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,13 @@ import platform
 import tkinter as tk
 from tkinter import ttk, filedialog
 import matplotlib.pyplot as plt
-from cv2 import calcOpticalFlowFarneback
 import numpy as np
 from matplotlib import colors, cm
 from matplotlib.animation import PillowWriter, ArtistAnimation
 from gui.config import VisualizationConfigGUI, BarcodeConfigGUI, PreviewConfigGUI
 from utils.binarization import binarize
 from utils.intensity_distribution import histogram
+from utils.optical_flow import create_flow_backend, flow_downsample
 from visualization.preview import save_rds_visualization
 from utils import groupAvg, find_analysis_frames
 
@@ -76,11 +76,13 @@ def save_preview_image(preview_config: VisualizationConfigGUI | PreviewConfigGUI
             flow_config = barcode_config.optical_flow_parameters.config
             um_pixel_ratio = barcode_config.reader.um_pixel_ratio.get()
             seconds_per_frame = barcode_config.reader.exposure_time.get()
-            downsample, frame_step, win_size = flow_config.downsample, flow_config.frame_step, flow_config.win_size
+            downsample, frame_step = flow_config.downsample, flow_config.frame_step
             if preview_number + frame_step >= len(frames):
                 frame_step = len(frames) - preview_number - 1
-            frame = calcOpticalFlowFarneback(frames[preview_number], frames[preview_number + frame_step], None, 0.5, 3, win_size, 3, 5, 1.2, 0)
+            frame = create_flow_backend(flow_config).compute(frames[preview_number], frames[preview_number + frame_step])
             frame = frame * um_pixel_ratio / (seconds_per_frame * frame_step)
+            # Flows of pre-binned frames have larger pixels and are already partly downsampled
+            downsample, um_pixel_ratio = flow_downsample(flow_config), um_pixel_ratio * flow_config.prebin_factor
             speeds = np.linalg.norm(frame, axis = -1)
             limits = (0, speeds.max())
         elif rds_type == "Intensity_Distribution":
@@ -164,14 +166,17 @@ def save_preview_video(preview_config: VisualizationConfigGUI | PreviewConfigGUI
             flow_config = barcode_config.optical_flow_parameters.config
             um_pixel_ratio = barcode_config.reader.um_pixel_ratio.get()
             seconds_per_frame = barcode_config.reader.exposure_time.get()
-            downsample, win_size = flow_config.downsample, flow_config.win_size
+            downsample = flow_config.downsample
             indices = find_analysis_frames(preview_frames, flow_config.frame_step)
             indices = [(indices[i], indices[i + 1]) for i in range(len(indices) - 1)]
+            flow_backend = create_flow_backend(flow_config)
             for frame_pair in indices:
-                rds_frame = calcOpticalFlowFarneback(preview_frames[frame_pair[0]], preview_frames[frame_pair[1]], None, 0.5, 3, win_size, 3, 5, 1.2, 0)
+                rds_frame = flow_backend.compute(preview_frames[frame_pair[0]], preview_frames[frame_pair[1]])
                 rds_frame = rds_frame * um_pixel_ratio / (seconds_per_frame * (frame_pair[1] - frame_pair[0]))
                 frames.append(rds_frame)
             frames = np.array(frames)
+            # Flows of pre-binned frames have larger pixels and are already partly downsampled
+            downsample, um_pixel_ratio = flow_downsample(flow_config), um_pixel_ratio * flow_config.prebin_factor
             speeds = np.linalg.norm(frames, axis = -1)
             limits = (0, speeds.max())
         elif rds_type == "Intensity_Distribution":
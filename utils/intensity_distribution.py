@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 import numpy as np
 from utils import flatten
 
@@ -38,6 +39,48 @@ def median_skewness(values: np.ndarray, probabilities: np.ndarray):
     stdev_intensity = stdev(values, probabilities)
     return 3 * (mean_intensity - median_intensity)/stdev_intensity
 
+@dataclass
+class HistogramMoments:
+    """Moments and derived metrics of a set of intensity histograms, one entry per histogram."""
+    mean: np.ndarray
+    stdev: np.ndarray
+    fourth_moment: np.ndarray
+    median: np.ndarray
+    mode: np.ndarray
+    kurtosis: np.ndarray
+    median_skewness: np.ndarray
+    mode_skewness: np.ndarray
+
+def histogram_moments(counts: np.ndarray, values: np.ndarray) -> HistogramMoments:
+    """
+    Moments of every histogram in a (frames x bins) matrix of integer counts (as from
+    histogram_counts), with the matching bin values.
+
+    Gives the same metrics as kurtosis, median_skewness and mode_skewness applied to each
+    normalised histogram, for all histograms at once. Bins with zero counts do not contribute.
+    """
+    rows = np.arange(len(counts))
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore"):
+        probabilities = counts / totals
+    mean = np.sum(values * probabilities, axis=1)
+    deviations_squared = (values - mean[:, None]) ** 2
+    stdev = np.sqrt(np.sum(deviations_squared * probabilities, axis=1))
+    fourth_moment = np.sum(deviations_squared ** 2 * probabilities, axis=1)
+    # The median is the first bin holding half of the pixels, compared in integers so a tie at exactly one half is exact
+    median = values[rows, np.argmax(2 * np.cumsum(counts, axis=1) >= totals, axis=1)]
+    mode = values[rows, np.argmax(counts, axis=1)]
+    return HistogramMoments(
+        mean=mean,
+        stdev=stdev,
+        fourth_moment=fourth_moment,
+        median=median,
+        mode=mode,
+        kurtosis=fourth_moment/(stdev ** 4) - 3,
+        median_skewness=3 * (mean - median)/stdev,
+        mode_skewness=(mean - mode)/stdev,
+    )
+
 def calc_frame_metric(metric, data, bin_number, noise_threshold):
     metric_outputs = []
     for i in range(len(data)):
@@ -57,17 +100,83 @@ def frame_mode(frame: np.ndarray, bin_number: int, noise_threshold: float):
     counts, values = histogram(frame, bin_number, noise_threshold)
     return mode(values, counts)
 
+def saturation_flags(counts: np.ndarray) -> np.ndarray:
+    """Whether the mode of each histogram (frames x bins, counts or probabilities) is its highest intensity bin above the noise threshold."""
+    last_kept = counts.shape[1] - 1 - np.argmax(counts[:, ::-1] > 0, axis=1)
+    return np.argmax(counts, axis=1) == last_kept
+
 def normalize_counts(count): 
     return count / count.sum()
 
 def histogram(frame: np.ndarray, bin_number: int, noise_threshold: float) -> tuple[np.ndarray, np.ndarray]:
+    probabilities, values = histograms(frame[None], bin_number, noise_threshold)
+    kept = probabilities[0] > 0
+    return probabilities[0][kept], values[0][kept]
+
+def histograms(frames: np.ndarray, bin_number: int, noise_threshold: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Normalised intensity histograms of a stack of frames (frames x height x width), all at once.
+
+    Bins are those of histogram_counts. Returns (probabilities, values), both frames x bins.
+    """
+    counts, values = histogram_counts(frames, bin_number, noise_threshold)
+    # A frame with every bin below the noise threshold has an empty (NaN) histogram
+    with np.errstate(invalid="ignore"):
+        return counts / counts.sum(axis=1, keepdims=True), values
+
+def histogram_counts(frames: np.ndarray, bin_number: int, noise_threshold: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Integer intensity histograms of a stack of frames (frames x height x width), all at once.
+
+    With bin_number == 1, every distinct intensity in the stack is a bin, shared by all frames;
+    otherwise each frame has bin_number equal bins spanning its own range (as np.histogram).
+    Bins holding a fraction of the pixels at or below the noise threshold are set to 0.
+    Returns (counts, values), both frames x bins.
+    """
+    num_frames = len(frames)
+    flat = frames.reshape(num_frames, -1)
     if bin_number == 1:
-        values, count = np.unique(frame, return_counts=True)
+        values, indices = _distinct_value_bins(flat)
+        values = np.broadcast_to(values, (num_frames, len(values)))
     else:
-        count, values = np.histogram(frame, bins=bin_number)
-        values = values[0:-1] + (values[1] - values[0])/2
-    count = normalize_counts(count)
-    values = flatten(values[np.argwhere(count > noise_threshold)])
-    count = flatten(count[np.argwhere(count > noise_threshold)])
-    count = normalize_counts(count)
-    return count, values
+        values, indices = _equal_width_bins(flat, bin_number)
+    num_bins = values.shape[1]
+
+    # Offset the bins of each frame so every frame is counted separately by one bincount
+    offsets = np.arange(num_frames)[:, None] * num_bins
+    counts = np.bincount((indices + offsets).ravel(), minlength=num_frames * num_bins).reshape(num_frames, num_bins)
+    counts[counts / counts.sum(axis=1, keepdims=True) <= noise_threshold] = 0
+    return counts, values
+
+def has_small_integer_type(dtype: np.dtype) -> bool:
+    """Whether every intensity of this type has its own bin, without sorting, in distinct value histograms."""
+    return (np.issubdtype(dtype, np.integer) and np.dtype(dtype).itemsize <= 2) or dtype == bool
+
+def _distinct_value_bins(flat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Bins for every intensity between the stack's extremes (8/16 bit integers), or every distinct intensity."""
+    if has_small_integer_type(flat.dtype):
+        low, high = int(flat.min()), int(flat.max())
+        return np.arange(low, high + 1, dtype=flat.dtype), flat.astype(np.intp) - low
+    values = np.unique(flat)
+    return values, np.searchsorted(values, flat)
+
+def _equal_width_bins(flat: np.ndarray, bin_number: int) -> tuple[np.ndarray, np.ndarray]:
+    """Bin centres and bin of every pixel for bin_number equal bins per frame, as np.histogram assigns them."""
+    # Edges are in the frame's float type (float64 for integer frames), computed in the same order as np.histogram
+    edge_type = flat.dtype if np.issubdtype(flat.dtype, np.floating) else np.float64
+    first = flat.min(axis=1).astype(edge_type)
+    last = flat.max(axis=1).astype(edge_type)
+    constant = first == last
+    first[constant] -= 0.5
+    last[constant] += 0.5
+    edges = np.linspace(first, last, bin_number + 1, axis=1, dtype=edge_type)
+
+    indices = ((flat.astype(edge_type) - first[:, None]) / (last - first)[:, None] * bin_number).astype(np.intp)
+    indices[indices == bin_number] -= 1
+    # Correct for rounding so pixels exactly on an edge fall in the same bin as with np.histogram
+    indices[flat < np.take_along_axis(edges, indices, axis=1)] -= 1
+    increment = (flat >= np.take_along_axis(edges, indices + 1, axis=1)) & (indices != bin_number - 1)
+    indices[increment] += 1
+
+    values = edges[:, :-1] + (edges[:, 1:2] - edges[:, 0:1])/2
+    return values, indices
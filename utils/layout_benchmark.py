@@ -0,0 +1,80 @@
+"""
+Benchmark the per-frame cost of the analysis steps on strided and on contiguous channel frames.
+
+A channel sliced out of an interleaved (T, Y, X, C) video is strided, and every consumer
+(OpenCV, the FFTs, groupAvg) makes its own contiguous copy of it. FrameSource.get_frame and
+FrameSource.read_stacks return C-contiguous channels instead. Run with:
+
+    python -m utils.layout_benchmark [--size 512] [--frames 20] [--channels 3]
+"""
+
+import argparse
+import time
+import warnings
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from core import OpticalFlowConfig
+from utils import groupAvg
+from utils.binarization import binarize, autocorrelation_profiles
+from utils.optical_flow import create_flow_backend
+from utils.reader import ArrayFrameSource
+
+
+def _interleaved_video(size: int, num_frames: int, num_channels: int, seed: int = 0) -> np.ndarray:
+    """Random 16 bit (T, Y, X, C) video, laid out like the channel-last arrays of the old loader."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 60000, (num_frames, size, size, num_channels), dtype=np.uint16)
+
+
+def _time_per_frame(step: Callable[[int], object], num_frames: int, repeats: int = 3) -> float:
+    # Best of a few passes over every frame, in milliseconds per frame
+    best = np.inf
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        for t in range(num_frames):
+            step(t)
+        best = min(best, time.perf_counter() - start_time)
+    return 1e3 * best / num_frames
+
+
+def benchmark(size: int = 512, num_frames: int = 20, num_channels: int = 3) -> None:
+    video = _interleaved_video(size, num_frames, num_channels)
+    stacks = ArrayFrameSource(video).read_stacks()
+    backend = create_flow_backend(OpticalFlowConfig())
+    layouts: Dict[str, Callable[[int], np.ndarray]] = {
+        "strided": lambda t: video[t, :, :, 0],
+        "contiguous": lambda t: stacks[t, :, :, 0],
+    }
+    steps: Dict[str, Callable[[Callable[[int], np.ndarray], int], object]] = {
+        "channel copy": lambda frame, t: np.ascontiguousarray(frame(t)),
+        "groupAvg": lambda frame, t: groupAvg(frame(t), 8),
+        "binarize": lambda frame, t: binarize(frame(t), 0.1, 2),
+        "autocorrelation": lambda frame, t: autocorrelation_profiles(frame(t)[None]),
+        "optical flow": lambda frame, t: backend.compute(frame(t - 1), frame(t)),
+    }
+
+    print(f"{size} x {size} frames, {num_channels} channels, {num_frames} frames")
+    print(f"{'step':<16} {'strided [ms]':>13} {'contiguous [ms]':>16} {'speedup':>8}")
+    totals: List[float] = [0.0, 0.0]
+    for step_name, step in steps.items():
+        times = [_time_per_frame(lambda t: step(frame, t), num_frames) for frame in layouts.values()]
+        totals = [total + step_time for total, step_time in zip(totals, times)]
+        print(f"{step_name:<16} {times[0]:>13.3f} {times[1]:>16.3f} {times[0] / times[1]:>7.2f}x")
+    print(f"{'total':<16} {totals[0]:>13.3f} {totals[1]:>16.3f} {totals[0] / totals[1]:>7.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the analysis steps on strided and contiguous channel frames.")
+    parser.add_argument("--size", type=int, default=512, help="Frame height and width in pixels")
+    parser.add_argument("--frames", type=int, default=20, help="Number of frames per channel")
+    parser.add_argument("--channels", type=int, default=3, help="Number of interleaved channels")
+    args = parser.parse_args()
+    # Deprecation warnings of skimage would be repeated for every binarized frame
+    warnings.simplefilter("ignore", FutureWarning)
+    benchmark(args.size, args.frames, args.channels)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,37 @@
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import replace
+from typing import Callable, Dict
+import cv2 as cv
 import numpy as np
+from scipy import fft
+from utils import groupAvg, radial_average
 
 def velocity_correlation(flow_field: np.ndarray):
+    """
+    Correlation of the velocity field with itself for every (dx, dy) shift in [-m/2, m/2) x [-n/2, n/2).
+
+    Each entry is the mean of U(r + d) U(r) + V(r + d) V(r) over the region where the field
+    and its shifted copy overlap, normalised by the mean squared speed. The sums for all
+    shifts are found at once as a cross-correlation, using FFTs zero-padded so shifts do
+    not wrap around.
+    """
     downU, downV = flow_field[:,:,0], flow_field[:,:,1]
     m, n = downU.shape
-    v_mag_squared = downU**2 + downV**2
     cx, cy = m//2, n//2
+    mean_v_mag_squared = np.mean(downU**2 + downV**2)
     correlation_matrix = np.zeros((m, n))
-    for dx in range(-cx, cx):
-        for dy in range(-cy, cy):
-            x_min, x_max = max(-dx, 0), min(m, m - dx)
-            y_min, y_max = max(-dy, 0), min(n, n - dy)
-            vx_r = downU[x_min:x_max, y_min:y_max]
-            vy_r = downV[x_min:x_max, y_min:y_max]
-            vx_shifted = downU[x_min+dx:x_max+dx, y_min+dy:y_max+dy]
-            vy_shifted = downV[x_min+dx:x_max+dx, y_min+dy:y_max+dy]
-            dot_product = vx_shifted * vx_r + vy_shifted * vy_r
-            correlation_value = np.mean(dot_product) / np.mean(v_mag_squared)
-            correlation_matrix[dx + cx, dy + cy] = correlation_value
+
+    padded_shape = (fft.next_fast_len(m + cx, real=True), fft.next_fast_len(n + cy, real=True))
+    spectrum_u = fft.rfft2(downU, s=padded_shape)
+    spectrum_v = fft.rfft2(downV, s=padded_shape)
+    power = spectrum_u * np.conj(spectrum_u) + spectrum_v * np.conj(spectrum_v)
+    shifted_sums = fft.irfft2(power, s=padded_shape)
+
+    dx, dy = np.arange(-cx, cx), np.arange(-cy, cy)
+    dot_product_sums = shifted_sums[np.ix_(dx % padded_shape[0], dy % padded_shape[1])]
+    overlap_sizes = np.outer(m - np.abs(dx), n - np.abs(dy))
+    correlation_matrix[:2*cx, :2*cy] = dot_product_sums / overlap_sizes / mean_v_mag_squared
     radial_correlations = velocity_radial_average(correlation_matrix)
     return correlation_matrix, radial_correlations
 
@@ -53,13 +68,121 @@ def curl(flow_field: np.ndarray, um_pix_ratio: float = 1):
     return c
 
 def velocity_radial_average(frame):
-    nx, ny = frame.shape
-    cx, cy = nx // 2, ny // 2
-    x_coord, y_coord = np.meshgrid(np.arange(-1*nx/2, nx/2), np.arange(-1*ny/2, ny/2), indexing = 'ij')
-    dists = np.sqrt(x_coord ** 2 + y_coord ** 2).flatten()
-    max_dist = int(np.ceil(dists.max()))
-    correlation_mask = frame.flatten()
-    bins = np.arange(max(nx,ny)/2+1)
-    c_histogram = np.histogram(dists, bins = bins, weights = correlation_mask)[0]
-    counts = np.histogram(dists, bins = bins)[0]
-    return c_histogram/counts
\ No newline at end of file
+    return radial_average(frame)
+
+class FlowBackend(ABC):
+    """Computes the dense flow field (height x width x 2) between two frames of a video."""
+
+    # Whether flows for different frame pairs may be computed at the same time
+    supports_threads = True
+
+    @abstractmethod
+    def compute(self, start_frame: np.ndarray, stop_frame: np.ndarray) -> np.ndarray:
+        pass
+
+class FarnebackBackend(FlowBackend):
+    """OpenCV Farneback flow, with the pyramid and iteration parameters of the config."""
+
+    def __init__(self, flow_config):
+        self.params = (flow_config.pyr_scale, flow_config.levels, flow_config.win_size,
+                       flow_config.iterations, flow_config.poly_n, flow_config.poly_sigma)
+
+    def compute(self, start_frame, stop_frame):
+        return cv.calcOpticalFlowFarneback(start_frame, stop_frame, None, *self.params, 0)
+
+class WarmStartFarnebackBackend(FarnebackBackend):
+    """Farneback flow started from the flow of the previous frame pair, so fewer iterations are needed."""
+
+    supports_threads = False
+
+    def __init__(self, flow_config):
+        super().__init__(flow_config)
+        self.previous_flow = None
+
+    def compute(self, start_frame, stop_frame):
+        if self.previous_flow is None or self.previous_flow.shape[:2] != start_frame.shape[:2]:
+            flow = super().compute(start_frame, stop_frame)
+        else:
+            flow = cv.calcOpticalFlowFarneback(start_frame, stop_frame, self.previous_flow.copy(), *self.params,
+                                               cv.OPTFLOW_USE_INITIAL_FLOW)
+        self.previous_flow = flow
+        return flow
+
+class DISBackend(FlowBackend):
+    """OpenCV Dense Inverse Search flow at one of its speed presets. Frames are converted to 8 bit."""
+
+    def __init__(self, flow_config, preset: int):
+        self.preset = preset
+        self._local = threading.local()
+
+    def compute(self, start_frame, stop_frame):
+        # DIS objects keep internal buffers, so each thread needs its own
+        if not hasattr(self._local, "dis"):
+            self._local.dis = cv.DISOpticalFlow_create(self.preset)
+        start_8bit, stop_8bit = to_8bit_pair(start_frame, stop_frame)
+        return self._local.dis.calc(start_8bit, stop_8bit, None)
+
+def to_8bit_pair(start_frame: np.ndarray, stop_frame: np.ndarray):
+    """Scale two frames to 8 bit with a shared intensity range, so their brightness stays comparable."""
+    if start_frame.dtype == np.uint8 and stop_frame.dtype == np.uint8:
+        return start_frame, stop_frame
+    low = min(start_frame.min(), stop_frame.min())
+    high = max(start_frame.max(), stop_frame.max())
+    scale = 255 / (float(high) - float(low)) if high > low else 0
+    return tuple(
+        np.clip((frame.astype(np.float32) - float(low)) * scale, 0, 255).astype(np.uint8)
+        for frame in (start_frame, stop_frame)
+    )
+
+class BinnedFlowBackend(FlowBackend):
+    """
+    Computes flow on frames averaged over prebin_factor x prebin_factor blocks.
+
+    Flows are returned at the binned resolution but in full resolution pixels, so they
+    only need to be downsampled further by downsample / prebin_factor.
+    """
+
+    def __init__(self, backend: FlowBackend, prebin_factor: int):
+        self.backend = backend
+        self.prebin_factor = prebin_factor
+        self.supports_threads = backend.supports_threads
+
+    def compute(self, start_frame, stop_frame):
+        start_binned = groupAvg(start_frame, self.prebin_factor).astype(np.float32)
+        stop_binned = groupAvg(stop_frame, self.prebin_factor).astype(np.float32)
+        return self.backend.compute(start_binned, stop_binned) * self.prebin_factor
+
+# Flow backends selectable with OpticalFlowConfig.flow_backend
+FLOW_BACKENDS: Dict[str, Callable[..., FlowBackend]] = {
+    "farneback": FarnebackBackend,
+    "farneback_warm_start": WarmStartFarnebackBackend,
+    "dis_ultrafast": lambda flow_config: DISBackend(flow_config, cv.DISOPTICAL_FLOW_PRESET_ULTRAFAST),
+    "dis_fast": lambda flow_config: DISBackend(flow_config, cv.DISOPTICAL_FLOW_PRESET_FAST),
+    "dis_medium": lambda flow_config: DISBackend(flow_config, cv.DISOPTICAL_FLOW_PRESET_MEDIUM),
+}
+
+def create_flow_backend(flow_config) -> FlowBackend:
+    """
+    Create the flow backend selected in an OpticalFlowConfig.
+
+    With prebin_factor > 1, flows are computed on binned frames (see BinnedFlowBackend) with
+    the window size scaled down to cover the same area, and should be downsampled with
+    flow_downsample(flow_config) rather than flow_config.downsample.
+    """
+    try:
+        backend = FLOW_BACKENDS[flow_config.flow_backend]
+    except KeyError:
+        raise ValueError(f"Unknown optical flow backend: {flow_config.flow_backend}. "
+                         f"Choose one of {', '.join(FLOW_BACKENDS)}") from None
+    prebin_factor = flow_config.prebin_factor
+    if prebin_factor < 1 or flow_config.downsample % prebin_factor != 0:
+        raise ValueError(f"Pre-binning factor {prebin_factor} must be a divisor of the downsampling "
+                         f"factor {flow_config.downsample}")
+    if prebin_factor == 1:
+        return backend(flow_config)
+    binned_config = replace(flow_config, win_size=max(flow_config.win_size // prebin_factor, 3))
+    return BinnedFlowBackend(backend(binned_config), prebin_factor)
+
+def flow_downsample(flow_config) -> int:
+    """Downsampling left to apply to the flow fields of create_flow_backend(flow_config)."""
+    return flow_config.downsample // flow_config.prebin_factor
@@ -1,17 +1,408 @@
 import os, functools, builtins
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from fractions import Fraction
 from itertools import pairwise
 import nd2, av
-import imageio.v3 as iio
+import tifffile
 import numpy as np
 from utils import vprint
 from core import BarcodeConfig, InputConfig, ChannelResults, BinarizationResults, IntensityResults, FlowResults
 
+@dataclass
+class FrameStatistics:
+    """Minimum, maximum, mean and number of zero pixels of every frame of each channel, shape (T, C)."""
+
+    minimum: np.ndarray
+    maximum: np.ndarray
+    mean: np.ndarray
+    zero_count: np.ndarray
+    pixels_per_frame: int
+
+    @classmethod
+    def collect(cls, source: "FrameSource") -> "FrameStatistics":
+        """Gather the statistics of a video in one pass, decoding one frame at a time."""
+        shape = (source.num_frames, source.num_channels)
+        minimum = np.empty(shape, dtype=source.dtype)
+        maximum = np.empty(shape, dtype=source.dtype)
+        mean = np.empty(shape)
+        zero_count = np.empty(shape, dtype=np.int64)
+        pixels_per_frame = source.height * source.width
+        for t, frame in enumerate(source.iter_frames()):
+            minimum[t] = frame.min(axis=(0, 1))
+            maximum[t] = frame.max(axis=(0, 1))
+            mean[t] = frame.mean(axis=(0, 1))
+            zero_count[t] = pixels_per_frame - np.count_nonzero(frame, axis=(0, 1))
+        return cls(minimum, maximum, mean, zero_count, pixels_per_frame)
+
+    def select(self, channel: int = None) -> "FrameStatistics":
+        """Statistics of a single channel (shape (T, 1)), or of every channel if channel is None."""
+        if channel is None:
+            return self
+        channel_slice = slice(channel, channel + 1)
+        return FrameStatistics(self.minimum[:, channel_slice], self.maximum[:, channel_slice], self.mean[:, channel_slice],
+                               self.zero_count[:, channel_slice], self.pixels_per_frame)
+
+    def is_blank(self) -> bool:
+        """True if every pixel is zero."""
+        return bool(np.all(self.zero_count == self.pixels_per_frame))
+
+    def max(self):
+        """Maximum pixel value over every frame."""
+        return self.maximum.max()
+
+    def is_first_frame_dim(self) -> bool:
+        """Same test as check_first_frame_dim, on the first frame."""
+        return bool(2 * np.exp(-1) * np.mean(self.mean[0]) <= np.min(self.minimum[0]))
+
+
+class FrameSource(ABC):
+    """Random-access reader over a (T, Y, X, C) video that decodes only the frames it is asked for."""
+
+    def __init__(self, filepath: str, shape: tuple[int, int, int, int], dtype: np.dtype):
+        self.filepath = filepath
+        self.shape = tuple(int(dim) for dim in shape)
+        self.dtype = np.dtype(dtype)
+        self._statistics = None
+
+    @property
+    def num_frames(self) -> int:
+        return self.shape[0]
+
+    @property
+    def height(self) -> int:
+        return self.shape[1]
+
+    @property
+    def width(self) -> int:
+        return self.shape[2]
+
+    @property
+    def num_channels(self) -> int:
+        return self.shape[3]
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @abstractmethod
+    def _read_frame(self, t: int) -> np.ndarray:
+        """Decode frame t with all of its channels, shape (Y, X, C)."""
+        pass
+
+    def _read_channel(self, t: int, channel: int) -> np.ndarray:
+        """Decode one channel of frame t as a C-contiguous (Y, X) array."""
+        return np.ascontiguousarray(self._read_frame(t)[:, :, channel])
+
+    def close(self) -> None:
+        """Release the underlying file handle."""
+        pass
+
+    def get_frame(self, t: int, channel: int = None) -> np.ndarray:
+        """
+        Return frame t as (Y, X) for a single channel, or (Y, X, C) if channel is None.
+
+        A single channel is always C-contiguous, so OpenCV, the FFTs and groupAvg do not each
+        make their own copy of a strided slice.
+        """
+        if t < 0:
+            t += self.num_frames
+        if not 0 <= t < self.num_frames:
+            raise IndexError(f"Frame {t} out of range for video with {self.num_frames} frames")
+        return self._read_frame(t) if channel is None else self._read_channel(t, channel)
+
+    def get_frames(self, indices, channel: int = None) -> np.ndarray:
+        """Return the requested frames stacked along a new leading axis."""
+        return np.stack([self.get_frame(t, channel) for t in indices])
+
+    def iter_frames(self, channel: int = None):
+        """Yield every frame in order."""
+        for t in range(self.num_frames):
+            yield self.get_frame(t, channel)
+
+    def read_stacks(self) -> np.ndarray:
+        """
+        Decode the whole video as (T, Y, X, C), stored channel by channel so that every channel
+        [..., c] is a C-contiguous (T, Y, X) stack. Frames are decoded one at a time into the
+        result, so the video is only held in memory once.
+        """
+        stacks = np.empty((self.num_channels, self.num_frames, self.height, self.width), dtype=self.dtype)
+        for t in range(self.num_frames):
+            stacks[:, t] = np.moveaxis(self._read_frame(t), -1, 0)
+        return np.moveaxis(stacks, 0, -1)
+
+    @property
+    def statistics(self) -> FrameStatistics:
+        """
+        Per-frame statistics of every channel, gathered in one pass over the whole video on first
+        use. Only needed for the intensity plot range, so loading and checking a file never
+        triggers it.
+        """
+        if self._statistics is None:
+            self._statistics = FrameStatistics.collect(self)
+        return self._statistics
+
+    def is_blank(self, channel: int = None) -> bool:
+        """True if every pixel of the video (or channel) is zero; stops at the first non-zero frame."""
+        if self._statistics is not None:
+            return self._statistics.select(channel).is_blank()
+        return not any(frame.any() for frame in self.iter_frames(channel))
+
+    def is_dim(self, channel: int = None) -> bool:
+        """True if the first frame of the video (or channel) is too dim to analyse (see check_first_frame_dim)."""
+        if self._statistics is not None:
+            return self._statistics.select(channel).is_first_frame_dim()
+        return bool(check_first_frame_dim(self.get_frames([0], channel)))
+
+    def max(self, channel: int = None):
+        """Maximum pixel value over every frame of the video (or channel)."""
+        return self.statistics.select(channel).max()
+
+
+class ArrayFrameSource(FrameSource):
+    """FrameSource over a video that is already in memory."""
+
+    def __init__(self, array: np.ndarray, filepath: str = ""):
+        array = np.reshape(array, (array.shape + (1,))) if len(array.shape) == 3 else array
+        super().__init__(filepath, array.shape, array.dtype)
+        self.array = array
+
+    def _read_frame(self, t: int) -> np.ndarray:
+        return self.array[t]
+
+
+class TiffFrameSource(FrameSource):
+    """Reads TIFF frames page by page from the first image series."""
+
+    def __init__(self, filepath: str):
+        self._tif = tifffile.TiffFile(filepath)
+        series = self._tif.series[0]
+        shape = series.shape
+        self._frame_shape = shape[1:]
+        self._channels_first = len(shape) == 4 and shape[3] != min(shape)
+        num_pages = len(series.pages)
+        self._array = None
+        self._pages_per_frame = 0
+        if series.dataoffset is not None:
+            # Uncompressed, contiguous data: map it so only the frames read are paged in
+            self._array = tifffile.memmap(filepath, series=0, mode='r')
+        elif num_pages % shape[0] == 0:
+            # Frames are read as whole groups of pages; otherwise fall back to a single full read
+            self._pages_per_frame = num_pages // shape[0]
+        if len(shape) == 3:
+            shape = shape + (1,)
+        elif self._channels_first:
+            shape = (shape[0], shape[2], shape[3], shape[1])
+        super().__init__(filepath, shape, series.dtype)
+
+    def _read_stored_frame(self, t: int) -> np.ndarray:
+        # Frame t in the layout it is stored in
+        if self._pages_per_frame:
+            start = t * self._pages_per_frame
+            frame = self._tif.asarray(series=0, key=range(start, start + self._pages_per_frame))
+            return np.reshape(frame, self._frame_shape)
+        if self._array is None:
+            self._array = self._tif.asarray(series=0)
+        # A copy, so frames stay valid after close() unmaps the file
+        return np.array(self._array[t])
+
+    def _read_frame(self, t: int) -> np.ndarray:
+        frame = self._read_stored_frame(t)
+        if len(self._frame_shape) == 2:
+            return frame[:, :, None]
+        return np.moveaxis(frame, 0, -1) if self._channels_first else frame
+
+    def _read_channel(self, t: int, channel: int) -> np.ndarray:
+        if not self._channels_first:
+            return super()._read_channel(t, channel)
+        if self._pages_per_frame == self.num_channels:
+            # Every channel of a frame is its own page, so only that page is decoded
+            return self._tif.asarray(series=0, key=t * self._pages_per_frame + channel)
+        return np.ascontiguousarray(self._read_stored_frame(t)[channel])
+
+    def close(self) -> None:
+        # Release the mapping with the file; a mapped TIFF stays locked on Windows
+        if isinstance(self._array, np.memmap) and self._array._mmap is not None:
+            self._array._mmap.close()
+        self._array = None
+        self._tif.close()
+
+
+class ND2FrameSource(FrameSource):
+    """Reads ND2 frames one sequence chunk at a time."""
+
+    def __init__(self, filepath: str):
+        self.ndfile = nd2.ND2File(filepath)
+        sizes = self.ndfile.sizes
+        try:
+            if len(sizes) >= 5:
+                raise TypeError("Incorrect file dimensions: file must be time series data with 1+ channels (4 dimensions total)")
+            if "Z" in sizes:
+                raise TypeError('Z-stack identified, skipping to next file...')
+            if 'T' not in sizes or len(self.ndfile.shape) <= 2 or sizes['T'] <= 5:
+                raise TypeError('Too few frames, unable to capture dynamics, skipping to next file...')
+        except TypeError:
+            self.ndfile.close()
+            raise
+        self._has_channels = 'C' in sizes
+        shape = (self.ndfile.shape[0], sizes['Y'], sizes['X'], sizes.get('C', 1))
+        super().__init__(filepath, shape, self.ndfile.dtype)
+
+    def _read_frame(self, t: int) -> np.ndarray:
+        frame = self.ndfile.read_frame(t)
+        return np.moveaxis(frame, 0, -1) if self._has_channels else frame[:, :, None]
+
+    def _read_channel(self, t: int, channel: int) -> np.ndarray:
+        # Frames are stored channel first, so each channel is already contiguous
+        frame = self.ndfile.read_frame(t)
+        return np.ascontiguousarray(frame[channel] if self._has_channels else frame)
+
+    def close(self) -> None:
+        self.ndfile.close()
+
+
+class VideoFrameSource(FrameSource):
+    """Reads grayscale frames from AVI/MP4 files, seeking to the nearest keyframe before each jump."""
+
+    def __init__(self, filepath: str):
+        self.container = av.open(filepath)
+        self.stream = self.container.streams.video[0]
+        self._rate = self.stream.average_rate or self.stream.guessed_rate
+        self._time_base = self.stream.time_base
+        self._start_pts = self.stream.start_time or 0
+        num_frames = self.stream.frames or self._count_frames()
+        self._decoder = None
+        self._next_index = 0
+        super().__init__(filepath, (num_frames, self.stream.height, self.stream.width, 1), np.uint8)
+
+    def _count_frames(self) -> int:
+        count = sum(1 for packet in self.container.demux(self.stream) if packet.size)
+        self.container.seek(0)
+        return count
+
+    def _frame_index(self, frame) -> int:
+        if frame.pts is None or not self._rate or not self._time_base:
+            return None
+        return int(round((frame.pts - self._start_pts) * self._time_base * self._rate))
+
+    def _seek(self, t: int) -> None:
+        if t > 0 and self._rate and self._time_base:
+            target_pts = self._start_pts + int(Fraction(t) / self._rate / self._time_base)
+            self.container.seek(target_pts, stream=self.stream, backward=True, any_frame=False)
+            self._next_index = None
+        else:
+            self.container.seek(0)
+            self._next_index = 0
+        self._decoder = self.container.decode(self.stream)
+
+    def _read_frame(self, t: int) -> np.ndarray:
+        # Decode forward from the current position unless the target lies behind it
+        if self._decoder is None or self._next_index is None or t < self._next_index:
+            self._seek(t)
+        for frame in self._decoder:
+            index = self._frame_index(frame)
+            if index is None:
+                index = self._next_index if self._next_index is not None else 0
+            self._next_index = index + 1
+            if index >= t:
+                return frame.to_ndarray(format='gray')[:, :, None]
+        raise IndexError(f"Unable to decode frame {t} from {self.filepath}")
+
+    def close(self) -> None:
+        self.container.close()
+
+
+def open_frame_source(filepath: str) -> FrameSource:
+    """Open a lazily-read FrameSource for a supported video file."""
+    if filepath.endswith(('.avi', '.mp4')):
+        return VideoFrameSource(filepath)
+    if filepath.endswith(('.tif', '.tiff')):
+        return TiffFrameSource(filepath)
+    if filepath.endswith('.nd2'):
+        return ND2FrameSource(filepath)
+    raise TypeError(f'Unsupported file format: {filepath}')
+
+def get_nd2_metadata(ndfile: nd2.ND2File) -> tuple[float, float]:
+    """Frame interval (seconds) and micron to pixel ratio from ND2 metadata."""
+    times = ndfile.events(orient="list")["Time [s]"]
+    frame_interval = np.array([y - x for x, y in pairwise(times)]).mean()
+    micron_pix_ratio = ndfile.voxel_size()[0]
+    return frame_interval, micron_pix_ratio
+
+def read_nd2_metadata(ndfile: nd2.ND2File, config: BarcodeConfig, in_config: InputConfig):
+    try:
+        frame_interval, micron_pix_ratio = get_nd2_metadata(ndfile)
+        config.reader.exposure_time = float(frame_interval / in_config.time)
+        config.reader.um_pixel_ratio = micron_pix_ratio / in_config.length
+        vprint(f"Extracted ND2 metadata: frame_interval={frame_interval:.4f}s, micron_pixel_ratio={micron_pix_ratio:.2f}")
+    except Exception as e:
+        config.reader.exposure_time = 1
+        config.reader.um_pixel_ratio = 1
+        vprint(f"Warning: Could not extract ND2 metadata: {e}")
+
 def check_first_frame_dim(file):
     min_intensity = np.min(file[0])
     mean_intensity = np.mean(file[0])
     return 2 * np.exp(-1) * mean_intensity <= min_intensity
 
-def read_file(filepath, count_list, config: BarcodeConfig = None, in_config: InputConfig = None, accept_dim: bool = False, allow_large_files = True):
+@dataclass
+class FileProbe:
+    """Container metadata and first-frame checks for a file, gathered without decoding the video."""
+
+    filepath: str
+    size_bytes: int = 0
+    shape: tuple = ()
+    dtype: str = ""
+    sizes: dict = field(default_factory=dict)
+    frame_interval: float = np.nan
+    um_pixel_ratio: float = np.nan
+    is_dim: bool = False
+    rejection: str = ""
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.rejection
+
+    @property
+    def workload(self) -> int:
+        """Number of pixels in the video, used to weight progress estimates."""
+        return int(np.prod(self.shape)) if self.shape else 0
+
+def probe_file(filepath: str, accept_dim: bool = False, allow_large_files: bool = True) -> FileProbe:
+    """Read a file's dimensions and metadata and decode only its first frame."""
+    probe = FileProbe(filepath=filepath, size_bytes=os.path.getsize(filepath))
+    if probe.size_bytes / (1024 ** 3) > 5 and not allow_large_files:
+        probe.rejection = "File size is too large -- this program does not process files larger than 5 GB."
+        return probe
+    try:
+        with open_frame_source(filepath) as source:
+            probe.shape, probe.dtype = source.shape, str(source.dtype)
+            probe.sizes = dict(zip("TYXC", source.shape))
+            if isinstance(source, ND2FrameSource):
+                probe.sizes = dict(source.ndfile.sizes)
+                try:
+                    probe.frame_interval, probe.um_pixel_ratio = get_nd2_metadata(source.ndfile)
+                except Exception:
+                    pass
+            first_frame = source.get_frames([0])
+    except TypeError as e:
+        probe.rejection = str(e)
+        return probe
+    except Exception as e:
+        probe.rejection = f"Unable to read file: {e}"
+        return probe
+
+    probe.is_dim = bool(check_first_frame_dim(first_frame))
+    if probe.is_dim and not accept_dim:
+        probe.rejection = "File is too dim"
+    return probe
+
+def read_file(filepath, count_list, config: BarcodeConfig = None, in_config: InputConfig = None, accept_dim: bool = False, allow_large_files = True) -> FrameSource:
     print = functools.partial(builtins.print, flush=True)
     
     if count_list[1] != 1:    
@@ -24,52 +415,23 @@ def read_file(filepath, count_list, config: BarcodeConfig = None, in_config: Inp
     if file_size_gb > 5 and not allow_large_files:
         print("File size is too large -- this program does not process files larger than 5 GB.")
         return None
-    if filepath.endswith(('.avi', '.mp4')):
-        frames = []
-        container = av.open(filepath)
-        for frame in container.decode(video=0):
-            frames.append(frame.to_ndarray(format='gray'))
-        file = np.array(frames)
-        file = np.reshape(file, (file.shape + (1,))) if len(file.shape) == 3 else file
-    if filepath.endswith(('.tif', '.tiff')):
-        file = iio.imread(filepath)
-        file = np.reshape(file, (file.shape + (1,))) if len(file.shape) == 3 else file
-        if file.shape[3] != min(file.shape):
-            file = np.swapaxes(np.swapaxes(file, 1, 2), 2, 3)
-    elif filepath.endswith('.nd2'):
-        with nd2.ND2File(filepath) as ndfile:
-            if len(ndfile.sizes) >= 5:
-                count_list[0] += 1
-                raise TypeError("Incorrect file dimensions: file must be time series data with 1+ channels (4 dimensions total)")
-            if "Z" in ndfile.sizes:
-                count_list[0] += 1
-                raise TypeError('Z-stack identified, skipping to next file...')
-            if 'T' not in ndfile.sizes or len(ndfile.shape) <= 2 or ndfile.sizes['T'] <= 5:
-                count_list[0] += 1
-                raise TypeError('Too few frames, unable to capture dynamics, skipping to next file...')
-            if ndfile == None:
-                raise TypeError('Unable to read file, skipping to next file...')
-            file = ndfile.asarray()
-            if 'C' not in ndfile.sizes:
-                file = np.expand_dims(file, axis=1)
-            file = np.swapaxes(np.swapaxes(file, 1, 2), 2, 3)
-            try:
-                times = ndfile.events(orient="list")["Time [s]"]
-                frame_interval = np.array([y - x for x, y in pairwise(times)]).mean()
-                micron_pix_ratio = ndfile.voxel_size()[0]
-                config.reader.exposure_time = float(frame_interval / in_config.time)
-                config.reader.um_pixel_ratio = micron_pix_ratio / in_config.length
-                vprint(f"Extracted ND2 metadata: frame_interval={frame_interval:.4f}s, micron_pixel_ratio={micron_pix_ratio:.2f}")
-            except Exception as e:
-                config.reader.exposure_time = 1
-                config.reader.um_pixel_ratio = 1
-                vprint(f"Warning: Could not extract ND2 metadata: {e}")
-    if (file == 0).all():
+    try:
+        file = open_frame_source(filepath)
+    except TypeError:
+        if filepath.endswith('.nd2'):
+            count_list[0] += 1
+        raise
+    if isinstance(file, ND2FrameSource):
+        read_nd2_metadata(file.ndfile, config, in_config)
+
+    if file.is_blank():
         print('Empty file: can not process, skipping to next file...')
+        file.close()
         return None
     
-    if accept_dim == False and check_first_frame_dim(file) == True:
+    if accept_dim == False and file.is_dim():
         print(filepath + 'is too dim, skipping to next file...')
+        file.close()
         return None
     else:
         return file
@@ -0,0 +1,91 @@
+"""
+Deferred rendering of the figures saved by the analysis.
+
+Inside deferred_rendering(), render_figure() only records the plot function and its
+arguments (arrays and metadata), and a pool of processes renders and saves the figures
+while the analysis goes on. Matplotlib then never runs in the analysis process, so its
+memory cannot build up there. Outside of it, figures are rendered immediately.
+"""
+
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from utils import restore_standard_streams, write_error_log
+
+
+@dataclass
+class PlotPayload:
+    """A plot function and the arguments it draws, which can be rendered in another process."""
+    function: Callable
+    args: tuple
+
+    def draw(self, ax=None):
+        return self.function(*self.args, ax=ax)
+
+
+class FigureRenderer:
+    """
+    Renders figures in a process pool, with at most 4 * workers payloads waiting so the
+    arrays they hold do not pile up. Failures are written to the error log.
+    """
+
+    def __init__(self, workers: int, fail_file_loc: Optional[str] = None):
+        self.fail_file_loc = fail_file_loc
+        # Render workers must not write to the GUI's log window they inherit
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=restore_standard_streams)
+        self._max_pending = 4 * workers
+        self._pending = deque()
+        # Start the workers now, before the analysis starts any threads of its own
+        self._executor.submit(int).result()
+
+    def submit(self, function: Callable, *args):
+        self._pending.append((function, self._executor.submit(function, *args)))
+        while len(self._pending) > self._max_pending:
+            self._collect(*self._pending.popleft())
+
+    def _collect(self, function: Callable, future):
+        try:
+            future.result()
+        except Exception as e:
+            message = f"Figure: {function.__name__}, Exception: {str(e)}\n"
+            details = "".join(traceback.format_exception(e))
+            if self.fail_file_loc:
+                write_error_log(self.fail_file_loc, details, message)
+            else:
+                print(details + message)
+
+    def close(self):
+        """Wait until every figure is rendered and stop the pool."""
+        while self._pending:
+            self._collect(*self._pending.popleft())
+        self._executor.shutdown()
+
+
+_renderer: Optional[FigureRenderer] = None
+
+
+@contextmanager
+def deferred_rendering(workers: int, fail_file_loc: Optional[str] = None):
+    """Render the figures of render_figure() in a pool of workers processes (inline if workers < 1)."""
+    global _renderer
+    if workers < 1 or _renderer is not None:
+        yield
+        return
+    _renderer = FigureRenderer(workers, fail_file_loc)
+    try:
+        yield
+    finally:
+        renderer, _renderer = _renderer, None
+        renderer.close()
+
+
+def render_figure(function: Callable, *args):
+    """Call function(*args), which saves a figure, in the render pool if there is one, otherwise now."""
+    if _renderer is None:
+        function(*args)
+    else:
+        _renderer.submit(function, *args)
@@ -1,5 +1,9 @@
 import os, csv
 from typing import List, Tuple
+from utils.reader import FileProbe, probe_file
+from utils.binary_rds import BinaryRDSWriter, RDS_EXTENSION
+from utils.background_writer import BackgroundRDSWriter
+from core import WriterConfig
 
 def remove_extension(path: str) -> str:
     return os.path.splitext(path)[0]
@@ -33,21 +37,43 @@ def find_files(path: str) -> List[str]:
                 files.append(os.path.join(dirpath, filename))
     return sorted(files)
 
+def build_file_manifest(path: str, accept_dim: bool = False, allow_large_files: bool = True) -> List[FileProbe]:
+    """Probe every file found under path, recording its dimensions and whether it will be rejected."""
+    return [probe_file(filepath, accept_dim, allow_large_files) for filepath in find_files(path)]
+
 def setup_csv_writer(filename: str):
     """Setup CSV writer and file handle."""
     myfile = open(filename, "w")
     csvwriter = csv.writer(myfile)
     return csvwriter, myfile
 
+def setup_rds_writer(filename: str, out_config: WriterConfig):
+    """
+    Setup the writer and file handle of a reduced data structure, as CSV or as a binary container,
+    written on a background thread if out_config.background_rds_writes.
+    """
+    if out_config.rds_format == "binary":
+        rds_writer = BinaryRDSWriter(remove_extension(filename) + RDS_EXTENSION)
+        rds_file = rds_writer
+    elif out_config.rds_format == "csv":
+        rds_writer, rds_file = setup_csv_writer(filename)
+    else:
+        raise ValueError(f"Unknown reduced data structure format: {out_config.rds_format}")
+    if out_config.background_rds_writes:
+        rds_writer = rds_file = BackgroundRDSWriter(rds_writer, rds_file)
+    return rds_writer, rds_file
+
 def setup_paths(root_dir: str, is_single_file: bool):
-    """Setup filepaths for data and output files."""
+    """Setup filepaths for data and output files. Every run output is saved in base_path."""
 
     base_path = root_dir if not is_single_file else os.path.dirname(root_dir)
     base_name = remove_extension(os.path.basename(root_dir))
     ff_name = "Error Log.txt" if not is_single_file else f"{base_name} Error Log.txt"
     time_name = "Time.txt" if not is_single_file else f"{base_name} Time.txt"
+    manifest_name = "Manifest.csv" if not is_single_file else f"{base_name} Manifest.csv"
     ff_filepath = os.path.join(base_path, ff_name)
     time_filepath = os.path.join(base_path, time_name)
+    manifest_filepath = os.path.join(base_path, manifest_name)
     open(ff_filepath, "w").close()
 
-    return base_path, base_name, ff_filepath, time_filepath
\ No newline at end of file
+    return base_path, base_name, ff_filepath, time_filepath, manifest_filepath
\ No newline at end of file
@@ -34,7 +34,12 @@ class Timer:
     def _log_time_since(self, _time: float, message: str = "") -> str:
         """Log a message with the time elapsed since a given time."""
         current_time = time.time()
-        elapsed_time = current_time - _time
+        log_message = self.log_duration(current_time - _time, message)
+        self.last_log_time = current_time
+        return log_message
+
+    def log_duration(self, elapsed_time: float, message: str = "") -> str:
+        """Log a message with a duration measured elsewhere (e.g. in a worker process)."""
         elapsed_time_str = get_time_as_string(elapsed_time)
 
         log_message = f"{message}: {elapsed_time_str}" if message else elapsed_time_str
@@ -43,7 +48,6 @@ class Timer:
         # Import vprint locally to avoid circular import
         from utils import vprint
         vprint(log_message)
-        self.last_log_time = current_time
 
         return log_message
 
@@ -55,6 +59,16 @@ class Timer:
         """Log the time elapsed since the timer started."""
         return self._log_time_since(self.start_time, message)
 
+    def log_estimated_time_remaining(self, fraction_complete: float) -> str:
+        """Print the time left, extrapolated from the time elapsed for the completed fraction of work."""
+        if fraction_complete <= 0:
+            return ""
+        elapsed_time = time.time() - self.start_time
+        remaining_time = elapsed_time * (1 - fraction_complete) / fraction_complete
+        message = f"Estimated Time Remaining: {get_time_as_string(remaining_time)} ({100 * fraction_complete:.0f}% complete)"
+        print(message, flush=True)
+        return message
+
     def stop(self):
         """Stop the timer and close the log file."""
         self.end_time = time.time()
@@ -0,0 +1,101 @@
+"""
+Check and benchmark the FFT velocity correlation against the per-shift loop it replaced.
+
+The parity check compares both on random float64 and float32 flow fields of several sizes
+(including odd and non-square ones) and fails if they differ; the benchmark then times both
+for square fields of increasing size. Run with:
+
+    python -m utils.velocity_correlation_benchmark [--sizes 32 64 128 256] [--repeats 3]
+"""
+
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from utils.optical_flow import velocity_correlation, velocity_radial_average
+
+# Field sizes of the parity check
+PARITY_SIZES: List[Tuple[int, int]] = [(1, 1), (2, 3), (7, 5), (16, 16), (33, 20), (64, 64)]
+# Largest difference allowed from the loop, relative to the largest correlation. The loop
+# accumulates float32 fields in float32, while the FFTs always compute in float64.
+PARITY_TOLERANCE = {np.float64: 1e-12, np.float32: 1e-5}
+
+
+def loop_velocity_correlation(flow_field: np.ndarray):
+    """The velocity correlation as computed before the FFT version, one (dx, dy) shift at a time."""
+    downU, downV = flow_field[:,:,0], flow_field[:,:,1]
+    m, n = downU.shape
+    v_mag_squared = downU**2 + downV**2
+    cx, cy = m//2, n//2
+    correlation_matrix = np.zeros((m, n))
+    for dx in range(-cx, cx):
+        for dy in range(-cy, cy):
+            x_min, x_max = max(-dx, 0), min(m, m - dx)
+            y_min, y_max = max(-dy, 0), min(n, n - dy)
+            vx_r = downU[x_min:x_max, y_min:y_max]
+            vy_r = downV[x_min:x_max, y_min:y_max]
+            vx_shifted = downU[x_min+dx:x_max+dx, y_min+dy:y_max+dy]
+            vy_shifted = downV[x_min+dx:x_max+dx, y_min+dy:y_max+dy]
+            dot_product = vx_shifted * vx_r + vy_shifted * vy_r
+            correlation_value = np.mean(dot_product) / np.mean(v_mag_squared)
+            correlation_matrix[dx + cx, dy + cy] = correlation_value
+    radial_correlations = velocity_radial_average(correlation_matrix)
+    return correlation_matrix, radial_correlations
+
+
+def _random_flow_field(shape: Tuple[int, int], dtype: type, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=shape + (2,)).astype(dtype)
+
+
+def check_parity(sizes: List[Tuple[int, int]] = PARITY_SIZES) -> None:
+    """Raise an AssertionError if the FFT and loop correlations of any size or dtype differ."""
+    print(f"{'size':<10} {'dtype':<8} {'matrix diff':>12} {'radial diff':>12}")
+    for dtype, tolerance in PARITY_TOLERANCE.items():
+        for shape in sizes:
+            flow_field = _random_flow_field(shape, dtype)
+            matrix, radial = velocity_correlation(flow_field)
+            loop_matrix, loop_radial = loop_velocity_correlation(flow_field)
+            scale = max(np.max(np.abs(loop_matrix)), 1.0)
+            matrix_diff = np.max(np.abs(matrix - loop_matrix)) / scale
+            radial_diff = np.nanmax(np.abs(radial - loop_radial), initial=0) / scale
+            print(f"{f'{shape[0]}x{shape[1]}':<10} {np.dtype(dtype).name:<8} {matrix_diff:>12.2e} {radial_diff:>12.2e}")
+            assert matrix.shape == loop_matrix.shape and np.array_equal(np.isnan(radial), np.isnan(loop_radial)), \
+                f"{shape} {np.dtype(dtype).name}: output layout differs from the loop"
+            assert matrix_diff <= tolerance and radial_diff <= tolerance, \
+                f"{shape} {np.dtype(dtype).name}: differs from the loop by {max(matrix_diff, radial_diff):.2e}"
+    print("FFT velocity correlation matches the loop")
+
+
+def _best_time(function: Callable[[], object], repeats: int) -> float:
+    best = np.inf
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def benchmark(sizes: List[int], repeats: int = 3) -> None:
+    print(f"{'size':<10} {'loop [s]':>10} {'FFT [s]':>10} {'speedup':>9}")
+    for size in sizes:
+        flow_field = _random_flow_field((size, size), np.float32)
+        # The loop takes seconds for the largest fields, so it is only timed once
+        loop_time = _best_time(lambda: loop_velocity_correlation(flow_field), 1)
+        fft_time = _best_time(lambda: velocity_correlation(flow_field), repeats)
+        print(f"{f'{size}x{size}':<10} {loop_time:>10.4f} {fft_time:>10.4f} {loop_time / fft_time:>8.0f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the FFT velocity correlation against the per-shift loop and time both.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64, 128, 256], help="Side lengths of the timed square fields")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of timed runs of the FFT correlation per size")
+    args = parser.parse_args()
+    check_parity()
+    benchmark(args.sizes, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
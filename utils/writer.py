@@ -5,7 +5,7 @@ import numpy as np
 from typing import Dict, List, Optional, TypeAlias, TypeVar
 
 from core import ChannelResults, ResultsBase, Metrics, sort_channel_results_by_metric
-from utils.reader import read_csv_to_channel_results
+from utils.reader import FileProbe, read_csv_to_channel_results
 from visualization.barcode import generate_combined_barcode, generate_comparison_barcodes
 from core.config import ComparisonConfig
 
@@ -73,6 +73,17 @@ def results_to_csv(
     return quantified
 
 
+def manifest_to_csv(manifest: List[FileProbe], output_filepath: str) -> None:
+    """Write the probed dimensions and rejection reason of each file to a CSV file."""
+    headers = ["File", "Size (bytes)", "Frames", "Height", "Width", "Channels", "Data Type", "Dim", "Rejection"]
+    with open(output_filepath, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(headers)
+        for probe in manifest:
+            dims = list(probe.shape) if probe.shape else [""] * 4
+            writer.writerow([probe.filepath, probe.size_bytes, *dims, probe.dtype, int(probe.is_dim), probe.rejection])
+
+
 def generate_aggregate_csv(
     csv_files: List[str],
     output_csv: str,
@@ -8,6 +8,7 @@ from matplotlib.axes import Axes
 from matplotlib import colors
 import matplotlib.cm as cm
 from utils.intensity_distribution import histogram, mean
+from utils.render import PlotPayload
 
 def save_binarization_visualization(original_frame: np.ndarray, binarized_frame: np.ndarray, frame_idx: int, name: str):
     compare_fig, comp_axs = plt.subplots(ncols = 2, figsize=(10, 5))
@@ -59,8 +60,11 @@ def save_flow_field_visualization(flow, start_frame: int, end_frame: int, name:
     fig.savefig(figpath)
     plt.close('all')
 
-def save_intensity_plots(first_frame, last_frame, bin_number, noise_threshold, last_frame_idx, max_intensity) -> plt.Figure:
-    fig, ax = plt.subplots(figsize = (7, 7))
+def save_intensity_plots(first_frame, last_frame, bin_number, noise_threshold, last_frame_idx, max_intensity, ax: Axes = None) -> plt.Figure:
+    if ax is None:
+        fig, ax = plt.subplots(figsize = (7, 7))
+    else:
+        fig = ax.figure
     i_count, i_bins = histogram(first_frame, bin_number, noise_threshold)
     f_count, f_bins = histogram(last_frame, bin_number, noise_threshold)
     i_mean = mean(i_bins, i_count)
@@ -78,8 +82,11 @@ def save_intensity_plots(first_frame, last_frame, bin_number, noise_threshold, l
     ax.legend()
     return fig
 
-def save_binarization_plots(void_percent_gain_list: np.ndarray, island_percent_gain_list: np.ndarray, num_frames: int, frame_step: int) -> plt.Figure:
-    fig, ax = plt.subplots(figsize = (7, 7))
+def save_binarization_plots(void_percent_gain_list: np.ndarray, island_percent_gain_list: np.ndarray, num_frames: int, frame_step: int, ax: Axes = None) -> plt.Figure:
+    if ax is None:
+        fig, ax = plt.subplots(figsize = (7, 7))
+    else:
+        fig = ax.figure
     stop_index = len(void_percent_gain_list)
     plot_range = np.arange(0, stop_index * frame_step, frame_step)
     plot_range[-1] = num_frames - 1 if stop_index * frame_step >= num_frames else stop_index * frame_step
@@ -93,24 +100,16 @@ def save_binarization_plots(void_percent_gain_list: np.ndarray, island_percent_g
     ax.legend()
     return fig
 
-def create_summary_visualization(figures: List[plt.Figure], output_path: str) -> None:
-    """Create combined summary plot from analysis figures."""
-    if not figures or all([fig == None for fig in figures]):
+def create_summary_visualization(plots: List[PlotPayload], output_path: str) -> None:
+    """Create combined summary plot, drawing each analysis plot side by side on its own axes."""
+    plots = [plot for plot in plots if plot is not None]
+    if not plots:
         return
 
-    num_figs = len(figures)
-    fig = plt.figure(figsize=(7 * num_figs, 7))
-
-    for i, source_fig in enumerate(figures):
-        ax = source_fig.axes[0]
-        ax.figure = fig
-        fig.add_axes(ax)
-        if num_figs == 2:
-            # Position axes side by side
-            if i == 0:
-                ax.set_position([1.5 / 10, 1 / 10, 4 / 5, 4 / 5])
-            else:
-                ax.set_position([11.5 / 10, 1 / 10, 4 / 5, 4 / 5])
+    num_figs = len(plots)
+    fig, axs = plt.subplots(ncols=num_figs, figsize=(7 * num_figs, 7), squeeze=False)
+    for plot, ax in zip(plots, axs[0]):
+        plot.draw(ax)
 
     plt.savefig(output_path)
     plt.close(fig)
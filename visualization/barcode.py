@@ -1,12 +1,21 @@
 import csv
+import shutil
 from itertools import compress
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
-from typing import List
+from PIL import Image
+from typing import List, Optional
 from core.results import ChannelResults
 from core.metrics import Units, get_data_limits
 
+# Above this many rows, barcodes are written directly as images instead of drawn in a figure
+RASTER_BARCODE_ROWS = 1000
+# Size in pixels of every row and every metric of a raster barcode, and the rows of each page
+RASTER_ROW_HEIGHT = 5
+RASTER_COLUMN_WIDTH = 40
+RASTER_ROWS_PER_PAGE = 2000
+
 def check_limits(limit, thresh):
     if thresh < limit[0]:
         limit[0] = thresh
@@ -37,7 +46,120 @@ def add_units(metric):
              'Mean Flow Direction': directional_unit, 'Flow Directional Spread': directional_unit}
     return metric + units[metric]
 
-def generate_comparison_barcodes(results_list: List[List[ChannelResults]], figpaths: List[str], separate_channels: bool = False):
+def colormap_lut(cmap: mpl.colors.Colormap) -> np.ndarray:
+    """
+    RGB colors (uint8) of a colormap: its N colors followed by its under, over and bad colors,
+    converted to bytes the way Matplotlib does when it saves an image.
+    """
+    colors = np.vstack([cmap(np.arange(cmap.N)), cmap.get_under(), cmap.get_over(), cmap.get_bad()])
+    return (colors[:, :3] * 255).astype(np.uint8)
+
+def colormap_indices(normed: np.ndarray, n: int) -> np.ndarray:
+    """Index into colormap_lut of normalized values, chosen as by Colormap.__call__ (NaN is the bad color)."""
+    scaled = np.array(normed, dtype=float) * n
+    scaled[scaled == n] = n - 1
+    mask_under = scaled < 0
+    mask_over = scaled >= n
+    mask_bad = np.isnan(scaled)
+    with np.errstate(invalid="ignore"):
+        indices = scaled.astype(np.intp)
+    indices[mask_under] = n
+    indices[mask_over] = n + 1
+    indices[mask_bad] = n + 2
+    return indices
+
+def _add_colorbar(fig, cax, norm, cmap, label: str):
+    cbar = fig.colorbar(
+        mpl.cm.ScalarMappable(norm=norm, cmap=cmap),
+        cax=cax,
+        orientation="vertical",
+    )
+    cbar.set_label(label, size=7)
+    cbar.formatter.set_powerlimits((-2, 2))
+    cbar.ax.tick_params(labelsize=6)
+
+def save_barcode_figure(data: np.ndarray, norms: list, cmap, labels: List[str], width: float, figpath: str):
+    """Draw the barcode of data (rows x metrics) above one colorbar per metric in a single figure."""
+    num_metrics = len(labels)
+
+    # Set up figure dimensions
+    height = 9 * int(len(data) / 40) if len(data) > 40 else 9
+    fig = plt.figure(figsize=(width, height), dpi=300)
+
+    if height == 9:
+        height_ratio = [5, 2]
+    else:
+        height_ratio = [int(2 / 5 * height), 1]
+
+    gs = fig.add_gridspec(
+        nrows=2, ncols=num_metrics * 8, height_ratios=height_ratio
+    )
+
+    # Create barcode array
+    barcode = np.repeat(
+        np.expand_dims(np.zeros_like(data), axis=2), 4, axis=2
+    )
+
+    # Fill barcode with colors and create colorbars
+    for idx in range(num_metrics):
+        norm = norms[idx]
+        barcode[:, idx] = cmap(norm(data[:, idx]))
+        _add_colorbar(fig, fig.add_subplot(gs[1, 8 * idx : 8 * idx + 1]), norm, cmap, labels[idx])
+
+    plt.subplots_adjust(wspace=1, hspace=0.05)
+
+    # Create main barcode visualization
+    barcode_ax = fig.add_subplot(gs[0, :])
+    barcode_image = np.repeat(barcode, 5, axis=0)  # Make bars more visible
+
+    barcode_ax.imshow(barcode_image, aspect="auto")
+    barcode_ax.axis("off")
+
+    # Save figure
+    fig.savefig(figpath, bbox_inches="tight", pad_inches=0)
+    plt.close("all")
+
+def save_barcode_legend(norms: list, cmap, labels: List[str], figpath: str):
+    """Draw the colorbar of every metric, as below a barcode figure, on their own."""
+    num_metrics = len(labels)
+    fig = plt.figure(figsize=(num_metrics, 2.5), dpi=300)
+    gs = fig.add_gridspec(nrows=1, ncols=num_metrics * 8)
+    for idx in range(num_metrics):
+        _add_colorbar(fig, fig.add_subplot(gs[0, 8 * idx : 8 * idx + 1]), norms[idx], cmap, labels[idx])
+    plt.subplots_adjust(wspace=1)
+    fig.savefig(figpath, bbox_inches="tight")
+    plt.close("all")
+
+def save_raster_barcode(data: np.ndarray, norms: list, lut: np.ndarray, figpath: str,
+                        rows_per_page: int = RASTER_ROWS_PER_PAGE) -> List[str]:
+    """
+    Write the barcode of data (rows x metrics) directly as images, each row RASTER_ROW_HEIGHT and
+    each metric RASTER_COLUMN_WIDTH pixels, in pages of at most rows_per_page rows. figpath has
+    no extension; with several pages, they are numbered. Returns the paths written.
+    """
+    n = len(lut) - 3
+    num_pages = max(1, -(-len(data) // rows_per_page))
+    paths = []
+    for page in range(num_pages):
+        rows = data[page * rows_per_page : (page + 1) * rows_per_page]
+        indices = np.column_stack([colormap_indices(norm(rows[:, idx]), n) for idx, norm in enumerate(norms)])
+        page_image = lut.take(indices, axis=0)
+        page_image = np.repeat(np.repeat(page_image, RASTER_ROW_HEIGHT, axis=0), RASTER_COLUMN_WIDTH, axis=1)
+        path = f"{figpath}.png" if num_pages == 1 else f"{figpath} (Page {page + 1} of {num_pages}).png"
+        Image.fromarray(page_image).save(path)
+        paths.append(path)
+    return paths
+
+def _use_raster(num_rows: int, raster: Optional[bool]) -> bool:
+    return num_rows > RASTER_BARCODE_ROWS if raster is None else raster
+
+def generate_comparison_barcodes(results_list: List[List[ChannelResults]], figpaths: List[str], separate_channels: bool = False,
+                                 raster: Optional[bool] = None):
+    """
+    Generate barcodes of several result sets with shared color limits. With raster (by default,
+    when a set has more than RASTER_BARCODE_ROWS rows), the barcodes are written directly as
+    images and the colorbars, which are the same for every barcode, are drawn once into a legend.
+    """
     if not results_list:
         return
 
@@ -73,6 +195,16 @@ def generate_comparison_barcodes(results_list: List[List[ChannelResults]], figpa
     norms = [mpl.colors.Normalize(vmin=limit[0], vmax=limit[1]) for limit in overall_limits]
     cmap = plt.get_cmap("plasma")
     cmap.set_bad("black")
+    labels = [format_header_with_units(headers[idx], units[idx]) for idx in range(num_metrics)]
+
+    raster = _use_raster(max(len(results) for results in results_list), raster)
+    if raster:
+        lut = colormap_lut(cmap)
+        legend_path = f"{figpaths[0]} Legend.png"
+        save_barcode_legend(norms, cmap, labels, legend_path)
+        # The limits are shared, so every barcode gets a copy of the same legend
+        for figpath in figpaths[1:]:
+            shutil.copyfile(legend_path, f"{figpath} Legend.png")
 
     for results, figpath in zip(results_list, figpaths):
         unique_channels = np.unique([result.channel for result in results])
@@ -84,11 +216,11 @@ def generate_comparison_barcodes(results_list: List[List[ChannelResults]], figpa
         
         for channel in unique_channels:
             if separate_channels:
-                channel_figpath = f"{figpath} (Channel {int(channel)}).png"
+                channel_figpath = f"{figpath} (Channel {int(channel)})"
                 channel_mask = channels == channel
                 filtered_data = data[channel_mask]
             else:
-                channel_figpath = f"{figpath}.png"
+                channel_figpath = figpath
                 channel_mask = np.isin(channels, unique_channels)
                 filtered_data = data[channel_mask]
 
@@ -99,54 +231,10 @@ def generate_comparison_barcodes(results_list: List[List[ChannelResults]], figpa
             if len(filtered_data.shape) == 1:
                 filtered_data = filtered_data.reshape(1, -1)
 
-            # Set up figure dimensions
-            height = 9 * int(len(filtered_data) / 40) if len(filtered_data) > 40 else 9
-            fig = plt.figure(figsize=(15, height), dpi=300)
-
-            if height == 9:
-                height_ratio = [5, 2]
+            if raster:
+                save_raster_barcode(filtered_data, norms, lut, channel_figpath)
             else:
-                height_ratio = [int(2 / 5 * height), 1]
-
-            gs = fig.add_gridspec(
-                nrows=2, ncols=num_metrics * 8, height_ratios=height_ratio
-            )
-
-            # Create barcode array
-            barcode = np.repeat(
-                np.expand_dims(np.zeros_like(filtered_data), axis=2), 4, axis=2
-            )
-
-            # Fill barcode with colors and create colorbars
-            for idx in range(num_metrics):
-                norm = norms[idx]
-                barcode[:, idx] = cmap(norm(filtered_data[:, idx]))
-
-                # Create colorbar
-                norm_ax = fig.add_subplot(gs[1, 8 * idx : 8 * idx + 1])
-                cbar = norm_ax.figure.colorbar(
-                    mpl.cm.ScalarMappable(norm=norm, cmap=cmap),
-                    cax=norm_ax,
-                    orientation="vertical",
-                )
-
-                # Use structured units for labeling
-                cbar.set_label(format_header_with_units(headers[idx], units[idx]), size=7)
-                cbar.formatter.set_powerlimits((-2, 2))
-                cbar.ax.tick_params(labelsize=6)
-
-            plt.subplots_adjust(wspace=1, hspace=0.05)
-
-            # Create main barcode visualization
-            barcode_ax = fig.add_subplot(gs[0, :])
-            barcode_image = np.repeat(barcode, 5, axis=0)  # Make bars more visible
-
-            barcode_ax.imshow(barcode_image, aspect="auto")
-            barcode_ax.axis("off")
-
-            # Save figure
-            fig.savefig(channel_figpath, bbox_inches="tight", pad_inches=0)
-            plt.close("all")
+                save_barcode_figure(filtered_data, norms, cmap, labels, 15, f"{channel_figpath}.png")
 
             if not separate_channels:
                 break
@@ -158,6 +246,7 @@ def generate_combined_barcode(
     separate_channels: bool = True,
     physical_units: bool = False,
     metrics_to_visualize: List[bool] = None,
+    raster: Optional[bool] = None,
 ) -> None:
     """
     Generate barcode visualization from structured ChannelResults.
@@ -167,6 +256,8 @@ def generate_combined_barcode(
         figpath: Base path for output figures (without extension)
         sort_metric: Optional metric name to sort results by
         separate_channels: If True, create separate figures per channel
+        raster: If True, write the barcodes directly as images (paged for many rows) with the
+            colorbars in a separate legend; by default, only for more than RASTER_BARCODE_ROWS results
     """
     if not results:
         return
@@ -215,15 +306,22 @@ def generate_combined_barcode(
     norms = [mpl.colors.Normalize(vmin=limit[0], vmax=limit[1]) for limit in limits]
     cmap = plt.get_cmap("plasma")
     cmap.set_bad("black")
+    labels = [format_header_with_units(headers[idx], units[idx]) for idx in range(num_metrics)]
+
+    # The limits are shared by every channel, so a raster barcode has a single legend
+    raster = _use_raster(len(data), raster)
+    if raster:
+        lut = colormap_lut(cmap)
+        save_barcode_legend(norms, cmap, labels, f"{figpath} Legend.png")
 
     # Generate visualizations
     for channel in unique_channels:
         if separate_channels:
-            channel_figpath = f"{figpath} (Channel {int(channel)}).png"
+            channel_figpath = f"{figpath} (Channel {int(channel)})"
             channel_mask = channels == channel
             filtered_data = data[channel_mask]
         else:
-            channel_figpath = f"{figpath}.png"
+            channel_figpath = figpath
             channel_mask = np.isin(channels, unique_channels)
             filtered_data = data[channel_mask]
 
@@ -234,54 +332,10 @@ def generate_combined_barcode(
         if len(filtered_data.shape) == 1:
             filtered_data = filtered_data.reshape(1, -1)
 
-        # Set up figure dimensions
-        height = 9 * int(len(filtered_data) / 40) if len(filtered_data) > 40 else 9
-        fig = plt.figure(figsize=(num_metrics, height), dpi=300)
-
-        if height == 9:
-            height_ratio = [5, 2]
+        if raster:
+            save_raster_barcode(filtered_data, norms, lut, channel_figpath)
         else:
-            height_ratio = [int(2 / 5 * height), 1]
-
-        gs = fig.add_gridspec(
-            nrows=2, ncols=num_metrics * 8, height_ratios=height_ratio
-        )
-
-        # Create barcode array
-        barcode = np.repeat(
-            np.expand_dims(np.zeros_like(filtered_data), axis=2), 4, axis=2
-        )
-
-        # Fill barcode with colors and create colorbars
-        for idx in range(num_metrics):
-            norm = norms[idx]
-            barcode[:, idx] = cmap(norm(filtered_data[:, idx]))
-
-            # Create colorbar
-            norm_ax = fig.add_subplot(gs[1, 8 * idx : 8 * idx + 1])
-            cbar = norm_ax.figure.colorbar(
-                mpl.cm.ScalarMappable(norm=norm, cmap=cmap),
-                cax=norm_ax,
-                orientation="vertical",
-            )
-
-            # Use structured units for labeling
-            cbar.set_label(format_header_with_units(headers[idx], units[idx]), size=7)
-            cbar.formatter.set_powerlimits((-2, 2))
-            cbar.ax.tick_params(labelsize=6)
-
-        plt.subplots_adjust(wspace=1, hspace=0.05)
-
-        # Create main barcode visualization
-        barcode_ax = fig.add_subplot(gs[0, :])
-        barcode_image = np.repeat(barcode, 5, axis=0)  # Make bars more visible
-
-        barcode_ax.imshow(barcode_image, aspect="auto")
-        barcode_ax.axis("off")
-
-        # Save figure
-        fig.savefig(channel_figpath, bbox_inches="tight", pad_inches=0)
-        plt.close("all")
+            save_barcode_figure(filtered_data, norms, cmap, labels, num_metrics, f"{channel_figpath}.png")
 
         if not separate_channels:
-            break
\ No newline at end of file
+            break
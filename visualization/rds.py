@@ -1,16 +1,31 @@
 import csv
 import numpy as np
+from utils.binary_rds import BinaryRDSWriter
+from utils.background_writer import BackgroundRDSWriter
 
 def write_binarization_rds(csvwriter, frame_data: np.ndarray, frame_idx: int):
     """Write binarized frame data to CSV."""
     if not csvwriter:
         return
+    if isinstance(csvwriter, BackgroundRDSWriter):
+        csvwriter.submit(write_binarization_rds, frame_data, frame_idx)
+        return
+    if isinstance(csvwriter, BinaryRDSWriter):
+        csvwriter.write_array(frame_idx, -1, "frame", frame_data, packed=True)
+        return
     csvwriter.writerow([f'Frame {str(frame_idx)}'])
     csvwriter.writerows(frame_data)
     csvwriter.writerow([])
     return
 
 def write_flow_field_rds(csvwriter, vx_data: np.ndarray, vy_data: np.ndarray, start_index: int, stop_index: int):
+    if isinstance(csvwriter, BackgroundRDSWriter):
+        csvwriter.submit(write_flow_field_rds, vx_data, vy_data, start_index, stop_index)
+        return
+    if isinstance(csvwriter, BinaryRDSWriter):
+        csvwriter.write_array(start_index, stop_index, "vx", vx_data.astype(np.float32))
+        csvwriter.write_array(start_index, stop_index, "vy", vy_data.astype(np.float32))
+        return
     csvwriter.writerow([f"Flow Field ({start_index} - {stop_index})"])
     csvwriter.writerow(["X-Direction"])
     csvwriter.writerows(vx_data)
@@ -19,6 +34,13 @@ def write_flow_field_rds(csvwriter, vx_data: np.ndarray, vy_data: np.ndarray, st
     return
 
 def write_intensity_distribution_rds(csvwriter, frame_intensities: np.ndarray, frame_probabilities: np.ndarray, frame_idx: int):
+    if isinstance(csvwriter, BackgroundRDSWriter):
+        csvwriter.submit(write_intensity_distribution_rds, frame_intensities, frame_probabilities, frame_idx)
+        return
+    if isinstance(csvwriter, BinaryRDSWriter):
+        csvwriter.write_array(frame_idx, -1, "intensity", frame_intensities)
+        csvwriter.write_array(frame_idx, -1, "probability", frame_probabilities)
+        return
     csvwriter.writerow([f'Frame {frame_idx}'])
     csvwriter.writerow(frame_intensities)
     csvwriter.writerow(frame_probabilities)
@@ -26,6 +48,14 @@ def write_intensity_distribution_rds(csvwriter, frame_intensities: np.ndarray, f
     return
 
 def write_correlation_rds(csvwriter, frame_pair: tuple[int, int] | int, xvalues: list[float], radial_average_lst: list[float]):
+    if isinstance(csvwriter, BackgroundRDSWriter):
+        csvwriter.submit(write_correlation_rds, frame_pair, xvalues, radial_average_lst)
+        return
+    if isinstance(csvwriter, BinaryRDSWriter):
+        start, stop = frame_pair if isinstance(frame_pair, tuple) else (frame_pair, -1)
+        csvwriter.write_array(start, stop, "r", np.asarray(xvalues, dtype=float))
+        csvwriter.write_array(start, stop, "correlation", np.asarray(radial_average_lst, dtype=float))
+        return
     if isinstance(frame_pair, tuple):
         frame_pair_str = f"Flow Field {frame_pair[0]}-{frame_pair[1]} Velocity Correlation"
         correlation_label = 'C(v(r))'
@@ -39,6 +69,12 @@ def write_correlation_rds(csvwriter, frame_pair: tuple[int, int] | int, xvalues:
     return
 
 def write_divergence_curl_rds(csvwriter, frame_pair: tuple[int, int], field_data: np.ndarray):
+    if isinstance(csvwriter, BackgroundRDSWriter):
+        csvwriter.submit(write_divergence_curl_rds, frame_pair, field_data)
+        return
+    if isinstance(csvwriter, BinaryRDSWriter):
+        csvwriter.write_array(frame_pair[0], frame_pair[1], "field", field_data.astype(np.float32))
+        return
     csvwriter.writerow([f"Flow Field ({frame_pair[0]} - {frame_pair[1]})"])
     csvwriter.writerows(field_data)
     csvwriter.writerow([])